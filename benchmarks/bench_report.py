@@ -0,0 +1,236 @@
+# benchmarks/bench_report.py
+"""
+レポート処理のスループット・ピークメモリのベンチマーク。
+
+ce_synthetic.SyntheticCostExplorer で数万～数十万グループ・複数ページ・複数期間の
+get_cost_and_usage レスポンスを生成し、集計・整形・カード作成の各処理を計測する。
+AWS にはアクセスしないため、オフラインで実行できる。
+
+また、サービスごとの費用の1行を辞書・ServiceCost (__slots__)・CostRowStore (列の配列) で
+保持した場合の1行あたりのメモリ (row_memory.*) を計測する。
+
+計測結果は benchmarks/baseline.json と比較し、スループットの低下またはメモリの
+増加が許容範囲を超えた場合や、ベースラインにない項目がある場合は終了コード 1 で終了する。
+
+使い方:
+    python benchmarks/bench_report.py                    # ベースラインと比較
+    python benchmarks/bench_report.py --update-baseline  # ベースラインを更新
+    python benchmarks/bench_report.py --quick            # 小さいシナリオのみ
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import tracemalloc
+from typing import List, Dict, Any, Callable
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+import cost_report  # noqa: E402
+import renderer  # noqa: E402
+import ce_scheduler  # noqa: E402
+from cost_records import ServiceCost  # noqa: E402
+from ce_synthetic import SyntheticCostExplorer  # noqa: E402
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+PAGE_SIZE = 5000
+REPEAT = 3
+# スループットは実行環境の差が大きいため、メモリより許容幅を広くとる
+THROUGHPUT_TOLERANCE = 0.5
+MEMORY_TOLERANCE = 0.25
+MEMORY_SLACK_KIB = 64
+
+# (シナリオ名, 1期間あたりのグループ数, 月数)
+SCENARIOS = [
+    ("10k_groups_1_month", 10_000, 1),
+    ("100k_groups_1_month", 100_000, 1),
+    ("120k_groups_12_months", 10_000, 12),
+]
+QUICK_SCENARIOS = SCENARIOS[:1]
+# 複数のメトリクスを1つのリクエストで取得する場合の計測に使うメトリクス
+MULTI_METRICS = ("AmortizedCost", "UnblendedCost", "NetAmortizedCost", "UsageQuantity")
+# 1行あたりのメモリを計測する行数と、行に現れるサービス名の種類数
+ROW_MEMORY_ROWS = 100_000
+ROW_MEMORY_DISTINCT_NAMES = 500
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+def period_for(months: int) -> Dict[str, str]:
+    end_year, end_month = divmod(months, 12)
+    return {"Start": "2024-01-01", "End": f"{2024 + end_year}-{end_month + 1:02d}-01"}
+
+
+def measure(func: Callable[[], Any], items: int) -> Dict[str, float]:
+    """
+    func の最短実行時間からスループットを、tracemalloc でピークメモリを計測する。
+    """
+    best = float("inf")
+    for _ in range(REPEAT):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": round(best, 6),
+        "groups_per_sec": round(items / best, 1),
+        "peak_kib": round(peak / 1024, 1),
+    }
+
+
+def run_scenario(group_count: int, months: int) -> Dict[str, Dict[str, float]]:
+    """
+    1シナリオ分の各処理を計測する。
+    """
+    period = period_for(months)
+    fake = SyntheticCostExplorer(group_count=group_count, page_size=PAGE_SIZE)
+    # 偽のクライアントにはレート上限がないため、スケジューラによる待機は行わない
+    scheduler = ce_scheduler.RequestScheduler(rate_per_second=1e9, burst=10**6)
+    explorer = cost_report.CostExplorer(fake, scheduler=scheduler)
+    request = explorer._build_request(period, include_credit=True, group_by_dimensions=["SERVICE"])
+    items = group_count * months
+
+    # 集計・整形処理はレスポンス生成を含めずに計測するため、事前に全ページを作成しておく
+    pages = [result for response in fake.iter_responses(**request) for result in response["ResultsByTime"]]
+    service_costs = list(explorer.get_service_costs(pages))
+    multi_explorer = cost_report.CostExplorer(fake, scheduler=scheduler, metrics=MULTI_METRICS)
+    multi_request = multi_explorer._build_request(period, include_credit=True, group_by_dimensions=["SERVICE"])
+    multi_pages = [
+        result for response in fake.iter_responses(**multi_request) for result in response["ResultsByTime"]
+    ]
+    section = cost_report.build_cost_section(explorer, pages, True, "01/01", "12/31")
+    report = {"title": "AWSアカウント 123456789012", "sections": [section, section]}
+
+    def consume_service_costs() -> None:
+        for _ in explorer.get_service_costs(pages):
+            pass
+
+    return {
+        "get_total_cost": measure(lambda: [explorer.get_total_cost(page) for page in pages], items),
+        "get_service_costs": measure(consume_service_costs, items),
+        "format_service_costs": measure(lambda: cost_report.format_service_costs(service_costs), items),
+        "build_cost_section": measure(
+            lambda: cost_report.build_cost_section(explorer, pages, True, "01/01", "12/31"), items
+        ),
+        "build_cost_section.multi_metric": measure(
+            lambda: cost_report.build_cost_section(multi_explorer, multi_pages, True, "01/01", "12/31"), items
+        ),
+        "handle_cost_report": measure(
+            lambda: cost_report.handle_cost_report(explorer, period, True, "01/01", "12/31"), items
+        ),
+        "render_teams_card": measure(lambda: renderer.TeamsCardRenderer().render(report), items),
+    }
+
+
+def measure_row_memory(rows: int = ROW_MEMORY_ROWS) -> Dict[str, Dict[str, float]]:
+    """
+    サービスごとの費用の行を保持したときの1行あたりのメモリ (バイト) を計測する。
+
+    レスポンスの JSON を読み込んだ場合と同じく、サービス名は行ごとに別の文字列として作る。
+    """
+    def build_dicts() -> List[Dict[str, Any]]:
+        return [{"service_name": f"Service {i % ROW_MEMORY_DISTINCT_NAMES:06d}", "billing": i * 0.01}
+                for i in range(rows)]
+
+    def build_records() -> List[ServiceCost]:
+        return [ServiceCost(f"Service {i % ROW_MEMORY_DISTINCT_NAMES:06d}", i * 0.01) for i in range(rows)]
+
+    def build_table() -> cost_report.CostRowStore:
+        table = cost_report.CostRowStore(["SERVICE"])
+        for i in range(rows):
+            table.append([f"Service {i % ROW_MEMORY_DISTINCT_NAMES:06d}"], i * 0.01)
+        return table
+
+    results = {}
+    for kind, build in (("dict", build_dicts), ("slots", build_records), ("columns", build_table)):
+        gc.collect()
+        tracemalloc.start()
+        retained = build()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del retained
+        results[f"row_memory.{kind}"] = {"bytes_per_row": round(current / rows, 1)}
+    return results
+
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any]) -> List[str]:
+    """
+    ベースラインと比較し、許容範囲を超えた項目の説明を返す。ベースラインにない項目も
+    比較できないため含める (追加したシナリオは --update-baseline で記録する)。
+    """
+    regressions = []
+    for key, current in results.items():
+        expected = baseline.get(key)
+        if expected is None:
+            regressions.append(f"{key}: no baseline (run with --update-baseline)")
+            continue
+        if "bytes_per_row" in current:
+            max_bytes = expected["bytes_per_row"] * (1 + MEMORY_TOLERANCE)
+            if current["bytes_per_row"] > max_bytes:
+                regressions.append(f"{key}: {current['bytes_per_row']:.1f} bytes/row > {max_bytes:.1f}")
+            continue
+        min_throughput = expected["groups_per_sec"] * (1 - THROUGHPUT_TOLERANCE)
+        if current["groups_per_sec"] < min_throughput:
+            regressions.append(
+                f"{key}: throughput {current['groups_per_sec']:.0f} groups/s < {min_throughput:.0f}"
+            )
+        max_peak = expected["peak_kib"] * (1 + MEMORY_TOLERANCE) + MEMORY_SLACK_KIB
+        if current["peak_kib"] > max_peak:
+            regressions.append(f"{key}: peak memory {current['peak_kib']:.0f} KiB > {max_peak:.0f} KiB")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="レポート処理のベンチマーク")
+    parser.add_argument("--update-baseline", action="store_true", help="計測結果でベースラインを更新する")
+    parser.add_argument("--quick", action="store_true", help="小さいシナリオのみ実行する")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="ベースラインの JSON ファイル")
+    args = parser.parse_args()
+
+    results: Dict[str, Any] = {}
+    for name, group_count, months in (QUICK_SCENARIOS if args.quick else SCENARIOS):
+        for operation, metrics in run_scenario(group_count, months).items():
+            key = f"{name}/{operation}"
+            results[key] = metrics
+            print(f"{key:50s} {metrics['groups_per_sec']:>14,.0f} groups/s {metrics['peak_kib']:>12,.1f} KiB")
+    for key, metrics in measure_row_memory().items():
+        results[key] = metrics
+        print(f"{key:50s} {metrics['bytes_per_row']:>14,.1f} bytes/row")
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline updated: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Baseline not found: {args.baseline} (run with --update-baseline)")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        regressions = compare(results, json.load(f))
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,76 @@
+# benchmarks/load_test.py
+"""
+Cost Explorer のローカルスタンドイン (src/ce_stub_server.py) に対するレポート処理の負荷試験。
+
+実際の boto3 クライアントで HTTP・botocore のシリアライズ・ページング・スロットリングを
+経由して main() を繰り返し実行し、1回あたりの処理時間とフェーズごとの時間を出力する。
+AWS にはアクセスしないため、オフラインで実行できる。
+
+使い方:
+    python benchmarks/load_test.py --groups 100000 --page-size 5000 --latency 0.2 --runs 5
+"""
+import io
+import os
+import sys
+import json
+import argparse
+import statistics
+import contextlib
+from typing import List, Dict, Any
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT_DIR, "src"))
+
+import cost_report  # noqa: E402
+from ce_stub_server import LocalCostExplorerServer  # noqa: E402
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "USE_TEAMS_POST": "no",
+    })
+    server = LocalCostExplorerServer(
+        group_count=args.groups,
+        page_size=args.page_size,
+        latency_seconds=args.latency,
+        max_calls_per_second=args.max_calls_per_second
+    )
+    summaries: List[Dict[str, Any]] = []
+    with server:
+        os.environ["CE_ENDPOINT_URL"] = server.url
+        os.environ["STS_ENDPOINT_URL"] = server.url
+        for _ in range(args.runs):
+            with contextlib.redirect_stdout(io.StringIO()):
+                summaries.append(cost_report.main())
+
+    totals = [summary["total_ms"] for summary in summaries]
+    phases = sorted({name for summary in summaries for name in summary["phases"]})
+    return {
+        "runs": args.runs,
+        "groups": args.groups,
+        "server": server.stats,
+        "total_ms": {"median": round(statistics.median(totals), 3), "max": round(max(totals), 3)},
+        "phase_median_ms": {
+            name: round(statistics.median(
+                s["phases"][name]["duration_ms"] for s in summaries if name in s["phases"]
+            ), 3)
+            for name in phases
+        },
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="ローカルスタンドインに対するレポート処理の負荷試験")
+    parser.add_argument("--groups", type=int, default=10_000, help="1期間あたりのグループ数")
+    parser.add_argument("--page-size", type=int, default=5000, help="1ページあたりのグループ数")
+    parser.add_argument("--latency", type=float, default=0.05, help="応答ごとの遅延 (秒)")
+    parser.add_argument("--max-calls-per-second", type=float, default=None, help="スロットリングする呼び出しレート")
+    parser.add_argument("--runs", type=int, default=3, help="main() の実行回数")
+    print(json.dumps(run(parser.parse_args()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
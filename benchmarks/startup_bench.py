@@ -0,0 +1,141 @@
+# benchmarks/startup_bench.py
+"""
+Lambda ハンドラ (sam/app/app.py) の起動時間ベンチマーク。
+
+新しい Python プロセスでモジュールを読み込み、コールドスタート (1回目) と
+ウォームスタート (2回目) のハンドラ呼び出し時間を計測する。boto3 は最初の
+クライアント作成時まで読み込まれないため、その読み込み時間は boto3_load_ms として
+別に出力する。cold_overlap_ms はコールドスタート時に STS と Cost Explorer の呼び出しが
+並行して重なった時間。AWS へのアクセスは botocore の Stubber で置き換えるため、オフラインで実行できる。
+
+使い方:
+    python benchmarks/startup_bench.py --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+from typing import List, Dict, Any
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(ROOT_DIR, "sam", "app")
+
+# 1回分の計測を行う子プロセスのスクリプト
+CHILD_SCRIPT = r"""
+import io
+import sys
+import json
+import time
+import contextlib
+
+started = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import app
+imported = time.perf_counter()
+
+from botocore.stub import Stubber
+
+CE_RESPONSE = {
+    "ResultsByTime": [{
+        "TimePeriod": {"Start": "2024-12-01", "End": "2024-12-28"},
+        "Total": {},
+        "Groups": [
+            {"Keys": ["Amazon EC2", "Usage"], "Metrics": {"AmortizedCost": {"Amount": "100.0", "Unit": "USD"}}},
+            {"Keys": ["Amazon EC2", "Credit"], "Metrics": {"AmortizedCost": {"Amount": "-10.0", "Unit": "USD"}}},
+        ],
+        "Estimated": True,
+    }]
+}
+# 遅延読み込みされる boto3 の読み込み時間 (コールドスタート時のみ発生する)
+boto3_started = time.perf_counter()
+real_client = app.boto3.client
+boto3_loaded = time.perf_counter()
+
+
+def stubbed_client(service_name, *args, **kwargs):
+    client = real_client(service_name, *args, **kwargs)
+    stubber = Stubber(client)
+    if service_name == "ce":
+        for _ in range(2):
+            stubber.add_response("get_cost_and_usage", CE_RESPONSE)
+    else:
+        stubber.add_response(
+            "get_caller_identity",
+            {"UserId": "AIDA", "Account": "123456789012", "Arn": "arn:aws:iam::123456789012:user/bench"}
+        )
+    stubber.activate()
+    return client
+
+
+app.boto3.client = stubbed_client
+timings = []
+with contextlib.redirect_stdout(io.StringIO()):
+    for _ in range(2):
+        invoke_started = time.perf_counter()
+        result = app.lambda_handler({}, None)
+        result["invoke_ms"] = (time.perf_counter() - invoke_started) * 1000
+        timings.append(result)
+
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "boto3_load_ms": (boto3_loaded - boto3_started) * 1000,
+    "cold": timings[0],
+    "warm": timings[1],
+}))
+"""
+
+
+def run_once() -> Dict[str, Any]:
+    """
+    新しいプロセスで1回分の計測を行う。
+    """
+    env = {
+        "PATH": os.environ.get("PATH", ""),
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "USE_TEAMS_POST": "no",
+    }
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, APP_DIR],
+        env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarize(runs: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    各計測値の中央値・最小値・最大値をまとめる。
+    """
+    metrics = {
+        "import_ms": [r["import_ms"] for r in runs],
+        "boto3_load_ms": [r["boto3_load_ms"] for r in runs],
+        "cold_init_ms": [r["cold"]["init_ms"] for r in runs],
+        "cold_invoke_ms": [r["cold"]["invoke_ms"] for r in runs],
+        "warm_init_ms": [r["warm"]["init_ms"] for r in runs],
+        "warm_invoke_ms": [r["warm"]["invoke_ms"] for r in runs],
+        "cold_overlap_ms": [r["cold"]["overlap_ms"] for r in runs],
+    }
+    return {
+        name: {
+            "median": round(statistics.median(values), 3),
+            "min": round(min(values), 3),
+            "max": round(max(values), 3),
+        }
+        for name, values in metrics.items()
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Lambda ハンドラの起動時間ベンチマーク")
+    parser.add_argument("--runs", type=int, default=10, help="計測回数 (プロセス数)")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    print(json.dumps({"runs": args.runs, "python": sys.version.split()[0], **summarize(runs)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
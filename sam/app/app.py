@@ -1,13 +1,54 @@
 # src/cost_report.py
+from __future__ import annotations
+
 import os
+import sys
 import json
+import math
+import time
+import hashlib
 import logging
+import sqlite3
+import threading
+import importlib.util
+from array import array
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from heapq import nlargest, heappush, heapreplace
+from operator import itemgetter
+from types import ModuleType
 from datetime import datetime, timedelta, date
-from typing import Tuple, List, Dict, Any, Optional
+from typing import Tuple, List, Dict, Any, Optional, Iterable, Iterator, Sequence, Union, Callable
 
-import boto3
 import botocore.exceptions
-import requests
+
+import notifier
+import renderer
+import ce_scheduler
+import cost_export
+import instrumentation
+from cost_records import ServiceCost
+
+
+def _lazy_import(name: str) -> ModuleType:
+    """
+    モジュールを最初の属性参照時に読み込む。
+
+    boto3 の読み込みは Lambda のコールドスタートの大半を占めるため、
+    実際にクライアントを作成するまで遅らせる。
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+boto3 = _lazy_import("boto3")
 
 # --------------------------------------------------------------------
 # 定数定義
@@ -18,6 +59,77 @@ COST_METRIC = "AmortizedCost"
 SERVICE_GROUP_DIMENSION = "SERVICE"
 RECORD_TYPE_DIMENSION = "RECORD_TYPE"
 CREDIT_RECORD_TYPE = "Credit"
+CACHE_DB_FILENAME = "ce_cache.sqlite3"
+DEFAULT_CACHE_TTL_SECONDS = 3600
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DAILY_GRANULARITY = "DAILY"
+HOURLY_GRANULARITY = "HOURLY"
+# HOURLY の1リクエストで指定できる最大日数と、時間別の期間の書式 (UTC)
+HOURLY_MAX_DAYS = 14
+HOURLY_TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+HOURLY_PERCENTILE = 95
+# COST_METRICS に指定できるメトリクス (先頭のメトリクスをレポートの金額に使う)
+SUPPORTED_METRICS = (
+    "AmortizedCost", "UnblendedCost", "BlendedCost", "NetAmortizedCost", "NetUnblendedCost",
+    "UsageQuantity", "NormalizedUsageAmount",
+)
+DEFAULT_HOURLY_TOP_N = 10
+MIN_REPORTED_BILLING = 0.01
+# CostRowStore の金額は 10^-6 USD 単位の整数 (固定小数点) で保持する
+AMOUNT_SCALE = 1_000_000
+DAILY_STORE_FILENAME = "daily_costs.sqlite3"
+DEFAULT_RESTATEMENT_DAYS = 3
+ANOMALY_DB_FILENAME = "anomaly_state.sqlite3"
+# 日別費用の EWMA の平滑化係数と、曜日ごとの季節成分の平滑化係数
+ANOMALY_ALPHA = 0.2
+ANOMALY_SEASONAL_GAMMA = 0.1
+ANOMALY_SEASON_LENGTH = 7
+# 判定を始めるまでに学習する日数と、初回実行時にさかのぼる日数
+ANOMALY_WARMUP_DAYS = 7
+ANOMALY_LOOKBACK_DAYS = 28
+ANOMALY_MIN_STDDEV = 0.01
+DEFAULT_ANOMALY_Z_THRESHOLD = 3.0
+DEFAULT_ANOMALY_MIN_INCREASE = 1.0
+# main() で STS と Cost Explorer の呼び出しを並行して行うスレッド数
+MAIN_MAX_WORKERS = 8
+# ドリルダウンで親ごとに表示する子の件数と、表示する親の件数
+DEFAULT_DRILLDOWN_TOP_N = 5
+DEFAULT_DRILLDOWN_MAX_PARENTS = 10
+DRILLDOWN_OTHER_LABEL = "その他"
+# GroupBy に "TAG:キー" / "COST_CATEGORY:名前" と書くとタグ・コストカテゴリでグルーピングする
+GROUP_BY_TYPE_PREFIXES = ("TAG", "COST_CATEGORY")
+UNTAGGED_LABEL = "(タグなし)"
+# 比較する期間 (COMPARE_PERIODS に指定する名前) と表示名
+COMPARE_PREVIOUS_MONTH = "previous_month"
+COMPARE_PREVIOUS_YEAR = "previous_year"
+COMPARISON_LABELS = {COMPARE_PREVIOUS_MONTH: "前月同期間", COMPARE_PREVIOUS_YEAR: "前年同期間"}
+# RUN_MODE=server の場合、エントリポイントはレポートを1回出力する代わりに常駐サーバを起動する
+RUN_MODE_ONCE = "once"
+RUN_MODE_SERVER = "server"
+# Lambda のイベントで渡すレポートの指定のキー (parse_report_spec() を参照)
+REPORT_SPEC_KEYS = ("id", "start", "end", "accounts", "dimensions", "credit", "compare", "sinks")
+CREDIT_MODE_BOTH = "both"
+CREDIT_MODE_AFTER = "after"
+CREDIT_MODE_BEFORE = "before"
+CREDIT_MODES = (CREDIT_MODE_BOTH, CREDIT_MODE_AFTER, CREDIT_MODE_BEFORE)
+# レポートの指定の sinks のキーと、対応する get_config() のキー
+SINK_CONFIG_KEYS = {
+    "teams_webhook_url": "TEAMS_WEBHOOK_URL",
+    "slack_webhook_url": "SLACK_WEBHOOK_URL",
+    "sns_topic_arn": "SNS_TOPIC_ARN",
+    "output_file": "REPORT_OUTPUT_FILE",
+}
+LINKED_ACCOUNT_DIMENSION = "LINKED_ACCOUNT"
+# 予算ルール (BUDGET_RULES) の種類と状態
+BUDGET_DB_FILENAME = "budget_state.sqlite3"
+BUDGET_RULE_THRESHOLD = "threshold"
+BUDGET_RULE_SERVICE = "service_budget"
+BUDGET_RULE_PERCENT_CHANGE = "percent_change"
+BUDGET_RULE_TYPES = (BUDGET_RULE_THRESHOLD, BUDGET_RULE_SERVICE, BUDGET_RULE_PERCENT_CHANGE)
+BUDGET_STATE_OK = "ok"
+BUDGET_STATE_WARNING = "warning"
+BUDGET_STATE_BREACH = "breach"
+BUDGET_STATE_LABELS = {BUDGET_STATE_OK: "正常", BUDGET_STATE_WARNING: "注意", BUDGET_STATE_BREACH: "超過"}
 
 # ロギング設定
 logging.basicConfig(level=logging.INFO)
@@ -33,266 +145,2860 @@ def get_config() -> dict:
     環境変数を実行時に取得して返す
 
     Returns:
-        dict: USE_TEAMS_POST, TEAMS_WEBHOOK_URL をキーに含む辞書
+        dict: USE_TEAMS_POST, TEAMS_WEBHOOK_URL, CE_CACHE_DIR, CE_CACHE_TTL_SECONDS,
+              CE_CACHE_MAX_BYTES, DAILY_STORE_DIR, RESTATEMENT_DAYS, SLACK_WEBHOOK_URL,
+              SNS_TOPIC_ARN, REPORT_OUTPUT_FILE, NOTIFY_TIMEOUT_SECONDS, NOTIFY_MAX_ATTEMPTS,
+              ANOMALY_STATE_DIR, ANOMALY_Z_THRESHOLD, ANOMALY_MIN_INCREASE, EXPORT_DIR,
+              EXPORT_FORMAT, METRICS_MODE, METRICS_OUTPUT_FILE, DRILLDOWN_DIMENSIONS, DRILLDOWN_TOP_N,
+              DRILLDOWN_MAX_PARENTS, COMPARE_PERIODS, RUN_MODE, BUDGET_RULES, BUDGET_RULES_FILE,
+              BUDGET_STATE_DIR, GRANULARITY, HOURLY_TOP_N, COST_METRICS をキーに含む辞書
     """
     return {
         "USE_TEAMS_POST": os.environ.get("USE_TEAMS_POST", "no").lower() == "yes",
         "TEAMS_WEBHOOK_URL": os.environ.get("TEAMS_WEBHOOK_URL"),
+        "CE_CACHE_DIR": os.environ.get("CE_CACHE_DIR"),
+        "CE_CACHE_TTL_SECONDS": int(os.environ.get("CE_CACHE_TTL_SECONDS", DEFAULT_CACHE_TTL_SECONDS)),
+        "CE_CACHE_MAX_BYTES": int(os.environ.get("CE_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES)),
+        "DAILY_STORE_DIR": os.environ.get("DAILY_STORE_DIR"),
+        "RESTATEMENT_DAYS": int(os.environ.get("RESTATEMENT_DAYS", DEFAULT_RESTATEMENT_DAYS)),
+        "SLACK_WEBHOOK_URL": os.environ.get("SLACK_WEBHOOK_URL"),
+        "SNS_TOPIC_ARN": os.environ.get("SNS_TOPIC_ARN"),
+        "REPORT_OUTPUT_FILE": os.environ.get("REPORT_OUTPUT_FILE"),
+        "NOTIFY_TIMEOUT_SECONDS": float(
+            os.environ.get("NOTIFY_TIMEOUT_SECONDS", notifier.DEFAULT_TIMEOUT_SECONDS)
+        ),
+        "NOTIFY_MAX_ATTEMPTS": int(os.environ.get("NOTIFY_MAX_ATTEMPTS", notifier.DEFAULT_MAX_ATTEMPTS)),
+        "ANOMALY_STATE_DIR": os.environ.get("ANOMALY_STATE_DIR"),
+        "ANOMALY_Z_THRESHOLD": float(os.environ.get("ANOMALY_Z_THRESHOLD", DEFAULT_ANOMALY_Z_THRESHOLD)),
+        "ANOMALY_MIN_INCREASE": float(os.environ.get("ANOMALY_MIN_INCREASE", DEFAULT_ANOMALY_MIN_INCREASE)),
+        "EXPORT_DIR": os.environ.get("EXPORT_DIR"),
+        "EXPORT_FORMAT": os.environ.get("EXPORT_FORMAT", cost_export.DEFAULT_EXPORT_FORMAT).lower(),
+        "METRICS_MODE": os.environ.get("METRICS_MODE", instrumentation.MODE_OFF).lower(),
+        "METRICS_OUTPUT_FILE": os.environ.get("METRICS_OUTPUT_FILE", "-"),
+        "DRILLDOWN_DIMENSIONS": [
+            key.strip() for key in os.environ.get("DRILLDOWN_DIMENSIONS", "").split(",") if key.strip()
+        ],
+        "DRILLDOWN_TOP_N": int(os.environ.get("DRILLDOWN_TOP_N", DEFAULT_DRILLDOWN_TOP_N)),
+        "DRILLDOWN_MAX_PARENTS": int(os.environ.get("DRILLDOWN_MAX_PARENTS", DEFAULT_DRILLDOWN_MAX_PARENTS)),
+        "COMPARE_PERIODS": [
+            name.strip().lower() for name in os.environ.get("COMPARE_PERIODS", "").split(",") if name.strip()
+        ],
+        "RUN_MODE": os.environ.get("RUN_MODE", RUN_MODE_ONCE).lower(),
+        "BUDGET_RULES": os.environ.get("BUDGET_RULES"),
+        "BUDGET_RULES_FILE": os.environ.get("BUDGET_RULES_FILE"),
+        "BUDGET_STATE_DIR": os.environ.get("BUDGET_STATE_DIR"),
+        "GRANULARITY": os.environ.get("GRANULARITY", GRANULARITY).upper(),
+        "HOURLY_TOP_N": int(os.environ.get("HOURLY_TOP_N", DEFAULT_HOURLY_TOP_N)),
+        "COST_METRICS": [
+            name.strip() for name in os.environ.get("COST_METRICS", COST_METRIC).split(",") if name.strip()
+        ],
     }
 
 
 # --------------------------------------------------------------------
 # クラス・関数定義
 # --------------------------------------------------------------------
-class CostExplorer:
+class PhaseTimer:
     """
-    AWS Cost Explorer API を用いてコスト情報を取得するクラス。
+    処理フェーズごとの開始・終了時刻 (計測開始からのミリ秒) を記録する。
+
+    複数のスレッドから記録でき、各フェーズの所要時間の合計と全体の経過時間の差から
+    並行実行で重なった時間 (overlap_ms) がわかる。
     """
 
-    def __init__(self, client: boto3.client) -> None:
-        self.client = client
+    def __init__(self) -> None:
+        self.origin = time.perf_counter()
+        self.phases: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
 
-    def get_cost_and_usage(
+    def record(self, name: str, started: float, ended: float) -> None:
+        with self._lock:
+            self.phases[name] = {
+                "start_ms": round((started - self.origin) * 1000, 3),
+                "end_ms": round((ended - self.origin) * 1000, 3),
+                "duration_ms": round((ended - started) * 1000, 3),
+            }
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started, time.perf_counter())
+
+    def call(self, name: str, func: Any, *args: Any, **kwargs: Any) -> Any:
+        """
+        func を呼び出し、その所要時間を name のフェーズとして記録する。
+        """
+        with self.phase(name):
+            return func(*args, **kwargs)
+
+    def summary(self) -> Dict[str, Any]:
+        total_ms = (time.perf_counter() - self.origin) * 1000
+        with self._lock:
+            phases = dict(self.phases)
+        busy_ms = sum(phase["duration_ms"] for phase in phases.values())
+        return {
+            "phases": phases,
+            "total_ms": round(total_ms, 3),
+            "overlap_ms": round(max(0.0, busy_ms - total_ms), 3),
+        }
+
+
+class ResponseCache:
+    """
+    get_cost_and_usage のレスポンスを SQLite に保存するキャッシュ。
+
+    締め済みの月 (期間の終了日が当月1日以前) のデータは変わらないため無期限に保持し、
+    当月を含む期間は ttl_seconds 秒だけ保持する。合計サイズが max_bytes を超えた場合は
+    最終参照が古いものから削除する。
+
+    namespace (アカウントIDなど) には、値を返す関数 (Future.result など) も渡せる。関数は
+    キャッシュキーが必要になった時点で初めて呼ぶため、lookup() は namespace によらず同じ
+    リクエストの有効なエントリが1つもなければ、namespace を待たずにキャッシュなしと判断する。
+    """
+
+    def __init__(
         self,
-        period: Dict[str, str],
-        include_credit: bool,
-        group_by_dimension: Optional[str] = None
-    ) -> Dict[str, Any]:
+        directory: str,
+        ttl_seconds: int = DEFAULT_CACHE_TTL_SECONDS,
+        max_bytes: int = DEFAULT_CACHE_MAX_BYTES,
+        namespace: Union[str, Callable[[], str]] = ""
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, CACHE_DB_FILENAME)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._namespace = namespace
+        self.stats = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS pages ("
+                " key TEXT NOT NULL, page INTEGER NOT NULL, body TEXT NOT NULL,"
+                " PRIMARY KEY (key, page))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, size INTEGER NOT NULL,"
+                " expires_at REAL, last_access REAL NOT NULL, request_key TEXT)"
+            )
+            # request_key の列がない以前のファイルには列を追加する (既存のエントリは lookup() で参照しない)
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(entries)")]
+            if "request_key" not in columns:
+                self._conn.execute("ALTER TABLE entries ADD COLUMN request_key TEXT")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_request_key ON entries (request_key)")
+
+    @property
+    def namespace(self) -> str:
+        if callable(self._namespace):
+            self._namespace = self._namespace()
+        return self._namespace
+
+    @staticmethod
+    def _request_key(request: Dict[str, Any]) -> str:
+        params = {k: v for k, v in request.items() if k != "NextPageToken"}
+        payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def make_key(self, request: Dict[str, Any]) -> str:
         """
-        指定期間のコストと使用状況を取得する。
+        リクエスト (期間・フィルタ・グルーピング・メトリクス) からキャッシュキーを作成する。
+        """
+        params = {k: v for k, v in request.items() if k != "NextPageToken"}
+        payload = json.dumps([self.namespace, params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def lookup(self, request: Dict[str, Any]) -> Optional[Iterator[Dict[str, Any]]]:
         """
+        リクエストの有効なキャッシュがあればレスポンスをページ順に返すイテレータを、なければ None を返す。
+
+        どの namespace にも同じリクエストの有効なエントリがない場合は、namespace を解決せずに
+        None を返す (アカウントIDの取得を待たずに Cost Explorer を呼び出せる)。
+        """
+        with self._lock:
+            candidate = self._conn.execute(
+                "SELECT 1 FROM entries WHERE request_key = ? AND (expires_at IS NULL OR expires_at > ?) LIMIT 1",
+                (self._request_key(request), time.time())
+            ).fetchone()
+            if candidate is None:
+                self.stats["misses"] += 1
+                return None
+        return self.get(self.make_key(request))
+
+    def ttl_for(self, request: Dict[str, Any]) -> Optional[int]:
+        """
+        リクエストの期間から保持期間を決める。締め済みの期間なら None (無期限) を返す。
+        """
+        end = request.get("TimePeriod", {}).get("End", "")[:10]
         try:
-            filter_params: Dict[str, Any] = {}
-            if not include_credit:
-                filter_params = {
-                    "Filter": {
-                        "Not": {
-                            "Dimensions": {
-                                "Key": RECORD_TYPE_DIMENSION,
-                                "Values": [CREDIT_RECORD_TYPE]
-                            }
-                        }
-                    }
-                }
+            end_date = date.fromisoformat(end)
+        except ValueError:
+            return self.ttl_seconds
+        if end_date <= date.today().replace(day=1):
+            return None
+        return self.ttl_seconds
+
+    def get(self, key: str) -> Optional[Iterator[Dict[str, Any]]]:
+        """
+        有効なキャッシュがあればレスポンスをページ順に返すイテレータを、なければ None を返す。
 
-            group_by = []
-            if group_by_dimension:
-                group_by = [{"Type": "DIMENSION", "Key": group_by_dimension}]
+        全ページの本文はエントリの確認と同じロック内で1回の SELECT で読み出す (JSON の解析は
+        イテレータを進めるまで行わない)。読み出す前に同じファイルを使う別の接続がエントリを
+        削除していた場合など、ページがそろっていなければキャッシュなしとして扱う。
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            bodies: List[str] = []
+            if row is not None and (row[0] is None or row[0] > now):
+                pages = self._conn.execute(
+                    "SELECT page, body FROM pages WHERE key = ? ORDER BY page", (key,)
+                ).fetchall()
+                if pages and all(page == i for i, (page, _) in enumerate(pages)):
+                    bodies = [body for _, body in pages]
+            if not bodies:
+                self.stats["misses"] += 1
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self.stats["hits"] += 1
+        return (json.loads(body) for body in bodies)
 
-            response = self.client.get_cost_and_usage(
-                TimePeriod=period,
-                Granularity=GRANULARITY,
-                Metrics=[COST_METRIC],
-                GroupBy=group_by,
-                **filter_params
+    def put_page(self, key: str, page: int, response: Dict[str, Any]) -> None:
+        """
+        レスポンスを1ページ保存する。commit() が呼ばれるまでは参照されない。
+        """
+        body = json.dumps(response, ensure_ascii=False, default=str)
+        with self._lock, self._conn:
+            if page == 0:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO pages (key, page, body) VALUES (?, ?, ?)", (key, page, body)
             )
-            return response["ResultsByTime"][0]
 
-        except botocore.exceptions.ClientError as e:
-            logger.error(f"Failed to fetch cost and usage data: {e}")
-            raise RuntimeError(f"Error calling AWS Cost Explorer API: {e}") from e
+    def commit(self, key: str, ttl_seconds: Optional[int], request: Optional[Dict[str, Any]] = None) -> None:
+        """
+        全ページの保存が完了したエントリを有効にし、上限を超えていれば古いものを削除する。
+        request を渡したエントリだけが lookup() の対象になる。
+        """
+        now = time.time()
+        expires_at = None if ttl_seconds is None else now + ttl_seconds
+        with self._lock, self._conn:
+            size = self._conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(body)), 0) FROM pages WHERE key = ?", (key,)
+            ).fetchone()[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, size, expires_at, last_access, request_key)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, size, expires_at, now, None if request is None else self._request_key(request))
+            )
+            self.stats["stores"] += 1
+            self._evict()
 
-    def get_total_cost(self, cost_and_usage_data: Dict[str, Any]) -> float:
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        rows = self._conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall()
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            total -= size
+            self.stats["evictions"] += 1
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+class DailyCostStore:
+    """
+    日別・サービス別のクレジット適用後/適用前の費用を SQLite に保存するストア。
+
+    取得済みの日は再取得せず、遅れて計上される費用に備えて直近 restatement_days 日だけを
+    取り直すことで、当月累計を毎回月初から集計し直さずに済むようにする。
+    """
+
+    def __init__(self, directory: str, namespace: str = "") -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, DAILY_STORE_FILENAME)
+        self.namespace = namespace
+        self._conn = sqlite3.connect(self.path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS daily_costs ("
+                " namespace TEXT NOT NULL, day TEXT NOT NULL, service TEXT NOT NULL,"
+                " after_credit REAL NOT NULL, before_credit REAL NOT NULL,"
+                " PRIMARY KEY (namespace, day, service))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS fetched_days ("
+                " namespace TEXT NOT NULL, day TEXT NOT NULL, PRIMARY KEY (namespace, day))"
+            )
+
+    def get_fetch_start(self, start_date: str, end_date: str, restatement_days: int) -> str:
         """
-        コストと使用状況のデータから合計費用を取得する。
+        取得が必要な最初の日を返す。未取得の日と、終了日から restatement_days 日前の
+        うち早い方 (ただし開始日以降) となる。
         """
-        try:
-            if not cost_and_usage_data.get("Total"):
-                total_cost = sum(
-                    max(0, float(group["Metrics"][COST_METRIC]["Amount"]))
-                    for group in cost_and_usage_data.get("Groups", [])
-                )
-                logger.info(f"Calculated total cost from Groups: {total_cost:.2f} USD")
-                return total_cost
+        fetched = {
+            row[0] for row in self._conn.execute(
+                "SELECT day FROM fetched_days WHERE namespace = ? AND day >= ? AND day < ?",
+                (self.namespace, start_date, end_date)
+            )
+        }
+        start = date.fromisoformat(start_date)
+        end = date.fromisoformat(end_date)
+        fetch_start = max(start, end - timedelta(days=restatement_days))
+        day = start
+        while day < fetch_start:
+            if day.isoformat() not in fetched:
+                return day.isoformat()
+            day += timedelta(days=1)
+        return fetch_start.isoformat()
 
-            return float(cost_and_usage_data["Total"][COST_METRIC]["Amount"])
+    def replace_days(
+        self,
+        start_date: str,
+        end_date: str,
+        daily_amounts: Dict[str, Tuple[Dict[str, float], Dict[str, float]]]
+    ) -> int:
+        """
+        開始日～終了日 (終了日は含まない) の日別費用を入れ替える。
 
-        except KeyError as e:
-            logger.error(f"Metric '{COST_METRIC}' is missing: {cost_and_usage_data}")
-            return 0.0
+        Args:
+            daily_amounts: 日付 -> (サービス別クレジット適用後費用, サービス別クレジット適用前費用)
 
-    def get_service_costs(self, cost_and_usage_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        Returns:
+            int: 書き込んだ行数
         """
-        コストと使用状況のデータからサービスごとの費用を取得する。
+        rows = [
+            (self.namespace, day, service, after_credit.get(service, 0.0), before_credit.get(service, 0.0))
+            for day, (after_credit, before_credit) in daily_amounts.items()
+            for service in after_credit.keys() | before_credit.keys()
+        ]
+        days = []
+        day = date.fromisoformat(start_date)
+        while day < date.fromisoformat(end_date):
+            days.append((self.namespace, day.isoformat()))
+            day += timedelta(days=1)
+
+        with self._conn:
+            self._conn.execute(
+                "DELETE FROM daily_costs WHERE namespace = ? AND day >= ? AND day < ?",
+                (self.namespace, start_date, end_date)
+            )
+            self._conn.executemany("INSERT INTO daily_costs VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.executemany("INSERT OR IGNORE INTO fetched_days VALUES (?, ?)", days)
+        return len(rows)
+
+    def get_period_amounts(
+        self,
+        start_date: str,
+        end_date: str
+    ) -> Tuple[Dict[str, float], Dict[str, float]]:
         """
-        service_groups = cost_and_usage_data.get("Groups", [])
-        result = []
-        for item in service_groups:
-            billing_amount = float(item["Metrics"][COST_METRIC]["Amount"])
-            result.append({
-                "service_name": item["Keys"][0],
-                "billing": billing_amount
-            })
-        return result
+        期間内のサービス別費用を合算して返す。
+
+        Returns:
+            Tuple: (サービス別クレジット適用後費用, サービス別クレジット適用前費用)
+        """
+        after_credit: Dict[str, float] = {}
+        before_credit: Dict[str, float] = {}
+        for service, after, before in self._conn.execute(
+            "SELECT service, SUM(after_credit), SUM(before_credit) FROM daily_costs"
+            " WHERE namespace = ? AND day >= ? AND day < ? GROUP BY service ORDER BY service",
+            (self.namespace, start_date, end_date)
+        ):
+            after_credit[service] = after
+            before_credit[service] = before
+        return after_credit, before_credit
 
+    def close(self) -> None:
+        self._conn.close()
 
-def get_client() -> boto3.client:
+
+class AnomalyDetector:
     """
-    boto3 Cost Explorer クライアントを返す。
+    サービス別の日次費用の急増を検知する。
+
+    サービスごとに EWMA (指数加重移動平均)・EWM 分散・曜日別の季節成分だけを状態として
+    SQLite に保存し、新しい1日分の費用ごとに定数時間で更新する。過去の履歴は保持しないため、
+    判定のたびに長期間の費用を集計し直す必要がない。各日は1度だけ反映するため、反映するのは
+    遅れて計上される費用が確定した日 (build_anomaly_section() の restatement_days を参照) に限る。
     """
-    return boto3.client("ce", region_name=REGION_NAME)
 
+    def __init__(
+        self,
+        directory: str,
+        namespace: str = "",
+        z_threshold: float = DEFAULT_ANOMALY_Z_THRESHOLD,
+        min_increase: float = DEFAULT_ANOMALY_MIN_INCREASE
+    ) -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, ANOMALY_DB_FILENAME)
+        self.namespace = namespace
+        self.z_threshold = z_threshold
+        self.min_increase = min_increase
+        self._conn = sqlite3.connect(self.path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS anomaly_state ("
+                " namespace TEXT NOT NULL, service TEXT NOT NULL, days INTEGER NOT NULL,"
+                " mean REAL NOT NULL, variance REAL NOT NULL, seasonal TEXT NOT NULL,"
+                " PRIMARY KEY (namespace, service))"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS anomaly_progress ("
+                " namespace TEXT PRIMARY KEY, last_day TEXT NOT NULL)"
+            )
+        self.states: Dict[str, Dict[str, Any]] = {
+            service: {"days": days, "mean": mean, "variance": variance, "seasonal": json.loads(seasonal)}
+            for service, days, mean, variance, seasonal in self._conn.execute(
+                "SELECT service, days, mean, variance, seasonal FROM anomaly_state WHERE namespace = ?",
+                (namespace,)
+            )
+        }
+        row = self._conn.execute(
+            "SELECT last_day FROM anomaly_progress WHERE namespace = ?", (namespace,)
+        ).fetchone()
+        self.last_day: Optional[str] = row[0] if row else None
+
+    def get_fetch_start(self, end_date: str) -> str:
+        """
+        未反映の最初の日を返す。初回は end_date の ANOMALY_LOOKBACK_DAYS 日前から学習する。
+        """
+        if self.last_day is not None:
+            return (date.fromisoformat(self.last_day) + timedelta(days=1)).isoformat()
+        return (date.fromisoformat(end_date) - timedelta(days=ANOMALY_LOOKBACK_DAYS)).isoformat()
 
-def get_date_range() -> Tuple[str, str]:
+    def update(self, day: str, amounts: Dict[str, float]) -> List[Dict[str, Any]]:
+        """
+        1日分のサービス別費用で状態を更新し、急増と判定したサービスを返す。
+
+        反映済みの日は無視する。その日に費用がない既知のサービスは 0 として扱う。
+        """
+        if self.last_day is not None and day <= self.last_day:
+            return []
+
+        weekday = date.fromisoformat(day).weekday() % ANOMALY_SEASON_LENGTH
+        anomalies = []
+        for service in self.states.keys() | amounts.keys():
+            amount = amounts.get(service, 0.0)
+            state = self.states.get(service)
+            if state is None:
+                state = self.states[service] = {
+                    "days": 0, "mean": amount, "variance": 0.0, "seasonal": [0.0] * ANOMALY_SEASON_LENGTH
+                }
+
+            expected = state["mean"] + state["seasonal"][weekday]
+            stddev = max(math.sqrt(state["variance"]), ANOMALY_MIN_STDDEV)
+            deviation = amount - expected
+            z_score = deviation / stddev
+            if (
+                state["days"] >= ANOMALY_WARMUP_DAYS
+                and z_score >= self.z_threshold
+                and deviation >= self.min_increase
+            ):
+                anomalies.append({
+                    "service_name": service,
+                    "day": day,
+                    "billing": amount,
+                    "expected": expected,
+                    "z_score": z_score,
+                })
+
+            # EWMA と EWM 分散は季節成分を除いた値で、季節成分は EWMA からの残差で更新する
+            residual = amount - state["mean"]
+            increment = ANOMALY_ALPHA * (residual - state["seasonal"][weekday])
+            state["mean"] += increment
+            state["variance"] = (1 - ANOMALY_ALPHA) * (state["variance"] + deviation * increment)
+            state["seasonal"][weekday] += ANOMALY_SEASONAL_GAMMA * (residual - state["seasonal"][weekday])
+            state["days"] += 1
+
+        self.last_day = day
+        return sorted(anomalies, key=lambda item: item["z_score"], reverse=True)
+
+    def save(self) -> None:
+        """
+        状態と反映済みの最終日を保存する。
+        """
+        if self.last_day is None:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO anomaly_state VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (self.namespace, service, state["days"], state["mean"], state["variance"],
+                     json.dumps(state["seasonal"]))
+                    for service, state in self.states.items()
+                ]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO anomaly_progress VALUES (?, ?)", (self.namespace, self.last_day)
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def load_budget_rules(text: str, compare_periods: Optional[Sequence[str]] = None) -> List[Dict[str, Any]]:
     """
-    集計期間を取得する。
+    予算ルールの JSON (ルールのリスト) を検証し、既定値を補って返す。不正な定義は ValueError。
+
+    compare_periods (COMPARE_PERIODS の名前のリスト) を渡した場合、percent_change のルールの
+    compare がそこに含まれなければ ValueError とする (比較対象の期間を取得しないため判定できない)。
+
+    ルールのキー:
+        id: ルールの名前 (必須・一意)
+        type: "threshold" (合計が amount 以上), "service_budget" (service の費用が amount 以上),
+              "percent_change" (比較対象の期間からの増加率が percent 以上。service を省略すると合計)
+        credit: 判定するクレジット適用の前後 ("after" (既定) / "before")
+        compare: percent_change で比較する期間 (COMPARE_PERIODS の名前、既定は previous_month)
+        warning_percent: 上限の何 % 以上で「注意」とするか (省略時は「注意」なし)
     """
-    start_date = date.today().replace(day=1).isoformat()
-    end_date = date.today().isoformat()
-    return start_date, end_date
+    try:
+        rules = json.loads(text)
+    except ValueError as e:
+        raise ValueError(f"BUDGET_RULES を JSON として解析できません: {e}") from e
+    if not isinstance(rules, list):
+        raise ValueError("BUDGET_RULES にはルールのリストを指定してください。")
+
+    parsed: List[Dict[str, Any]] = []
+    for rule in rules:
+        if not isinstance(rule, dict) or not rule.get("id"):
+            raise ValueError(f"予算ルールには id が必要です: {rule!r}")
+        rule_id = str(rule["id"])
+        if any(item["id"] == rule_id for item in parsed):
+            raise ValueError(f"予算ルールの id が重複しています: {rule_id}")
+        rule_type = rule.get("type")
+        if rule_type not in BUDGET_RULE_TYPES:
+            raise ValueError(f"予算ルール {rule_id} の type が不正です: {rule_type} ({', '.join(BUDGET_RULE_TYPES)} のいずれか)")
+        limit_key = "percent" if rule_type == BUDGET_RULE_PERCENT_CHANGE else "amount"
+        if not isinstance(rule.get(limit_key), (int, float)):
+            raise ValueError(f"予算ルール {rule_id} には数値の {limit_key} が必要です。")
+        if rule_type == BUDGET_RULE_SERVICE and not rule.get("service"):
+            raise ValueError(f"予算ルール {rule_id} には service が必要です。")
+        credit = rule.get("credit", CREDIT_MODE_AFTER)
+        if credit not in (CREDIT_MODE_AFTER, CREDIT_MODE_BEFORE):
+            raise ValueError(f"予算ルール {rule_id} の credit が不正です: {credit} (after, before のいずれか)")
+        compare = rule.get("compare", COMPARE_PREVIOUS_MONTH)
+        if compare not in COMPARISON_LABELS:
+            raise ValueError(f"予算ルール {rule_id} の compare が不正です: {compare}")
+        if (
+            rule_type == BUDGET_RULE_PERCENT_CHANGE and compare_periods is not None
+            and compare not in compare_periods
+        ):
+            raise ValueError(
+                f"予算ルール {rule_id} の compare ({compare}) が COMPARE_PERIODS に含まれていないため判定できません。"
+            )
+        parsed.append({
+            "id": rule_id,
+            "type": rule_type,
+            "service": rule.get("service"),
+            "limit": float(rule[limit_key]),
+            "credit": credit,
+            "compare": compare,
+            "warning_percent": rule.get("warning_percent"),
+        })
+    return parsed
 
 
-def format_service_costs(service_billings: List[Dict[str, Any]]) -> List[str]:
+class BudgetRuleEngine:
     """
-    サービスごとの費用を表示用に整形する。
+    レポート区分に予算ルールを適用し、前回の実行から状態 (正常・注意・超過) が変化したルールを返す。
+
+    ルールごとの状態だけを SQLite に保存し、実行のたびに前回の状態と比べる。区分のサービス別費用は
+    1度だけ辞書にしてから各ルールを定数時間で判定するため、ルールやアカウントが多くても
+    判定の手間はルールの数に比例するだけで済む。前回の状態がないルールは「正常」だったものとみなす。
+    判定に必要なデータがない場合 (比較対象の期間を取得していないなど) は状態を変えない。
     """
-    formatted_services = []
-    for item in service_billings:
-        billing = item["billing"]
-        if billing >= 0.01:
-            formatted_services.append(f"- {item['service_name']}: {billing:.2f} USD")
+
+    def __init__(self, directory: str, rules: Sequence[Dict[str, Any]], namespace: str = "") -> None:
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, BUDGET_DB_FILENAME)
+        self.rules = list(rules)
+        self.namespace = namespace
+        self._conn = sqlite3.connect(self.path)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS budget_state ("
+                " namespace TEXT NOT NULL, rule_id TEXT NOT NULL, state TEXT NOT NULL,"
+                " value REAL, updated_at REAL NOT NULL,"
+                " PRIMARY KEY (namespace, rule_id))"
+            )
+        self.states: Dict[str, Tuple[str, Optional[float]]] = {
+            rule_id: (state, value)
+            for rule_id, state, value in self._conn.execute(
+                "SELECT rule_id, state, value FROM budget_state WHERE namespace = ?", (namespace,)
+            )
+        }
+
+    @staticmethod
+    def _measure(rule: Dict[str, Any], section: Dict[str, Any], services: Dict[str, Dict[str, Any]]) -> Optional[float]:
+        if rule["type"] == BUDGET_RULE_THRESHOLD:
+            return section["total"]
+        item = services.get(rule["service"]) if rule["service"] else None
+        if rule["type"] == BUDGET_RULE_SERVICE:
+            return item.billing if item else 0.0
+
+        if rule["service"]:
+            changes = item.changes if item else ()
         else:
-            logger.debug(f"Excluded negligible cost: {item['service_name']} ({billing:.5f})")
-    return formatted_services
+            changes = section.get("comparisons", [])
+        label = COMPARISON_LABELS[rule["compare"]]
+        for change in changes:
+            if change["label"] == label:
+                return change["percent"]
+        return None
 
+    @staticmethod
+    def _classify(rule: Dict[str, Any], value: float) -> str:
+        if value >= rule["limit"]:
+            return BUDGET_STATE_BREACH
+        if rule["warning_percent"] is not None and value >= rule["limit"] * rule["warning_percent"] / 100:
+            return BUDGET_STATE_WARNING
+        return BUDGET_STATE_OK
 
-def handle_cost_report(
-    explorer: CostExplorer,
-    period: Dict[str, str],
-    include_credit: bool,
-    start_day: str,
-    end_day: str
-) -> Tuple[str, List[str]]:
+    def evaluate(self, sections: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        build_cost_section() の区分 (クレジット適用後/適用前) にルールを適用し、状態が変化した
+        ルールを rule, previous_state, state, value をキーに含む辞書のリストで返す。
+        """
+        by_credit: Dict[str, Tuple[Dict[str, Any], Dict[str, Dict[str, Any]]]] = {}
+        for section in sections:
+            if "include_credit" in section:
+                credit = CREDIT_MODE_AFTER if section["include_credit"] else CREDIT_MODE_BEFORE
+                by_credit[credit] = (section, {item.service_name: item for item in section["services"]})
+
+        changes = []
+        for rule in self.rules:
+            if rule["credit"] not in by_credit:
+                continue
+            value = self._measure(rule, *by_credit[rule["credit"]])
+            if value is None:
+                continue
+            state = self._classify(rule, value)
+            previous_state = self.states.get(rule["id"], (BUDGET_STATE_OK, None))[0]
+            self.states[rule["id"]] = (state, value)
+            if state != previous_state:
+                changes.append({"rule": rule, "previous_state": previous_state, "state": state, "value": value})
+        return changes
+
+    def save(self) -> None:
+        """
+        ルールごとの状態を保存する。
+        """
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO budget_state VALUES (?, ?, ?, ?, ?)",
+                [(self.namespace, rule_id, state, value, now) for rule_id, (state, value) in self.states.items()]
+            )
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def group_by_definition(key: str) -> Dict[str, str]:
     """
-    費用レポート（クレジット適用前/後）の取得と整形を行う。
+    GroupBy の指定 ("SERVICE", "TAG:Project", "COST_CATEGORY:Team" など) を
+    get_cost_and_usage の GroupBy の要素に変換する。
     """
-    cost_and_usage = explorer.get_cost_and_usage(
-        period,
-        include_credit=include_credit,
-        group_by_dimension=SERVICE_GROUP_DIMENSION
-    )
-    total_cost = explorer.get_total_cost(cost_and_usage)
-    services_cost = explorer.get_service_costs(cost_and_usage)
-    formatted_services = format_service_costs(services_cost)
-
-    credit_text = "後" if include_credit else "前"
-    title = f"{start_day}～{end_day}のクレジット適用{credit_text}費用は、{total_cost:.2f} USD です。"
-    return title, formatted_services
+    group_type, separator, name = key.partition(":")
+    if separator and group_type in GROUP_BY_TYPE_PREFIXES:
+        if not name:
+            raise ValueError(f"GroupBy のキーが空です: {key}")
+        return {"Type": group_type, "Key": name}
+    return {"Type": "DIMENSION", "Key": key}
 
 
-def print_report(title: str, services_cost: List[str]) -> None:
+def group_key_label(key: str, value: str) -> str:
     """
-    レポートを標準出力に表示する。
+    レスポンスのグループのキーを表示用に整形する。
+
+    タグ・コストカテゴリのキーは "Project$web" の形式で返るため、"キー$" を取り除く
+    (値がない場合は UNTAGGED_LABEL)。
     """
-    print("------------------------------------------------------")
-    print(title)
-    if services_cost:
-        print("\n".join(services_cost))
-    else:
-        print("サービスごとの費用データはありません。")
-    print("------------------------------------------------------\n")
+    if group_by_definition(key)["Type"] == "DIMENSION":
+        return value
+    return value.partition("$")[2] or UNTAGGED_LABEL
 
-def post_to_teams(title: str, services_cost: List[str]) -> None:
+
+class DrillDown:
     """
-    Teams WebhookにAdaptive Card形式でメッセージを送信する。
+    2つのディメンション (親・子) のグループから、親ごとに金額の大きい子の上位 N 件を選ぶ。
+
+    親ごとに大きさ top_n の最小ヒープだけを持ち、ヒープからあふれた子の金額と件数は
+    親ごとの「その他」に加算する。グループを1件ずつ受け取りながら選ぶため、組み合わせが
+    数万件あっても保持するのは 親の数 × top_n 件に収まる。
+    同じ (親, 子) の組み合わせは1回だけ add() されることを前提とする。
     """
-    teams_webhook_url = os.environ.get("TEAMS_WEBHOOK_URL")
-    if not teams_webhook_url:
-        raise ValueError("TEAMS_WEBHOOK_URL is環境変数で設定されていません。")
 
-    # サービスごとの費用データを1行ずつ整形
-    services_text = "\n".join(services_cost) if services_cost else "サービスごとの費用データはありません。"
-
-    # Adaptive Card形式のメッセージを作成
-    message = {
-        "attachments": [
-            {
-                "contentType": "application/vnd.microsoft.card.adaptive",
-                "content": {
-                    "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
-                    "type": "AdaptiveCard",
-                    "version": "1.2",
-                    "body": [
-                        {
-                            "type": "TextBlock",
-                            "text": f"### {title}\n\n{services_text}",
-                            "wrap": True,
-                            "markdown": True
-                        }
-                    ]
-                }
-            }
-        ]
-    }
+    def __init__(self, top_n: int = DEFAULT_DRILLDOWN_TOP_N) -> None:
+        if top_n < 1:
+            raise ValueError(f"top_n は1以上を指定してください: {top_n}")
+        self.top_n = top_n
+        self.parent_totals: Dict[str, float] = {}
+        self.others: Dict[str, Tuple[float, int]] = {}
+        self._heaps: Dict[str, List[Tuple[float, int, str]]] = {}
+        self._sequence = 0
 
-    # Teams WebhookにPOSTリクエストを送信
-    try:
-        response = requests.post(
-            url=teams_webhook_url,
-            data=json.dumps(message),
-            headers={'Content-Type': 'application/json'}
-        )
-        response.raise_for_status()
-        logger.info("Teamsへの通知に成功しました。")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Teams Webhookへの通知に失敗しました: {e}")
-        raise RuntimeError("Teams通知に失敗しました。") from e
+    def add(self, parent: str, child: str, amount: float) -> None:
+        """
+        (親, 子) の金額を1件加える。
+        """
+        self.parent_totals[parent] = self.parent_totals.get(parent, 0.0) + amount
+        heap = self._heaps.setdefault(parent, [])
+        # 同額の場合は先に来た子を残す
+        self._sequence -= 1
+        entry = (amount, self._sequence, child)
+        if len(heap) < self.top_n:
+            heappush(heap, entry)
+            return
+        if entry > heap[0]:
+            entry = heapreplace(heap, entry)
+        other_amount, other_count = self.others.get(parent, (0.0, 0))
+        self.others[parent] = (other_amount + entry[0], other_count + 1)
 
-def get_account_id() -> str:
+    def extend_groups(self, groups: Iterable[Dict[str, Any]], metric: str = COST_METRIC) -> None:
+        """
+        Keys が [親, 子] のグループをまとめて加える。
+        """
+        for group in groups:
+            parent, child = group["Keys"][:2]
+            self.add(parent, child, float(group["Metrics"][metric]["Amount"]))
+
+    def results(self, max_parents: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        親を合計の大きい順に並べ、親ごとの上位の子と「その他」を返す。
+
+        Returns:
+            List[dict]: name, total, children ((子, 金額) のリスト、金額の大きい順),
+                        other (その他の金額), other_count (その他の件数) をキーに含む辞書のリスト
+        """
+        parents = sorted(self.parent_totals, key=self.parent_totals.__getitem__, reverse=True)
+        if max_parents is not None:
+            parents = parents[:max_parents]
+        results = []
+        for parent in parents:
+            ranked = sorted(self._heaps[parent], reverse=True)
+            other, other_count = self.others.get(parent, (0.0, 0))
+            results.append({
+                "name": parent,
+                "total": self.parent_totals[parent],
+                "children": [(child, amount) for amount, _, child in ranked],
+                "other": other,
+                "other_count": other_count,
+            })
+        return results
+
+
+class HourlyAggregator:
     """
-    AWSアカウントIDを取得する。
+    時間別の費用を読みながら、サービスごとの合計・ピークの時間・時間別の p95 を集計する。
+
+    時間 × サービスの表は作らず、サービスごとに合計とピークと、大きい方から k 件
+    (k は時間数から決まる p95 の順位) の値だけを持つ大きさ k の最小ヒープを更新する。
+    費用の行がない時間は 0 として扱うため、0 以下の値はヒープに入れない。
+    金額は CostRowStore と同じく AMOUNT_SCALE 倍した整数で合算する。
     """
-    try:
-        sts_client = boto3.client("sts")
-        account_id = sts_client.get_caller_identity()["Account"]
-        return account_id
-    except botocore.exceptions.ClientError as e:
-        logger.error(f"Failed to fetch AWS Account ID: {e}")
-        raise RuntimeError("AWS Account IDの取得に失敗しました。") from e
 
-def main() -> None:
+    def __init__(self, hour_count: int, percentile: int = HOURLY_PERCENTILE) -> None:
+        self.hour_count = hour_count
+        self.percentile = percentile
+        # nearest-rank 法の p 分位は、小さい方から ceil(p/100 × n) 番目 = 大きい方から k 番目の値
+        self.tail_size = hour_count - math.ceil(percentile * hour_count / 100) + 1 if hour_count else 0
+        self.totals: Dict[str, int] = {}
+        self.peaks: Dict[str, Tuple[int, str]] = {}
+        self.tails: Dict[str, List[int]] = {}
+        self.hourly_totals: Dict[str, int] = {}
+
+    def add(self, hour: str, name: str, amount: float) -> None:
+        scaled = round(amount * AMOUNT_SCALE)
+        self.totals[name] = self.totals.get(name, 0) + scaled
+        self.hourly_totals[hour] = self.hourly_totals.get(hour, 0) + scaled
+        peak = self.peaks.get(name)
+        if peak is None or scaled > peak[0]:
+            self.peaks[name] = (scaled, hour)
+        if scaled <= 0 or not self.tail_size:
+            return
+        tail = self.tails.setdefault(name, [])
+        if len(tail) < self.tail_size:
+            heappush(tail, scaled)
+        elif scaled > tail[0]:
+            heapreplace(tail, scaled)
+
+    def extend_result(self, result: Dict[str, Any], metric: str = COST_METRIC) -> None:
+        """
+        ResultsByTime の1要素 (1時間分。ページで分割された一部でもよい) を取り込む。
+        """
+        hour = result["TimePeriod"]["Start"]
+        for group in result.get("Groups", []):
+            self.add(hour, group["Keys"][0], float(group["Metrics"][metric]["Amount"]))
+
+    def peak_hour(self) -> Optional[Tuple[str, float]]:
+        """
+        全サービスの合計が最も大きい時間と、その費用を返す。
+        """
+        if not self.hourly_totals:
+            return None
+        hour = max(self.hourly_totals, key=self.hourly_totals.__getitem__)
+        return hour, self.hourly_totals[hour] / AMOUNT_SCALE
+
+    def results(self) -> List[Dict[str, Any]]:
+        """
+        サービスごとの name, total, peak, peak_hour, p95 の辞書を合計の大きい順に返す。
+        """
+        results = []
+        for name, total in sorted(self.totals.items(), key=lambda item: item[1], reverse=True):
+            peak, peak_hour = self.peaks[name]
+            tail = self.tails.get(name, [])
+            p95 = tail[0] if len(tail) == self.tail_size else 0
+            results.append({
+                "name": name,
+                "total": total / AMOUNT_SCALE,
+                "peak": peak / AMOUNT_SCALE,
+                "peak_hour": peak_hour,
+                "p95": p95 / AMOUNT_SCALE,
+            })
+        return results
+
+
+class CostRowStore:
     """
-    メイン関数。
+    Cost Explorer のグループを整数の配列に詰めて保持するコンパクトな行ストア。
+
+    ディメンションの値は列ごとに整数IDへインターン (重複する文字列は1つだけ保持) し、
+    金額は AMOUNT_SCALE 倍した int64 の固定小数点で array に格納する。グループごとに
+    辞書や float を作らないため、サービス × アカウント × 使用タイプ × 期間のような
+    大量の行でもメモリ使用量を抑えられる (row_memory.columns のベンチマークを参照)。
+    目的はメモリの削減で、集約・合計・上位N件・しきい値による絞り込みは行ごとの Python の
+    ループで行う (ベクトル化はしないため、辞書で集計する場合より速くはならない)。
+    行の取り出しだけは operator.itemgetter でまとめて行う。
+
+    metrics を複数指定した場合はメトリクスごとに金額の列を持ち、集約ではすべての列を合算する。
+    絞り込み・並べ替えは先頭のメトリクス (amounts) で行う。
     """
-    config = get_config()
-    use_teams_post = config["USE_TEAMS_POST"]
-    teams_webhook_url = config["TEAMS_WEBHOOK_URL"]
 
-    # USE_TEAMS_POST が True なら TEAMS_WEBHOOK_URL が必要
-    if use_teams_post and not teams_webhook_url:
-        raise ValueError("TEAMS_WEBHOOK_URL is not set in the environment variables.")
+    def __init__(self, dimensions: Sequence[str], metrics: Sequence[str] = (COST_METRIC,)) -> None:
+        self.dimensions = list(dimensions)
+        self.metrics = list(metrics)
+        self.key_columns = [array("q") for _ in self.dimensions]
+        self.metric_columns = [array("q") for _ in self.metrics]
+        self._values: List[List[str]] = [[] for _ in self.dimensions]
+        self._ids: List[Dict[str, int]] = [{} for _ in self.dimensions]
 
-    # AWSアカウントIDを取得
-    account_id = get_account_id()
-    logger.info(f"AWS Account ID: {account_id}")
+    @property
+    def amounts(self) -> array:
+        return self.metric_columns[0]
 
-    # boto3 CostExplorer クライアントをモック化できるよう必ず get_client() 経由にする
-    client = get_client()
-    explorer = CostExplorer(client)
+    def __len__(self) -> int:
+        return len(self.amounts)
 
-    start_date, end_date = get_date_range()
-    period = {"Start": start_date, "End": end_date}
-    start_day_str = datetime.strptime(start_date, "%Y-%m-%d").strftime("%m/%d")
-    end_day_str = (datetime.strptime(end_date, "%Y-%m-%d") - timedelta(days=1)).strftime("%m/%d")
+    @classmethod
+    def from_results(
+        cls,
+        results: Iterable[Dict[str, Any]],
+        dimensions: Sequence[str],
+        metrics: Sequence[str] = (COST_METRIC,)
+    ) -> "CostRowStore":
+        """
+        ResultsByTime の要素のストリームから表を作成する。
+        """
+        table = cls(dimensions, metrics)
+        for result in results:
+            table.extend_groups(result.get("Groups", []))
+        return table
 
-    # --- クレジット適用後 ---
-    title_after, services_after = handle_cost_report(
-        explorer, period, include_credit=True, start_day=start_day_str, end_day=end_day_str
-    )
-    title_after = f"AWSアカウント {account_id}\n" + title_after
-    print_report(title_after, services_after)
-    if use_teams_post:
-        post_to_teams(title_after, services_after)
-
-    # --- クレジット適用前 ---
-    title_before, services_before = handle_cost_report(
-        explorer, period, include_credit=False, start_day=start_day_str, end_day=end_day_str
-    )
-    title_before = f"AWSアカウント {account_id}\n" + title_before
-    print_report(title_before, services_before)
-    if use_teams_post:
-        post_to_teams(title_before, services_before)
+    def intern(self, column: int, value: str) -> int:
+        """
+        ディメンションの値を列内で一意な整数IDに変換する。
+        """
+        ids = self._ids[column]
+        value_id = ids.get(value)
+        if value_id is None:
+            value_id = ids[value] = len(self._values[column])
+            self._values[column].append(value)
+        return value_id
+
+    def append(self, keys: Sequence[str], *amounts: float) -> None:
+        """
+        1行を追加する。amounts は metrics の順の値。
+        """
+        for column, key in enumerate(keys):
+            self.key_columns[column].append(self.intern(column, key))
+        for column, amount in zip(self.metric_columns, amounts):
+            column.append(round(amount * AMOUNT_SCALE))
 
+    def extend_groups(self, groups: Iterable[Dict[str, Any]]) -> None:
+        """
+        Groups の各要素を1行として追加する。複数のメトリクスはグループを1度だけ走査して読む。
+        """
+        groups = groups if isinstance(groups, list) else list(groups)
+        intern = self.intern
+        for column in range(len(self.dimensions)):
+            self.key_columns[column].extend(intern(column, group["Keys"][column]) for group in groups)
+        if len(self.metrics) == 1:
+            metric = self.metrics[0]
+            self.amounts.extend(
+                round(float(group["Metrics"][metric]["Amount"]) * AMOUNT_SCALE) for group in groups
+            )
+            return
+        pairs = list(zip(self.metrics, self.metric_columns))
+        for group in groups:
+            values = group["Metrics"]
+            for metric, column in pairs:
+                column.append(round(float(values[metric]["Amount"]) * AMOUNT_SCALE))
+
+    def total(self, clip_negative: bool = False) -> float:
+        """
+        先頭のメトリクスの合計を返す。clip_negative が True の場合は負の行を 0 として扱う。
+        """
+        return self.totals(clip_negative)[0]
+
+    def totals(self, clip_negative: bool = False) -> Tuple[float, ...]:
+        """
+        メトリクスごとの合計を metrics の順に返す。
+        """
+        if clip_negative:
+            return tuple(sum(amount for amount in column if amount > 0) / AMOUNT_SCALE
+                         for column in self.metric_columns)
+        return tuple(sum(column) / AMOUNT_SCALE for column in self.metric_columns)
+
+    def group_by(self, *dimensions: str) -> "CostRowStore":
+        """
+        指定したディメンションで行を集約した表を返す。行の順序は各キーの初出順となる。
+        """
+        columns = [self.dimensions.index(dimension) for dimension in dimensions]
+        # 1ディメンションの場合は行ごとにキーのタプルを作らず、IDをそのままキーにする
+        keys: Iterable[Any] = (
+            self.key_columns[columns[0]] if len(columns) == 1 else zip(*(self.key_columns[c] for c in columns))
+        )
+        sums: Dict[Any, Any] = {}
+        if len(self.metric_columns) == 1:
+            for key, amount in zip(keys, self.amounts):
+                sums[key] = sums.get(key, 0) + amount
+        else:
+            for key, *amounts in zip(keys, *self.metric_columns):
+                current = sums.get(key)
+                sums[key] = amounts if current is None else [a + b for a, b in zip(current, amounts)]
+
+        # インターンした値は追記のみのため、コピーせずに元の表と共有する
+        grouped = CostRowStore(dimensions, self.metrics)
+        grouped._values = [self._values[c] for c in columns]
+        grouped._ids = [self._ids[c] for c in columns]
+        if len(columns) == 1:
+            grouped.key_columns[0] = array("q", sums)
+        else:
+            for position in range(len(columns)):
+                grouped.key_columns[position] = array("q", (key[position] for key in sums))
+        if len(self.metric_columns) == 1:
+            grouped.metric_columns = [array("q", sums.values())]
+        else:
+            grouped.metric_columns = [array("q", column) for column in zip(*sums.values())] or [
+                array("q") for _ in self.metrics
+            ]
+        return grouped
+
+    def _select(self, indexes: Iterable[int]) -> "CostRowStore":
+        selected = CostRowStore(self.dimensions, self.metrics)
+        selected._values = self._values
+        selected._ids = self._ids
+        indexes = list(indexes)
+        if not indexes:
+            return selected
+        # itemgetter は1要素の場合だけタプルではなく値を返す
+        gather = itemgetter(*indexes) if len(indexes) > 1 else lambda column: (column[indexes[0]],)
+        selected.key_columns = [array("q", gather(column)) for column in self.key_columns]
+        selected.metric_columns = [array("q", gather(column)) for column in self.metric_columns]
+        return selected
+
+    def where(self, dimension: str, exclude: Sequence[str] = ()) -> "CostRowStore":
+        """
+        指定ディメンションの値が exclude に含まれる行を除いた表を返す。
+        """
+        column = self.dimensions.index(dimension)
+        excluded = {self._ids[column][value] for value in exclude if value in self._ids[column]}
+        return self._select(i for i, key in enumerate(self.key_columns[column]) if key not in excluded)
+
+    def at_least(self, threshold: float) -> "CostRowStore":
+        """
+        金額が threshold 以上の行だけを残した表を返す。
+        """
+        scaled = round(threshold * AMOUNT_SCALE)
+        return self._select(i for i, amount in enumerate(self.amounts) if amount >= scaled)
 
-def lambda_handler(event, context) -> None:
-    main()
\ No newline at end of file
+    def top_n(self, n: int) -> "CostRowStore":
+        """
+        金額の大きい順に n 行を残した表を返す。
+        """
+        return self._select(nlargest(n, range(len(self.amounts)), key=self.amounts.__getitem__))
+
+    def rows(self) -> Iterator[Tuple[Tuple[str, ...], float]]:
+        """
+        (ディメンションの値のタプル, 先頭のメトリクスの金額) を行ごとに返す。
+        """
+        values = self._values
+        for position, amount in enumerate(self.amounts):
+            keys = tuple(values[c][column[position]] for c, column in enumerate(self.key_columns))
+            yield keys, amount / AMOUNT_SCALE
+
+    def metric_rows(self) -> Iterator[Tuple[Tuple[str, ...], Tuple[float, ...]]]:
+        """
+        (ディメンションの値のタプル, metrics の順の値のタプル) を行ごとに返す。
+        """
+        values = self._values
+        for position, amounts in enumerate(zip(*self.metric_columns)):
+            keys = tuple(values[c][column[position]] for c, column in enumerate(self.key_columns))
+            yield keys, tuple(amount / AMOUNT_SCALE for amount in amounts)
+
+    def to_dict(self) -> Dict[str, float]:
+        """
+        1ディメンションの表を {値: 金額} の辞書に変換する。
+        """
+        return {keys[0]: amount for keys, amount in self.rows()}
+
+
+class CostExplorer:
+    """
+    AWS Cost Explorer API を用いてコスト情報を取得するクラス。
+
+    cache を渡した場合、同一リクエストのレスポンスはキャッシュから返す。API の呼び出しは
+    scheduler (省略時はプロセス全体で共有するスケジューラ) を通し、priority の順に実行する。
+    exporter を渡した場合、取得した結果をページ単位で列指向ファイルにも書き出す。
+    base_filter を渡した場合、全てのリクエストの Filter にその条件を加える (And で結合する)。
+    metrics を渡した場合、全てのメトリクスを1つのリクエストの Metrics で取得する。先頭の
+    メトリクス (metric) をレポートの金額として使い、2つ目以降は extra_metrics として行に添える。
+    """
+
+    def __init__(
+        self,
+        client: boto3.client,
+        cache: Optional[ResponseCache] = None,
+        scheduler: Optional[ce_scheduler.RequestScheduler] = None,
+        priority: int = ce_scheduler.PRIORITY_INTERACTIVE,
+        exporter: Optional[cost_export.ExportWriter] = None,
+        base_filter: Optional[Dict[str, Any]] = None,
+        metrics: Optional[Sequence[str]] = None
+    ) -> None:
+        self.client = client
+        self.cache = cache
+        self.scheduler = scheduler or ce_scheduler.get_default_scheduler()
+        self.priority = priority
+        self.exporter = exporter
+        self.base_filter = base_filter
+        self.metrics: Tuple[str, ...] = tuple(metrics or (COST_METRIC,))
+
+    @property
+    def metric(self) -> str:
+        return self.metrics[0]
+
+    @property
+    def extra_metrics(self) -> Tuple[str, ...]:
+        return self.metrics[1:]
+
+    def _build_request(
+        self,
+        period: Dict[str, str],
+        include_credit: bool,
+        group_by_dimensions: Sequence[str] = (),
+        granularity: str = GRANULARITY
+    ) -> Dict[str, Any]:
+        """
+        get_cost_and_usage API に渡すパラメータを組み立てる。
+        """
+        request: Dict[str, Any] = {
+            "TimePeriod": period,
+            "Granularity": granularity,
+            "Metrics": list(self.metrics),
+            "GroupBy": [group_by_definition(key) for key in group_by_dimensions],
+        }
+        filters = [self.base_filter] if self.base_filter else []
+        if not include_credit:
+            filters.append({
+                "Not": {
+                    "Dimensions": {
+                        "Key": RECORD_TYPE_DIMENSION,
+                        "Values": [CREDIT_RECORD_TYPE]
+                    }
+                }
+            })
+        if len(filters) == 1:
+            request["Filter"] = filters[0]
+        elif filters:
+            request["Filter"] = {"And": filters}
+        return request
+
+    def iter_results(
+        self,
+        request: Dict[str, Any],
+        on_page: Optional[Callable[[bool], None]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        NextPageToken をたどりながら ResultsByTime の要素をページ単位で順に返す。
+
+        全ページを保持しないため、グループ数が多くてもメモリ使用量は1ページ分に収まる。
+        on_page を渡した場合、各ページの要素を返す前に、API を呼び出したページなら True、
+        キャッシュから返すページなら False を引数に呼び出す。
+        """
+        results = self._fetch_results(request, on_page)
+        if self.exporter is not None:
+            return self.exporter.export(request, results)
+        return results
+
+    def _fetch_results(
+        self,
+        request: Dict[str, Any],
+        on_page: Optional[Callable[[bool], None]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        cache_key: Optional[str] = None
+        if self.cache is not None:
+            cached = self.cache.lookup(request)
+            if cached is not None:
+                instrumentation.current().count("ce.cache_hits")
+                for response in cached:
+                    if on_page is not None:
+                        on_page(False)
+                    yield from response["ResultsByTime"]
+                return
+
+        next_page_token: Optional[str] = None
+        page = 0
+        while True:
+            params = dict(request)
+            if next_page_token:
+                params["NextPageToken"] = next_page_token
+            metrics = instrumentation.current()
+            try:
+                with metrics.span("ce.get_cost_and_usage"):
+                    response = self.scheduler.call(
+                        self.client.get_cost_and_usage, priority=self.priority, **params
+                    )
+            except (botocore.exceptions.ClientError, botocore.exceptions.BotoCoreError) as e:
+                # BotoCoreError はタイムアウト・接続エラーなど、レスポンスを受け取れなかったエラー
+                metrics.count("ce.errors")
+                logger.error(f"Failed to fetch cost and usage data: {e}")
+                raise RuntimeError(f"Error calling AWS Cost Explorer API: {e}") from e
+            if metrics.enabled:
+                self._record_response(metrics, response)
+
+            if self.cache is not None:
+                # キャッシュキー (namespace) は最初のページを保存する時点で決める
+                if cache_key is None:
+                    cache_key = self.cache.make_key(request)
+                self.cache.put_page(cache_key, page, response)
+            page += 1
+
+            if on_page is not None:
+                on_page(True)
+            yield from response["ResultsByTime"]
+
+            next_page_token = response.get("NextPageToken")
+            if not next_page_token:
+                if cache_key is not None:
+                    self.cache.commit(cache_key, self.cache.ttl_for(request), request)
+                return
+
+    @staticmethod
+    def _record_response(metrics: Any, response: Dict[str, Any]) -> None:
+        """
+        課金対象のリクエスト数と、レスポンスのグループ数・サイズを記録する。
+        """
+        metrics.count("ce.requests")
+        metrics.observe("ce.groups", sum(len(r.get("Groups", [])) for r in response.get("ResultsByTime", [])))
+        headers = response.get("ResponseMetadata", {}).get("HTTPHeaders", {})
+        if "content-length" in headers:
+            metrics.observe("ce.response_bytes", int(headers["content-length"]), unit="Bytes")
+
+    @staticmethod
+    def merge_results(results: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        ページ分割された ResultsByTime の要素のうち、先頭期間のものを1つにまとめる。
+        """
+        merged: Optional[Dict[str, Any]] = None
+        for result in results:
+            if merged is None:
+                merged = dict(result)
+                merged["Groups"] = list(result.get("Groups", []))
+            elif result.get("TimePeriod") == merged.get("TimePeriod"):
+                merged["Groups"].extend(result.get("Groups", []))
+        if merged is None:
+            raise RuntimeError("Error calling AWS Cost Explorer API: ResultsByTime is empty")
+        return merged
+
+    def iter_cost_and_usage(
+        self,
+        period: Dict[str, str],
+        include_credit: bool,
+        group_by_dimension: Optional[str] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        指定期間のコストと使用状況をページ単位で順に返す。
+        """
+        group_by = [group_by_dimension] if group_by_dimension else []
+        return self.iter_results(self._build_request(period, include_credit, group_by))
+
+    def get_cost_and_usage(
+        self,
+        period: Dict[str, str],
+        include_credit: bool,
+        group_by_dimension: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        指定期間のコストと使用状況を取得する。
+        """
+        return self.merge_results(
+            self.iter_cost_and_usage(period, include_credit, group_by_dimension)
+        )
+
+    def get_cost_and_usage_for_periods(
+        self,
+        periods: Sequence[Dict[str, str]],
+        include_credit: bool,
+        group_by_dimension: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        複数の期間のコストと使用状況を、QueryPlanner で最少の呼び出しにまとめて取得する。
+
+        Returns:
+            List[dict]: 期間ごとの結果 (merge_results() と同じ形)。periods の順
+        """
+        group_by = [group_by_dimension] if group_by_dimension else []
+        planner = QueryPlanner(self)
+        for period in periods:
+            planner.add(self._build_request(period, include_credit, group_by))
+        return [future.result() for future in planner.execute()]
+
+    def iter_cost_and_usage_by_record_type(
+        self,
+        period: Dict[str, str],
+        group_by_dimension: str = SERVICE_GROUP_DIMENSION,
+        granularity: str = GRANULARITY
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        クレジット適用前/後の両方を算出できるよう、指定ディメンションと
+        RECORD_TYPE の2軸でグルーピングしたデータをページ単位で順に返す。
+        """
+        return self.iter_results(
+            self._build_request(
+                period, include_credit=True,
+                group_by_dimensions=[group_by_dimension, RECORD_TYPE_DIMENSION],
+                granularity=granularity
+            )
+        )
+
+    def iter_cost_and_usage_by_dimensions(
+        self,
+        period: Dict[str, str],
+        include_credit: bool,
+        group_by_dimensions: Sequence[str]
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        指定した複数のディメンション (タグ・コストカテゴリを含む) でグルーピングした
+        コストと使用状況をページ単位で順に返す。
+        """
+        return self.iter_results(self._build_request(period, include_credit, group_by_dimensions))
+
+    def iter_hourly_cost_and_usage(
+        self,
+        start_date: str,
+        end_date: str,
+        include_credit: bool,
+        group_by_dimension: str = SERVICE_GROUP_DIMENSION
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        開始日～終了日 (終了日は含まない) の時間別のコストと使用状況を、ResultsByTime の要素
+        (1時間分) ごとに順に返す。HOURLY の上限の日数ごとに分けたリクエストを順に呼び出す。
+        """
+        for period in split_hourly_periods(start_date, end_date):
+            yield from self.iter_results(
+                self._build_request(period, include_credit, [group_by_dimension], granularity=HOURLY_GRANULARITY)
+            )
+
+    def get_cost_and_usage_by_record_type(
+        self,
+        period: Dict[str, str],
+        group_by_dimension: str = SERVICE_GROUP_DIMENSION
+    ) -> Dict[str, Any]:
+        """
+        クレジット適用前/後の両方を算出できるよう、指定ディメンションと
+        RECORD_TYPE の2軸でグルーピングしたデータを取得する。
+        """
+        return self.merge_results(
+            self.iter_cost_and_usage_by_record_type(period, group_by_dimension)
+        )
+
+    def split_by_credit(
+        self,
+        cost_and_usage_data: Union[Dict[str, Any], Iterable[Dict[str, Any]]]
+    ) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        """
+        RECORD_TYPE 付きのデータから、クレジット適用後/適用前のデータを組み立てる。
+
+        ResultsByTime の1要素、または iter_cost_and_usage_by_record_type() の
+        ページのストリームを受け取る。戻り値はどちらも
+        get_cost_and_usage(group_by_dimension=...) と同じ形式
+        (Keys が1要素の Groups を持つ ResultsByTime の1要素) となる。
+
+        Returns:
+            Tuple[Dict[str, Any], Dict[str, Any]]: (クレジット適用後, クレジット適用前)
+        """
+        pages = [cost_and_usage_data] if isinstance(cost_and_usage_data, dict) else cost_and_usage_data
+        table = CostRowStore(["KEY", RECORD_TYPE_DIMENSION], self.metrics)
+        time_period: Optional[Dict[str, str]] = None
+        for page in pages:
+            if time_period is None:
+                time_period = page.get("TimePeriod", {})
+            table.extend_groups(page.get("Groups", []))
+
+        after_credit = {keys[0]: amounts for keys, amounts in table.group_by("KEY").metric_rows()}
+        before_amounts = {
+            keys[0]: amounts
+            for keys, amounts in table.where(RECORD_TYPE_DIMENSION, exclude=[CREDIT_RECORD_TYPE])
+            .group_by("KEY").metric_rows()
+        }
+        # クレジットのみのキーも適用前の区分に 0 として残す
+        zeros = (0.0,) * len(self.metrics)
+        before_credit = {key: before_amounts.get(key, zeros) for key in after_credit}
+
+        return (
+            self.build_credit_view(after_credit, time_period or {}, self.metrics),
+            self.build_credit_view(before_credit, time_period or {}, self.metrics),
+        )
+
+    def add_credit_amount(
+        self,
+        group: Dict[str, Any],
+        after_credit: Dict[str, float],
+        before_credit: Dict[str, float]
+    ) -> None:
+        """
+        RECORD_TYPE 付きのグループ1件の金額 (先頭のメトリクス) を、クレジット適用後/適用前の集計に加算する。
+        """
+        keys = group["Keys"]
+        amount = float(group["Metrics"][self.metric]["Amount"])
+        key = keys[0]
+        record_type = keys[1] if len(keys) > 1 else None
+
+        after_credit[key] = after_credit.get(key, 0.0) + amount
+        if record_type != CREDIT_RECORD_TYPE:
+            before_credit[key] = before_credit.get(key, 0.0) + amount
+        else:
+            before_credit.setdefault(key, 0.0)
+
+    @staticmethod
+    def build_credit_view(
+        amounts: Dict[str, Union[float, Sequence[float]]],
+        time_period: Dict[str, str],
+        metrics: Sequence[str] = (COST_METRIC,)
+    ) -> Dict[str, Any]:
+        """
+        キーごとの金額から get_cost_and_usage(group_by_dimension=...) と同じ形式のデータを作る。
+        金額は metrics の順の値のタプル (メトリクスが1つなら float でもよい)。
+        """
+        return {
+            "TimePeriod": time_period,
+            "Total": {},
+            "Groups": [
+                {
+                    "Keys": [key],
+                    "Metrics": {
+                        metric: {"Amount": str(value), "Unit": "USD"}
+                        for metric, value in zip(metrics, amount if isinstance(amount, tuple) else (amount,))
+                    }
+                }
+                for key, amount in amounts.items()
+            ]
+        }
+
+    def get_total_costs(self, cost_and_usage_data: Dict[str, Any]) -> Tuple[float, ...]:
+        """
+        コストと使用状況のデータから、メトリクスごとの合計を metrics の順に取得する。
+
+        Total がない場合 (GroupBy を指定した場合) は Groups を1度だけ走査して全メトリクスの
+        正の金額を合算する。合計だけが必要なため、CostRowStore は作らずに走査しながら足し込む。
+        """
+        try:
+            if not cost_and_usage_data.get("Total"):
+                groups = cost_and_usage_data.get("Groups", [])
+                if not self.extra_metrics:
+                    metric = self.metric
+                    totals: Tuple[float, ...] = (
+                        sum(max(0.0, float(group["Metrics"][metric]["Amount"])) for group in groups),
+                    )
+                else:
+                    sums = [0.0] * len(self.metrics)
+                    for group in groups:
+                        values = group["Metrics"]
+                        for position, name in enumerate(self.metrics):
+                            amount = float(values[name]["Amount"])
+                            if amount > 0:
+                                sums[position] += amount
+                    totals = tuple(sums)
+                logger.info(f"Calculated total cost from Groups: {totals[0]:.2f} USD")
+                return totals
+
+            total = cost_and_usage_data["Total"]
+            return tuple(float(total[metric]["Amount"]) for metric in self.metrics)
+
+        except KeyError as e:
+            logger.error(f"Metric {e} is missing: {cost_and_usage_data}")
+            return (0.0,) * len(self.metrics)
+
+    def get_total_cost(self, cost_and_usage_data: Dict[str, Any]) -> float:
+        """
+        コストと使用状況のデータから合計費用 (先頭のメトリクス) を取得する。
+        """
+        return self.get_total_costs(cost_and_usage_data)[0]
+
+    def get_service_costs(
+        self,
+        cost_and_usage_data: Union[Dict[str, Any], Iterable[Dict[str, Any]]]
+    ) -> Iterator[ServiceCost]:
+        """
+        コストと使用状況のデータからサービスごとの費用を ServiceCost として順に返す。
+
+        ResultsByTime の1要素、または iter_cost_and_usage() のページのストリームを受け取る。
+        2つ目以降のメトリクスは同じグループから続けて読み、extra_amounts に入れる。
+        """
+        pages = [cost_and_usage_data] if isinstance(cost_and_usage_data, dict) else cost_and_usage_data
+        metric, extra_metrics = self.metric, self.extra_metrics
+        for page in pages:
+            groups = page.get("Groups", [])
+            if not extra_metrics:
+                for item in groups:
+                    yield ServiceCost(item["Keys"][0], float(item["Metrics"][metric]["Amount"]))
+                continue
+            for item in groups:
+                values = item["Metrics"]
+                yield ServiceCost(
+                    item["Keys"][0],
+                    float(values[metric]["Amount"]),
+                    extra_amounts=tuple(float(values[name]["Amount"]) for name in extra_metrics)
+                )
+
+
+class QueryPlanner:
+    """
+    複数の期間の get_cost_and_usage リクエストを、最少の呼び出しにまとめて実行する。
+
+    Filter・GroupBy・Metrics・Granularity が同じで、期間が重なるか隣接するリクエストを1つの
+    広い期間の呼び出しにまとめ、返ってきた ResultsByTime の各要素を期間が含まれるリクエストごとに
+    合算して、merge_results() と同じ形の結果に戻す。粒度は各リクエストのものをそのまま使うため、
+    MONTHLY のリクエストは、まとめた中の各リクエストの境界が月初 (または全体の始点・終点) に
+    そろう場合だけまとめる (まとめた呼び出しの各期間が元のリクエストの期間の和を超えないため、
+    ページ数が元のリクエストを個別に呼び出した場合より増えない)。
+
+    stats は GetCostAndUsage のページ単位の呼び出し数で、calls は実際に API を呼び出した
+    ページ数、requests は各リクエストを個別に呼び出した場合のページ数の推定値 (リクエストの
+    期間の結果を含んでいたページの数、最低1)、saved はその差。キャッシュから返したページは数えない。
+    """
+
+    def __init__(self, explorer: CostExplorer) -> None:
+        self.explorer = explorer
+        self.requests: List[Dict[str, Any]] = []
+        self.stats = {"requests": 0, "calls": 0, "saved": 0}
+        self._stats_lock = threading.Lock()
+
+    def add(self, request: Dict[str, Any]) -> int:
+        """
+        リクエスト (CostExplorer._build_request() の戻り値) を追加し、結果の番号を返す。
+        """
+        self.requests.append(request)
+        return len(self.requests) - 1
+
+    @staticmethod
+    def _shape(request: Dict[str, Any]) -> str:
+        return json.dumps({key: value for key, value in request.items() if key != "TimePeriod"}, sort_keys=True)
+
+    @staticmethod
+    def _monthly_aligned(periods: Sequence[Dict[str, str]]) -> bool:
+        """
+        各期間の境界が月初、または全体の始点・終点にそろっている (MONTHLY のまままとめられる) かを判定する。
+        """
+        start = min(period["Start"] for period in periods)
+        end = max(period["End"] for period in periods)
+        return all(
+            value[8:10] == "01" or value in (start, end)
+            for period in periods for value in (period["Start"], period["End"])
+        )
+
+    def plan(self) -> List[Dict[str, Any]]:
+        """
+        まとめた呼び出しのリストを返す。
+
+        Returns:
+            List[dict]: request (実際に送るリクエスト), members (含まれるリクエストの番号) をキーに含む辞書
+        """
+        by_shape: Dict[str, List[int]] = {}
+        for index, request in enumerate(self.requests):
+            by_shape.setdefault(self._shape(request), []).append(index)
+
+        calls = []
+        for indexes in by_shape.values():
+            indexes.sort(key=lambda i: (self.requests[i]["TimePeriod"]["Start"], self.requests[i]["TimePeriod"]["End"]))
+            groups: List[List[int]] = []
+            group_end = ""
+            monthly = self.requests[indexes[0]]["Granularity"] == GRANULARITY
+            for index in indexes:
+                period = self.requests[index]["TimePeriod"]
+                if groups and period["Start"] <= group_end and (
+                    not monthly
+                    or self._monthly_aligned([self.requests[i]["TimePeriod"] for i in groups[-1]] + [period])
+                ):
+                    groups[-1].append(index)
+                    group_end = max(group_end, period["End"])
+                else:
+                    groups.append([index])
+                    group_end = period["End"]
+            for members in groups:
+                calls.append({"request": self._merge(members), "members": members})
+        return calls
+
+    def _merge(self, members: List[int]) -> Dict[str, Any]:
+        periods = [self.requests[i]["TimePeriod"] for i in members]
+        return {
+            **self.requests[members[0]],
+            "TimePeriod": {
+                "Start": min(period["Start"] for period in periods),
+                "End": max(period["End"] for period in periods),
+            },
+        }
+
+    def _execute_call(self, call: Dict[str, Any], futures: List[Future]) -> None:
+        members = call["members"]
+        page = -1
+        billed_pages = 0
+        member_pages: List[set] = [set() for _ in members]
+
+        def on_page(billed: bool) -> None:
+            nonlocal page, billed_pages
+            page += 1
+            billed_pages += billed
+
+        try:
+            totals: List[Dict[str, Dict[str, Any]]] = [{} for _ in members]
+            groups: List[Dict[Tuple[str, ...], Dict[str, Any]]] = [{} for _ in members]
+            periods = [self.requests[i]["TimePeriod"] for i in members]
+            for result in self.explorer.iter_results(call["request"], on_page=on_page):
+                time_period = result["TimePeriod"]
+                for position, period in enumerate(periods):
+                    if not (period["Start"] <= time_period["Start"] and time_period["End"] <= period["End"]):
+                        continue
+                    member_pages[position].add(page)
+                    self._add_metrics(totals[position], result.get("Total", {}))
+                    member_groups = groups[position]
+                    for group in result.get("Groups", []):
+                        keys = tuple(group["Keys"])
+                        self._add_metrics(member_groups.setdefault(keys, {}), group["Metrics"])
+        except BaseException as e:
+            for index in members:
+                futures[index].set_exception(e)
+            return
+
+        if billed_pages:
+            self._record_pages(sum(max(1, len(pages)) for pages in member_pages), billed_pages)
+        for position, index in enumerate(members):
+            result: Dict[str, Any] = {
+                "TimePeriod": periods[position],
+                "Groups": [
+                    {"Keys": list(keys), "Metrics": self._format_metrics(metrics)}
+                    for keys, metrics in groups[position].items()
+                ],
+            }
+            if totals[position]:
+                result["Total"] = self._format_metrics(totals[position])
+            futures[index].set_result(result)
+
+    def _record_pages(self, estimated: int, billed: int) -> None:
+        """
+        まとめた呼び出し1回分のページ数を stats とメトリクス ce.planner.saved に加える。
+        """
+        saved = max(0, estimated - billed)
+        with self._stats_lock:
+            self.stats["requests"] += estimated
+            self.stats["calls"] += billed
+            self.stats["saved"] += saved
+        instrumentation.current().count("ce.planner.saved", saved)
+        logger.info(f"Query planner stats: {self.stats}")
+
+    @staticmethod
+    def _add_metrics(target: Dict[str, Any], metrics: Dict[str, Dict[str, str]]) -> None:
+        for name, value in metrics.items():
+            amount, unit = target.get(name, (0.0, value.get("Unit", "USD")))
+            target[name] = (amount + float(value["Amount"]), unit)
+
+    @staticmethod
+    def _format_metrics(metrics: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+        return {name: {"Amount": repr(amount), "Unit": unit} for name, (amount, unit) in metrics.items()}
+
+    def execute(self, executor: Optional[ThreadPoolExecutor] = None) -> List[Future]:
+        """
+        まとめた呼び出しを実行し、追加したリクエストごとの結果の Future を add() の順に返す。
+
+        executor を渡した場合は呼び出しを並行して行い、完了を待たずに返す。stats は各呼び出しの
+        結果を Future に設定する前に更新する。
+        """
+        futures: List[Future] = [Future() for _ in self.requests]
+        calls = self.plan()
+        self.stats = {"requests": 0, "calls": 0, "saved": 0}
+        logger.info(f"Query planner: {len(self.requests)} requests in {len(calls)} calls")
+        for call in calls:
+            if executor is None:
+                self._execute_call(call, futures)
+            else:
+                executor.submit(self._execute_call, call, futures)
+        return futures
+
+
+def get_client() -> boto3.client:
+    """
+    boto3 Cost Explorer クライアントを返す。接続・読み取りのタイムアウトは環境変数
+    CE_CONNECT_TIMEOUT_SECONDS, CE_READ_TIMEOUT_SECONDS で設定する。
+
+    環境変数 CE_ENDPOINT_URL を設定した場合は、そのエンドポイント (ce_stub_server などの
+    ローカルのスタンドイン) を呼び出す。
+    """
+    with instrumentation.current().span("get_client"):
+        return boto3.client(
+            "ce",
+            region_name=REGION_NAME,
+            endpoint_url=os.environ.get("CE_ENDPOINT_URL") or None,
+            config=ce_scheduler.get_client_config()
+        )
+
+
+def get_date_range() -> Tuple[str, str]:
+    """
+    集計期間を取得する。
+    """
+    start_date = date.today().replace(day=1).isoformat()
+    end_date = date.today().isoformat()
+    return start_date, end_date
+
+
+def split_hourly_periods(start_date: str, end_date: str, max_days: int = HOURLY_MAX_DAYS) -> List[Dict[str, str]]:
+    """
+    開始日～終了日 (終了日は含まない) を max_days 日以下の HOURLY 用の期間 (UTC の日時) に分割する。
+    """
+    periods = []
+    start = datetime.strptime(start_date, "%Y-%m-%d")
+    end = datetime.strptime(end_date, "%Y-%m-%d")
+    while start < end:
+        following = min(start + timedelta(days=max_days), end)
+        periods.append({"Start": start.strftime(HOURLY_TIME_FORMAT), "End": following.strftime(HOURLY_TIME_FORMAT)})
+        start = following
+    return periods
+
+
+def shift_months(day: date, months: int) -> date:
+    """
+    日付を months か月ずらす。移動先の月にその日がない場合は月末に丸める。
+    """
+    year, month = divmod(day.year * 12 + day.month - 1 + months, 12)
+    following = date(year + (month + 1) // 12, (month + 1) % 12 + 1, 1)
+    last_day = (following - timedelta(days=1)).day
+    return date(year, month + 1, min(day.day, last_day))
+
+
+def get_comparison_periods(
+    start_date: str,
+    end_date: str,
+    names: Sequence[str]
+) -> List[Tuple[str, Dict[str, str]]]:
+    """
+    集計期間と同じ日付範囲の比較対象の期間 (前月同期間・前年同期間) を返す。
+
+    End は API と同じく翌日を指すため、最終日をずらしてから1日足す。
+
+    Returns:
+        List[Tuple]: (表示名, TimePeriod) のリスト
+    """
+    months_by_name = {COMPARE_PREVIOUS_MONTH: -1, COMPARE_PREVIOUS_YEAR: -12}
+    start = date.fromisoformat(start_date)
+    last = date.fromisoformat(end_date) - timedelta(days=1)
+    periods = []
+    for name in names:
+        if name not in months_by_name:
+            raise ValueError(
+                f"COMPARE_PERIODS の値が不正です: {name} ({', '.join(months_by_name)} のいずれか)"
+            )
+        months = months_by_name[name]
+        periods.append((COMPARISON_LABELS[name], {
+            "Start": shift_months(start, months).isoformat(),
+            "End": (shift_months(last, months) + timedelta(days=1)).isoformat(),
+        }))
+    return periods
+
+
+def compare_section(section: Dict[str, Any], label: str, previous: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    レポート区分に、比較対象の期間の区分からの合計とサービスごとの増減を加えた区分を返す。
+
+    増減は changes (label, previous, delta, percent の辞書) としてサービスごとに、
+    合計の増減は comparisons として区分に追加する。比較対象の費用が0以下の場合、percent は None。
+    """
+    def change(current: float, before: float) -> Dict[str, Any]:
+        delta = current - before
+        percent = delta / before * 100 if before > 0 else None
+        return {"label": label, "previous": before, "delta": delta, "percent": percent}
+
+    previous_billings = {item.service_name: item.billing for item in previous.get("services", [])}
+    total_change = change(section["total"], previous["total"])
+    return {
+        **section,
+        "title": f"{section['title']}{renderer.format_changes([total_change])}",
+        "comparisons": [*section.get("comparisons", []), total_change],
+        "services": [
+            item.with_change(change(item.billing, previous_billings.get(item.service_name, 0.0)))
+            for item in section["services"]
+        ],
+    }
+
+
+def format_service_costs(
+    service_billings: Iterable[ServiceCost],
+    extra_metrics: Sequence[str] = ()
+) -> List[str]:
+    """
+    サービスごとの費用を表示用に整形する。
+
+    service_billings はジェネレータでもよく、1件ずつ消費しながら整形する。
+    2つ目以降のメトリクス (extra_metrics) の値と、比較対象の期間からの増減 (changes) があれば
+    金額の後ろに付ける。
+    """
+    formatted_services = []
+    for item in service_billings:
+        billing = item.billing
+        if billing >= MIN_REPORTED_BILLING:
+            metrics = renderer.format_metric_amounts(extra_metrics, item.extra_amounts)
+            changes = renderer.format_changes(item.changes)
+            formatted_services.append(f"- {item.service_name}: {billing:.2f} USD{metrics}{changes}")
+        else:
+            logger.debug(f"Excluded negligible cost: {item.service_name} ({billing:.5f})")
+    return formatted_services
+
+
+def build_cost_section(
+    explorer: CostExplorer,
+    pages: Iterable[Dict[str, Any]],
+    include_credit: bool,
+    start_day: str,
+    end_day: str,
+    group_by_dimension: str = SERVICE_GROUP_DIMENSION
+) -> Dict[str, Any]:
+    """
+    コストと使用状況のページから、レポートの1区分 (クレジット適用前/後) を作成する。
+
+    group_by_dimension は Keys の先頭のディメンション。SERVICE 以外 (タグなど) の場合も
+    区分の services (ServiceCost のリスト) には service_name として表示用の値を入れる。
+
+    explorer が複数のメトリクスを取得する場合は、全メトリクスを同じ表で集約し、
+    2つ目以降のメトリクスの名前 (extra_metrics) と合計 (extra_totals) を区分に加える。
+
+    Returns:
+        dict: title (見出し), total (合計費用), services (表示対象のサービス別費用),
+              include_credit, extra_metrics, extra_totals をキーに含む辞書
+    """
+    # ページを1つずつ行ストアに読み込み、合計・サービス別集約・しきい値の絞り込みを行ストアの上で行う
+    totals = [0.0] * len(explorer.metrics)
+    table = CostRowStore([group_by_dimension], explorer.metrics)
+    for page in pages:
+        if page.get("Total"):
+            totals = [a + b for a, b in zip(totals, explorer.get_total_costs(page))]
+        table.extend_groups(page.get("Groups", []))
+
+    with instrumentation.current().span("aggregate"):
+        totals = [a + b for a, b in zip(totals, table.totals(clip_negative=True))]
+        by_service = table.group_by(group_by_dimension)
+        services = [
+            ServiceCost(group_key_label(group_by_dimension, keys[0]), amounts[0], extra_amounts=amounts[1:])
+            for keys, amounts in by_service.at_least(MIN_REPORTED_BILLING).metric_rows()
+        ]
+    logger.debug(f"Excluded {len(by_service) - len(services)} services with negligible cost")
+
+    total_cost = totals[0]
+    extra_metrics = explorer.extra_metrics
+    credit_text = "後" if include_credit else "前"
+    title = f"{start_day}～{end_day}のクレジット適用{credit_text}費用は、{total_cost:.2f} USD"
+    title += f"{renderer.format_metric_amounts(extra_metrics, totals[1:])} です。"
+    return {
+        "title": title,
+        "total": total_cost,
+        "services": services,
+        "include_credit": include_credit,
+        "extra_metrics": list(extra_metrics),
+        "extra_totals": totals[1:],
+    }
+
+
+def section_to_report(section: Dict[str, Any]) -> Tuple[str, List[str]]:
+    """
+    レポートの区分を (タイトル, 整形済みサービス一覧) に変換する。
+    """
+    if "services" not in section:
+        return section["title"], list(section.get("lines", []))
+    return section["title"], format_service_costs(section["services"], section.get("extra_metrics", ()))
+
+
+def handle_cost_report(
+    explorer: CostExplorer,
+    period: Dict[str, str],
+    include_credit: bool,
+    start_day: str,
+    end_day: str,
+    cost_and_usage: Optional[Dict[str, Any]] = None,
+    comparison_periods: Sequence[Tuple[str, Dict[str, str]]] = ()
+) -> Tuple[str, List[str]]:
+    """
+    費用レポート（クレジット適用前/後）の取得と整形を行う。
+
+    cost_and_usage を渡した場合は API を呼び出さず、そのデータから整形する。
+    comparison_periods ((表示名, TimePeriod) のリスト、get_comparison_periods() を参照) を
+    渡した場合は、比較対象の期間を集計期間と並行して取得し、合計とサービスごとの増減を加える。
+    """
+    def fetch_section(target: Dict[str, str]) -> Dict[str, Any]:
+        pages = explorer.iter_cost_and_usage(
+            target,
+            include_credit=include_credit,
+            group_by_dimension=SERVICE_GROUP_DIMENSION
+        )
+        return build_cost_section(explorer, pages, include_credit, start_day, end_day)
+
+    with ThreadPoolExecutor(max_workers=max(len(comparison_periods), 1)) as executor:
+        previous_futures = [
+            (label, executor.submit(fetch_section, target)) for label, target in comparison_periods
+        ]
+        if cost_and_usage is None:
+            section = fetch_section(period)
+        else:
+            section = build_cost_section(explorer, [cost_and_usage], include_credit, start_day, end_day)
+        for label, future in previous_futures:
+            section = compare_section(section, label, future.result())
+
+    return section_to_report(section)
+
+
+def build_combined_cost_sections(
+    explorer: CostExplorer,
+    period: Dict[str, str],
+    start_day: str,
+    end_day: str,
+    group_by_dimension: str = SERVICE_GROUP_DIMENSION,
+    pages: Optional[Iterable[Dict[str, Any]]] = None
+) -> List[Dict[str, Any]]:
+    """
+    クレジット適用後/適用前のレポート区分を1回のAPI呼び出しで作成する。
+
+    pages (指定ディメンションと RECORD_TYPE でグルーピングした結果) を渡した場合は
+    API を呼び出さず、そのデータから作成する。
+
+    Returns:
+        List[dict]: [適用後の区分, 適用前の区分]
+    """
+    if pages is None:
+        pages = explorer.iter_cost_and_usage_by_record_type(
+            period,
+            group_by_dimension=group_by_dimension
+        )
+    after_credit, before_credit = explorer.split_by_credit(pages)
+    return [
+        build_cost_section(explorer, [after_credit], True, start_day, end_day, group_by_dimension),
+        build_cost_section(explorer, [before_credit], False, start_day, end_day, group_by_dimension),
+    ]
+
+
+def handle_combined_cost_report(
+    explorer: CostExplorer,
+    period: Dict[str, str],
+    start_day: str,
+    end_day: str
+) -> Tuple[Tuple[str, List[str]], Tuple[str, List[str]]]:
+    """
+    クレジット適用後/適用前の費用レポートを1回のAPI呼び出しで取得・整形する。
+
+    Returns:
+        Tuple: ((適用後タイトル, 適用後サービス一覧), (適用前タイトル, 適用前サービス一覧))
+    """
+    section_after, section_before = build_combined_cost_sections(explorer, period, start_day, end_day)
+    return section_to_report(section_after), section_to_report(section_before)
+
+
+def build_incremental_cost_sections(
+    explorer: CostExplorer,
+    store: DailyCostStore,
+    period: Dict[str, str],
+    start_day: str,
+    end_day: str,
+    restatement_days: int = DEFAULT_RESTATEMENT_DAYS
+) -> List[Dict[str, Any]]:
+    """
+    未取得の日 (と直近 restatement_days 日) だけを DAILY 粒度で取得してストアに反映し、
+    ストアから当月累計のクレジット適用後/適用前のレポート区分を作成する。
+
+    Returns:
+        List[dict]: [適用後の区分, 適用前の区分]
+    """
+    fetch_start = store.get_fetch_start(period["Start"], period["End"], restatement_days)
+    if fetch_start < period["End"]:
+        daily_amounts: Dict[str, Tuple[Dict[str, float], Dict[str, float]]] = {}
+        for result in explorer.iter_cost_and_usage_by_record_type(
+            {"Start": fetch_start, "End": period["End"]},
+            granularity=DAILY_GRANULARITY
+        ):
+            day = result["TimePeriod"]["Start"][:10]
+            after_credit, before_credit = daily_amounts.setdefault(day, ({}, {}))
+            for group in result.get("Groups", []):
+                explorer.add_credit_amount(group, after_credit, before_credit)
+        row_count = store.replace_days(fetch_start, period["End"], daily_amounts)
+        logger.info(f"Stored {row_count} daily cost rows from {fetch_start}")
+
+    after_credit, before_credit = store.get_period_amounts(period["Start"], period["End"])
+    return [
+        build_cost_section(
+            explorer, [explorer.build_credit_view(after_credit, period, explorer.metrics)], True, start_day, end_day
+        ),
+        build_cost_section(
+            explorer, [explorer.build_credit_view(before_credit, period, explorer.metrics)], False, start_day, end_day
+        ),
+    ]
+
+
+def handle_incremental_cost_report(
+    explorer: CostExplorer,
+    store: DailyCostStore,
+    period: Dict[str, str],
+    start_day: str,
+    end_day: str,
+    restatement_days: int = DEFAULT_RESTATEMENT_DAYS
+) -> Tuple[Tuple[str, List[str]], Tuple[str, List[str]]]:
+    """
+    未取得の日だけを取得し、ストアから当月累計のクレジット適用後/適用前の費用レポートを作成する。
+
+    Returns:
+        Tuple: ((適用後タイトル, 適用後サービス一覧), (適用前タイトル, 適用前サービス一覧))
+    """
+    section_after, section_before = build_incremental_cost_sections(
+        explorer, store, period, start_day, end_day, restatement_days
+    )
+    return section_to_report(section_after), section_to_report(section_before)
+
+
+def build_anomaly_section(
+    explorer: CostExplorer,
+    detector: AnomalyDetector,
+    end_date: str,
+    restatement_days: int = DEFAULT_RESTATEMENT_DAYS
+) -> Optional[Dict[str, Any]]:
+    """
+    未反映の日のサービス別費用 (クレジット適用前) を DAILY 粒度で取得して検知器に反映し、
+    急増を検知したサービスのレポート区分を作成する。検知がなければ None を返す。
+
+    直近 restatement_days 日は費用が遅れて計上され (Estimated)、後から金額が変わるため反映しない。
+    検知器は各日を1度だけ反映するので、計上途中の日を反映すると EWMA・分散が低い値に偏り続ける。
+
+    Args:
+        end_date: 当日 (集計期間の終了日、YYYY-MM-DD)。end_date の restatement_days 日前の前日までを反映する
+    """
+    settled_end = (date.fromisoformat(end_date) - timedelta(days=restatement_days)).isoformat()
+    fetch_start = detector.get_fetch_start(settled_end)
+    if fetch_start >= settled_end:
+        return None
+
+    daily_amounts: Dict[str, Dict[str, float]] = {}
+    for result in explorer.iter_cost_and_usage_by_record_type(
+        {"Start": fetch_start, "End": settled_end},
+        granularity=DAILY_GRANULARITY
+    ):
+        day = result["TimePeriod"]["Start"][:10]
+        if day >= settled_end:
+            continue
+        before_credit = daily_amounts.setdefault(day, {})
+        for group in result.get("Groups", []):
+            explorer.add_credit_amount(group, {}, before_credit)
+
+    anomalies = []
+    for day in sorted(daily_amounts):
+        anomalies.extend(detector.update(day, daily_amounts[day]))
+    detector.save()
+    if not anomalies:
+        return None
+
+    lines = [
+        f"- {item['service_name']} ({item['day']}): {item['billing']:.2f} USD"
+        f" (想定 {item['expected']:.2f} USD, z={item['z_score']:.1f})"
+        for item in anomalies
+    ]
+    title = f"日次費用の急増を検知したサービスが {len(anomalies)} 件あります。"
+    return {"title": title, "lines": lines, "anomalies": anomalies}
+
+
+def build_drilldown_section(
+    explorer: CostExplorer,
+    period: Dict[str, str],
+    dimensions: Sequence[str],
+    start_day: str,
+    end_day: str,
+    top_n: int = DEFAULT_DRILLDOWN_TOP_N,
+    max_parents: int = DEFAULT_DRILLDOWN_MAX_PARENTS,
+    include_credit: bool = False
+) -> Dict[str, Any]:
+    """
+    2つのディメンション (例: SERVICE と USAGE_TYPE / LINKED_ACCOUNT / TAG:Project) で
+    グルーピングした費用から、親ごとの上位 top_n 件の子と「その他」のレポート区分を作成する。
+
+    期間が1か月に収まる場合は各組み合わせが1回だけ返るため、ページを読みながら DrillDown で
+    選ぶ。複数の月にまたがる場合は、月ごとに返る同じ組み合わせを CostRowStore で合算してから選ぶ。
+
+    Returns:
+        dict: title, lines (親と、字下げした子の行), drilldown (DrillDown.results() の戻り値) をキーに含む辞書
+    """
+    if len(dimensions) != 2:
+        raise ValueError(f"ドリルダウンには2つのディメンションを指定してください: {list(dimensions)}")
+    parent_key, child_key = dimensions
+    drilldown = DrillDown(top_n)
+    pages = explorer.iter_cost_and_usage_by_dimensions(period, include_credit, dimensions)
+    last_day = (date.fromisoformat(period["End"][:10]) - timedelta(days=1)).isoformat()
+    if period["Start"][:7] == last_day[:7]:
+        for page in pages:
+            drilldown.extend_groups(page.get("Groups", []), explorer.metric)
+    else:
+        table = CostRowStore(dimensions, (explorer.metric,))
+        for page in pages:
+            table.extend_groups(page.get("Groups", []))
+        for (parent, child), amount in table.group_by(*dimensions).rows():
+            drilldown.add(parent, child, amount)
+
+    with instrumentation.current().span("aggregate.drilldown"):
+        parents = drilldown.results(max_parents)
+        lines = []
+        for item in parents:
+            if item["total"] < MIN_REPORTED_BILLING:
+                continue
+            lines.append(f"- {group_key_label(parent_key, item['name'])}: {item['total']:.2f} USD")
+            other, other_count = item["other"], item["other_count"]
+            for child, amount in item["children"]:
+                if amount < MIN_REPORTED_BILLING:
+                    other += amount
+                    other_count += 1
+                    continue
+                lines.append(f"    - {group_key_label(child_key, child)}: {amount:.2f} USD")
+            if other_count:
+                lines.append(f"    - {DRILLDOWN_OTHER_LABEL} ({other_count}件): {other:.2f} USD")
+        hidden = len(drilldown.parent_totals) - len(parents)
+        if hidden > 0:
+            hidden_total = sum(drilldown.parent_totals.values()) - sum(item["total"] for item in parents)
+            lines.append(f"- {DRILLDOWN_OTHER_LABEL} ({hidden}件): {hidden_total:.2f} USD")
+
+    credit_text = "後" if include_credit else "前"
+    title = (
+        f"{start_day}～{end_day}の {parent_key} × {child_key} 別のクレジット適用{credit_text}費用"
+        f" (上位 {top_n} 件) です。"
+    )
+    return {"title": title, "lines": lines, "drilldown": parents}
+
+
+def format_hour(hour: str) -> str:
+    """
+    HOURLY の期間の開始日時 (UTC) を "MM/DD HH時" に整形する。
+    """
+    return datetime.strptime(hour, HOURLY_TIME_FORMAT).strftime("%m/%d %H時")
+
+
+def build_hourly_section(
+    explorer: CostExplorer,
+    start_date: str,
+    end_date: str,
+    start_day: str,
+    end_day: str,
+    top_n: int = DEFAULT_HOURLY_TOP_N,
+    include_credit: bool = False
+) -> Dict[str, Any]:
+    """
+    時間別の費用から、合計の大きい上位 top_n 件のサービスの合計・ピークの時間・p95 の
+    レポート区分を作成する。時間別の結果はページを読みながら HourlyAggregator に畳み込む。
+
+    Returns:
+        dict: title, lines, hourly (HourlyAggregator.results() の上位 top_n 件) をキーに含む辞書
+    """
+    hour_count = (date.fromisoformat(end_date) - date.fromisoformat(start_date)).days * 24
+    aggregator = HourlyAggregator(max(hour_count, 0))
+    for result in explorer.iter_hourly_cost_and_usage(start_date, end_date, include_credit):
+        aggregator.extend_result(result, explorer.metric)
+
+    with instrumentation.current().span("aggregate.hourly"):
+        results = aggregator.results()
+        shown = [item for item in results[:top_n] if item["total"] >= MIN_REPORTED_BILLING]
+        lines = [
+            f"- {item['name']}: 合計 {item['total']:.2f} USD / ピーク {item['peak']:.2f} USD"
+            f" ({format_hour(item['peak_hour'])}) / p{aggregator.percentile} {item['p95']:.2f} USD"
+            for item in shown
+        ]
+        hidden = results[len(shown):]
+        if hidden:
+            hidden_total = sum(item["total"] for item in hidden)
+            lines.append(f"- {DRILLDOWN_OTHER_LABEL} ({len(hidden)}件): {hidden_total:.2f} USD")
+
+    credit_text = "後" if include_credit else "前"
+    title = f"{start_day}～{end_day}の時間別 (UTC) のクレジット適用{credit_text}費用です。"
+    peak = aggregator.peak_hour()
+    if peak is not None:
+        title += f" ピークは {format_hour(peak[0])} の {peak[1]:.2f} USD です。"
+    return {"title": title, "lines": lines, "hourly": shown}
+
+
+def print_report(title: str, services_cost: List[str]) -> None:
+    """
+    レポートを標準出力に表示する。
+    """
+    print("------------------------------------------------------")
+    print(title)
+    if services_cost:
+        print("\n".join(services_cost))
+    else:
+        print("サービスごとの費用データはありません。")
+    print("------------------------------------------------------\n")
+
+def post_to_teams(title: str, services_cost: List[str]) -> None:
+    """
+    Teams WebhookにAdaptive Card形式でメッセージを送信する。
+    """
+    teams_webhook_url = os.environ.get("TEAMS_WEBHOOK_URL")
+    if not teams_webhook_url:
+        raise ValueError("TEAMS_WEBHOOK_URL is環境変数で設定されていません。")
+
+    # タイムアウト・再送付きで Teams Webhook に POST する
+    report = {"title": "", "sections": [{"title": title, "lines": services_cost}]}
+    dispatcher = notifier.NotificationDispatcher([notifier.TeamsSink(teams_webhook_url)], max_workers=1)
+    try:
+        with instrumentation.current().span("post_to_teams"):
+            result = dispatcher.dispatch([report])[0]
+    finally:
+        dispatcher.close()
+
+    if not result["delivered"]:
+        logger.error(f"Teams Webhookへの通知に失敗しました: {result['error']}")
+        raise RuntimeError("Teams通知に失敗しました。")
+    logger.info("Teamsへの通知に成功しました。")
+
+
+def create_dispatcher(config: dict) -> Optional[notifier.NotificationDispatcher]:
+    """
+    設定された通知先 (Teams, Slack, SNS, ファイル) へのディスパッチャを作成する。
+    通知先がなければ None を返す。
+    """
+    sinks = notifier.build_sinks(config)
+    if not sinks:
+        return None
+    return notifier.NotificationDispatcher(sinks, max_attempts=config["NOTIFY_MAX_ATTEMPTS"])
+
+
+def finish_dispatch(dispatcher: notifier.NotificationDispatcher, deliveries: List[Future]) -> None:
+    """
+    送信中の通知の完了を待ってディスパッチャを閉じる。失敗した通知先があれば例外を送出する。
+    """
+    try:
+        wait(deliveries)
+        results = [delivery.result() for delivery in deliveries]
+    finally:
+        dispatcher.close()
+    logger.info(f"Notification metrics: {dispatcher.metrics}")
+
+    failed = sorted({result["sink"] for result in results if not result["delivered"]})
+    if failed:
+        raise RuntimeError(f"通知に失敗しました: {', '.join(failed)}")
+
+
+def dispatch_reports(config: dict, reports: List[Dict[str, Any]]) -> None:
+    """
+    設定された全ての通知先 (Teams, Slack, SNS, ファイル) へレポートを並行して送信する。
+
+    レポートは title と sections (build_cost_section() の戻り値のリスト) を持つ辞書。
+    """
+    dispatcher = create_dispatcher(config)
+    if dispatcher is None:
+        return
+    finish_dispatch(dispatcher, [delivery for report in reports for delivery in dispatcher.submit(report)])
+
+def get_account_id() -> str:
+    """
+    AWSアカウントIDを取得する。環境変数 STS_ENDPOINT_URL を設定した場合は、そのエンドポイントを呼び出す。
+    """
+    try:
+        with instrumentation.current().span("get_account_id"):
+            endpoint_url = os.environ.get("STS_ENDPOINT_URL")
+            sts_client = boto3.client("sts", endpoint_url=endpoint_url) if endpoint_url else boto3.client("sts")
+            account_id = sts_client.get_caller_identity()["Account"]
+        return account_id
+    except botocore.exceptions.ClientError as e:
+        logger.error(f"Failed to fetch AWS Account ID: {e}")
+        raise RuntimeError("AWS Account IDの取得に失敗しました。") from e
+
+def build_report_sections(
+    explorer: CostExplorer,
+    config: dict,
+    account_future: Future,
+    period: Dict[str, str],
+    start_day: str,
+    end_day: str
+) -> List[Dict[str, Any]]:
+    """
+    クレジット適用後/適用前のレポート区分を作成する。
+
+    DAILY_STORE_DIR が設定されていればアカウントIDごとのストアから当月累計を集計する
+    (ストアの名前空間にアカウントIDを使うため、STS の完了を待つ)。
+    """
+    if config["DAILY_STORE_DIR"]:
+        # 未取得の日だけを DAILY 粒度で取得し、ローカルのストアから当月累計を集計する
+        store = DailyCostStore(config["DAILY_STORE_DIR"], namespace=account_future.result())
+        try:
+            return build_incremental_cost_sections(
+                explorer, store, period, start_day=start_day, end_day=end_day,
+                restatement_days=config["RESTATEMENT_DAYS"]
+            )
+        finally:
+            store.close()
+
+    # クレジット適用後/適用前を1回の Cost Explorer 呼び出しで取得する
+    return build_combined_cost_sections(explorer, period, start_day=start_day, end_day=end_day)
+
+
+def detect_anomalies(
+    explorer: CostExplorer,
+    config: dict,
+    account_future: Future,
+    end_date: str
+) -> Optional[Dict[str, Any]]:
+    """
+    アカウントIDごとの状態を使って日次費用の急増を検知し、レポート区分を返す。
+    """
+    detector = AnomalyDetector(
+        config["ANOMALY_STATE_DIR"],
+        namespace=account_future.result(),
+        z_threshold=config["ANOMALY_Z_THRESHOLD"],
+        min_increase=config["ANOMALY_MIN_INCREASE"]
+    )
+    try:
+        return build_anomaly_section(explorer, detector, end_date, config["RESTATEMENT_DAYS"])
+    finally:
+        detector.close()
+
+
+def get_cost_metrics(config: dict) -> Tuple[str, ...]:
+    """
+    COST_METRICS のメトリクスを検証して返す。不正な名前は ValueError。
+    """
+    metrics = tuple(config["COST_METRICS"])
+    unknown = [name for name in metrics if name not in SUPPORTED_METRICS]
+    if not metrics or unknown or len(set(metrics)) != len(metrics):
+        raise ValueError(
+            f"COST_METRICS の値が不正です: {','.join(metrics)} ({', '.join(SUPPORTED_METRICS)} から重複なく指定)"
+        )
+    # 日別のストアは先頭のメトリクスのクレジット適用後/適用前の金額だけを保存する
+    if len(metrics) > 1 and config["DAILY_STORE_DIR"]:
+        raise ValueError("DAILY_STORE_DIR を設定した場合、COST_METRICS には1つのメトリクスだけを指定してください。")
+    return metrics
+
+
+def get_budget_rules(config: dict) -> List[Dict[str, Any]]:
+    """
+    BUDGET_RULES (JSON) または BUDGET_RULES_FILE (JSON ファイルのパス) の予算ルールを読み込む。
+    ルールがなければ空のリストを返す。
+    """
+    text = config["BUDGET_RULES"]
+    if config["BUDGET_RULES_FILE"]:
+        with open(config["BUDGET_RULES_FILE"], encoding="utf-8") as f:
+            text = f.read()
+    if not text:
+        return []
+    rules = load_budget_rules(text, compare_periods=config["COMPARE_PERIODS"])
+    # 状態を保存しないと毎回全ての超過を通知してしまうため、保存先を必須にする
+    if rules and not config["BUDGET_STATE_DIR"]:
+        raise ValueError("BUDGET_STATE_DIR is not set in the environment variables.")
+    return rules
+
+
+def format_budget_change(change: Dict[str, Any]) -> str:
+    """
+    状態が変化した予算ルールを表示用の1行に整形する。
+    """
+    rule, value = change["rule"], change["value"]
+    target = rule["service"] or "合計"
+    if rule["type"] == BUDGET_RULE_PERCENT_CHANGE:
+        detail = f"{target} {COMPARISON_LABELS[rule['compare']]}比 {value:+.1f}% / 上限 {rule['limit']:+.1f}%"
+    else:
+        detail = f"{target} {value:.2f} USD / 予算 {rule['limit']:.2f} USD"
+    previous_label = BUDGET_STATE_LABELS[change["previous_state"]]
+    return f"- {rule['id']}: {previous_label} → {BUDGET_STATE_LABELS[change['state']]} ({detail})"
+
+
+def evaluate_budget_rules(
+    config: dict,
+    rules: Sequence[Dict[str, Any]],
+    account_id: str,
+    sections: List[Dict[str, Any]]
+) -> Optional[Dict[str, Any]]:
+    """
+    アカウントIDごとの前回の状態と比べて予算ルールを判定し、状態が変化したルールの
+    レポート区分を返す。変化がなければ None を返す。
+    """
+    engine = BudgetRuleEngine(config["BUDGET_STATE_DIR"], rules, namespace=account_id)
+    try:
+        changes = engine.evaluate(sections)
+        engine.save()
+    finally:
+        engine.close()
+    if not changes:
+        return None
+    title = f"予算ルールの状態が変化したものが {len(changes)} 件あります。"
+    return {"title": title, "lines": [format_budget_change(change) for change in changes], "changes": changes}
+
+
+def _spec_string_list(spec: Dict[str, Any], key: str, default: Sequence[str] = ()) -> List[str]:
+    """
+    レポートの指定の key の値 (文字列のリスト) を返す。リスト以外や文字列以外の要素は ValueError。
+    """
+    values = spec.get(key, default)
+    if not isinstance(values, (list, tuple)) or not all(isinstance(value, str) for value in values):
+        raise ValueError(f"{key} は文字列のリストで指定してください: {values!r}")
+    return list(values)
+
+
+def parse_report_spec(spec: Any) -> Dict[str, Any]:
+    """
+    Lambda のイベントで渡されたレポートの指定を検証し、既定値を補って返す。不正な指定は ValueError。
+
+    指定のキー (全て省略可):
+        id: 結果を識別する任意の値
+        start, end: 集計期間 (YYYY-MM-DD、end は最終日の翌日。省略時は当月累計)
+        accounts: 対象のリンクアカウントIDのリスト (省略時は全て)
+        dimensions: グルーピングするディメンションのリスト。2つ指定するとドリルダウンの区分を加える
+                    (省略時は ["SERVICE"])
+        credit: "both" (クレジット適用後/適用前、既定), "after", "before"
+        compare: 比較する期間の名前のリスト (COMPARE_PERIODS と同じ)
+        sinks: 通知先 (teams_webhook_url, slack_webhook_url, sns_topic_arn, output_file)。
+               省略時は環境変数の通知先、{} の場合は通知しない
+    """
+    if not isinstance(spec, dict):
+        raise ValueError(f"レポートの指定は JSON オブジェクトで渡してください: {spec!r}")
+    unknown = sorted(set(spec) - set(REPORT_SPEC_KEYS))
+    if unknown:
+        raise ValueError(f"レポートの指定に不明なキーがあります: {', '.join(unknown)}")
+
+    default_start, default_end = get_date_range()
+    start, end = str(spec.get("start", default_start)), str(spec.get("end", default_end))
+    try:
+        start_date, end_date = date.fromisoformat(start), date.fromisoformat(end)
+    except ValueError as e:
+        raise ValueError(f"期間の指定が不正です: start={start}, end={end}") from e
+    if start_date >= end_date:
+        raise ValueError(f"start は end より前の日付を指定してください: start={start}, end={end}")
+
+    dimensions = _spec_string_list(spec, "dimensions", [SERVICE_GROUP_DIMENSION])
+    if len(dimensions) not in (1, 2):
+        raise ValueError(f"dimensions には1つまたは2つのディメンションを指定してください: {dimensions}")
+    credit = str(spec.get("credit", CREDIT_MODE_BOTH)).lower()
+    if credit not in CREDIT_MODES:
+        raise ValueError(f"credit の値が不正です: {credit} ({', '.join(CREDIT_MODES)} のいずれか)")
+    sinks = spec.get("sinks")
+    if sinks is not None:
+        unknown = sorted(set(sinks) - set(SINK_CONFIG_KEYS)) if isinstance(sinks, dict) else [repr(sinks)]
+        if unknown:
+            raise ValueError(f"sinks に不明な通知先があります: {', '.join(unknown)}")
+
+    return {
+        "id": spec.get("id"),
+        "period": {"Start": start, "End": end},
+        "accounts": _spec_string_list(spec, "accounts"),
+        "dimensions": dimensions,
+        "credit": credit,
+        "comparison_periods": get_comparison_periods(
+            start, end, [name.lower() for name in _spec_string_list(spec, "compare")]
+        ),
+        "sinks": sinks,
+    }
+
+
+def extract_report_specs(event: Dict[str, Any]) -> Optional[List[Tuple[Optional[str], Any]]]:
+    """
+    Lambda のイベントからレポートの指定を取り出す。指定がない場合 (スケジュール実行など) は None。
+
+    - SQS: Records の各 body (JSON) が1件の指定、または {"reports": [指定, ...]}
+    - EventBridge: detail が1件の指定、または {"reports": [...]}
+    - 直接呼び出し: イベント自体が1件の指定、または {"reports": [...]}
+
+    Returns:
+        List[Tuple]: (SQS のメッセージID (それ以外は None), 指定) のリスト
+    """
+    def from_payload(payload: Any, source: Optional[str]) -> List[Tuple[Optional[str], Any]]:
+        if isinstance(payload, dict) and "reports" in payload:
+            return [(source, spec) for spec in payload["reports"]]
+        return [(source, payload)] if payload else []
+
+    specs: List[Tuple[Optional[str], Any]] = []
+    if "Records" in event:
+        for record in event["Records"]:
+            body = record.get("body", "")
+            try:
+                payload = json.loads(body)
+            except ValueError:
+                # 解析できない本文は、そのまま不正な指定として結果に含める
+                payload = body
+            specs.extend(from_payload(payload, record.get("messageId")) or [(record.get("messageId"), {})])
+    elif "detail" in event:
+        specs = from_payload(event["detail"], None)
+    elif "reports" in event or any(key in event for key in REPORT_SPEC_KEYS):
+        specs = from_payload(event, None)
+    return specs or None
+
+
+def spec_config(config: dict, sinks: Optional[Dict[str, str]]) -> dict:
+    """
+    レポートの指定の sinks で通知先を置き換えた設定を返す (sinks が None なら config のまま)。
+    """
+    if sinks is None:
+        return config
+    return {
+        **config,
+        "USE_TEAMS_POST": bool(sinks.get("teams_webhook_url")),
+        **{config_key: sinks.get(key) for key, config_key in SINK_CONFIG_KEYS.items()},
+    }
+
+
+def submit_spec_queries(
+    executor: ThreadPoolExecutor,
+    planner: QueryPlanner,
+    explorer: CostExplorer,
+    spec: Dict[str, Any]
+) -> Dict[str, Any]:
+    """
+    レポートの指定に必要な Cost Explorer の取得を準備する。
+
+    本体と比較対象の期間のリクエストは planner に追加し (他の指定と期間が重なるか隣接すれば
+    1回の呼び出しにまとめられる)、ドリルダウンは executor に投入する。結果は
+    assemble_spec_sections() で組み立てる。
+    """
+    period = spec["period"]
+    dimensions = [spec["dimensions"][0], RECORD_TYPE_DIMENSION]
+    queries: Dict[str, Any] = {
+        "explorer": explorer,
+        "start_day": datetime.strptime(period["Start"], "%Y-%m-%d").strftime("%m/%d"),
+        "end_day": (datetime.strptime(period["End"], "%Y-%m-%d") - timedelta(days=1)).strftime("%m/%d"),
+        "sections": planner.add(explorer._build_request(period, True, dimensions)),
+        "comparisons": [
+            (label, planner.add(explorer._build_request(comparison_period, True, dimensions)))
+            for label, comparison_period in spec["comparison_periods"]
+        ],
+        "drilldown": None,
+    }
+    if len(spec["dimensions"]) == 2:
+        queries["drilldown"] = executor.submit(
+            build_drilldown_section, explorer, period, spec["dimensions"], queries["start_day"], queries["end_day"],
+            include_credit=spec["credit"] == CREDIT_MODE_AFTER
+        )
+    return queries
+
+
+def assemble_spec_sections(
+    spec: Dict[str, Any],
+    queries: Dict[str, Any],
+    results: List[Future]
+) -> List[Dict[str, Any]]:
+    """
+    submit_spec_queries() の準備と QueryPlanner.execute() の結果から、指定に応じたレポート区分の
+    リストを作成する。
+    """
+    def combined_sections(ticket: int) -> List[Dict[str, Any]]:
+        return build_combined_cost_sections(
+            queries["explorer"], spec["period"], queries["start_day"], queries["end_day"],
+            spec["dimensions"][0], pages=[results[ticket].result()]
+        )
+
+    sections = combined_sections(queries["sections"])
+    for label, ticket in queries["comparisons"]:
+        sections = [
+            compare_section(section, label, previous)
+            for section, previous in zip(sections, combined_sections(ticket))
+        ]
+    after_credit, before_credit = sections
+    sections = {
+        CREDIT_MODE_BOTH: [after_credit, before_credit],
+        CREDIT_MODE_AFTER: [after_credit],
+        CREDIT_MODE_BEFORE: [before_credit],
+    }[spec["credit"]]
+    if queries["drilldown"] is not None:
+        sections = sections + [queries["drilldown"].result()]
+    return sections
+
+
+def record_spec_error(result: Dict[str, Any], error: Exception) -> None:
+    """
+    レポートの指定の実行結果を失敗 (status="error") にする。RuntimeError・ValueError 以外の
+    想定外の例外は、例外の型を error に含めてログに出力する。
+    """
+    if isinstance(error, (RuntimeError, ValueError)):
+        message = str(error)
+    else:
+        message = f"{type(error).__name__}: {error}"
+        logger.error(f"Unexpected error in report spec {result.get('id')!r}: {message}")
+    result.update(status="error", error=message)
+
+
+def run_report_specs(
+    specs: Sequence[Tuple[Optional[str], Any]],
+    client: boto3.client,
+    account_id: str,
+    config: Optional[dict] = None
+) -> List[Dict[str, Any]]:
+    """
+    複数のレポートの指定をまとめて実行する。
+
+    全ての指定で Cost Explorer クライアント・レスポンスのキャッシュ・スレッドプールを共有し、
+    各指定の取得を先に全て投入してから、指定の順に組み立てて表示・通知する。期間が重なるか
+    隣接する指定の取得は QueryPlanner で1回の呼び出しにまとめる。通知先が同じ指定は
+    1つのディスパッチャ (接続プール) を共有する。1件の失敗は他の指定に影響しない。
+
+    Args:
+        specs: extract_report_specs() の戻り値
+
+    Returns:
+        List[dict]: 指定ごとの source, id, status ("ok" / "error"), sections (区分の数), error を含む辞書
+    """
+    config = config or get_config()
+    cost_metrics = get_cost_metrics(config)
+    metrics = instrumentation.configure(config["METRICS_MODE"], config["METRICS_OUTPUT_FILE"])
+    cache = None
+    if config["CE_CACHE_DIR"]:
+        cache = ResponseCache(
+            config["CE_CACHE_DIR"],
+            ttl_seconds=config["CE_CACHE_TTL_SECONDS"],
+            max_bytes=config["CE_CACHE_MAX_BYTES"],
+            namespace=account_id
+        )
+    executor = ThreadPoolExecutor(max_workers=MAIN_MAX_WORKERS)
+    dispatchers: Dict[str, Tuple[Optional[notifier.NotificationDispatcher], List[Future], List[Dict[str, Any]]]] = {}
+    results: List[Dict[str, Any]] = []
+    planner = QueryPlanner(CostExplorer(client, cache=cache, metrics=cost_metrics))
+    try:
+        jobs = []
+        for source, raw_spec in specs:
+            result = {"source": source, "id": raw_spec.get("id") if isinstance(raw_spec, dict) else None,
+                      "status": "ok", "sections": 0}
+            results.append(result)
+            # 不正な指定や想定外のレスポンスによる例外は、その指定だけの失敗として記録する
+            try:
+                spec = parse_report_spec(raw_spec)
+                base_filter = None
+                if spec["accounts"]:
+                    base_filter = {"Dimensions": {"Key": LINKED_ACCOUNT_DIMENSION, "Values": spec["accounts"]}}
+                explorer = CostExplorer(client, cache=cache, base_filter=base_filter, metrics=cost_metrics)
+                jobs.append((result, spec, submit_spec_queries(executor, planner, explorer, spec)))
+            except Exception as e:
+                record_spec_error(result, e)
+        planned = planner.execute(executor)
+
+        for result, spec, queries in jobs:
+            try:
+                sections = assemble_spec_sections(spec, queries, planned)
+                title = f"AWSアカウント {account_id}"
+                if spec["accounts"]:
+                    title += f" (リンクアカウント {', '.join(spec['accounts'])})"
+                for section in sections:
+                    section_title, lines = section_to_report(section)
+                    print_report(f"{title}\n{section_title}", lines)
+
+                sink_key = json.dumps(spec["sinks"], sort_keys=True)
+                if sink_key not in dispatchers:
+                    dispatchers[sink_key] = (create_dispatcher(spec_config(config, spec["sinks"])), [], [])
+                dispatcher, deliveries, dispatched = dispatchers[sink_key]
+                if dispatcher is not None:
+                    deliveries.extend(dispatcher.submit({"title": title, "sections": sections}))
+                    dispatched.append(result)
+            except Exception as e:
+                record_spec_error(result, e)
+                continue
+            result["sections"] = len(sections)
+    except BaseException:
+        for dispatcher, _, _ in dispatchers.values():
+            if dispatcher is not None:
+                dispatcher.close()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        if cache is not None:
+            cache.close()
+
+    for dispatcher, deliveries, dispatched in dispatchers.values():
+        if dispatcher is None:
+            continue
+        try:
+            finish_dispatch(dispatcher, deliveries)
+        except Exception as e:
+            for result in dispatched:
+                record_spec_error(result, e)
+
+    if metrics.enabled:
+        metrics.count("reports", len(results))
+        metrics.count("reports.failed", sum(result["status"] == "error" for result in results))
+        metrics.emit({"AccountId": str(account_id)})
+    return results
+
+
+def main(client: Optional[boto3.client] = None, account_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    メイン関数。
+
+    STS によるアカウントIDの取得と Cost Explorer の呼び出しは互いに依存しないため並行して行い、
+    レポートの表示と通知は入力が揃ったものから順に開始する。
+    client, account_id を渡した場合はそれを使い回し、クライアント作成と STS 呼び出しを省く
+    (Lambda のウォームスタート時)。
+
+    Returns:
+        dict: account_id と、フェーズごとの処理時間 (PhaseTimer.summary() の戻り値) を含む辞書
+    """
+    config = get_config()
+    use_teams_post = config["USE_TEAMS_POST"]
+    teams_webhook_url = config["TEAMS_WEBHOOK_URL"]
+
+    # USE_TEAMS_POST が True なら TEAMS_WEBHOOK_URL が必要
+    if use_teams_post and not teams_webhook_url:
+        raise ValueError("TEAMS_WEBHOOK_URL is not set in the environment variables.")
+
+    if config["GRANULARITY"] not in (GRANULARITY, HOURLY_GRANULARITY):
+        raise ValueError(
+            f"GRANULARITY の値が不正です: {config['GRANULARITY']} ({GRANULARITY}, {HOURLY_GRANULARITY} のいずれか)"
+        )
+
+    # COST_METRICS の全メトリクスを1つのリクエストで取得する
+    cost_metrics = get_cost_metrics(config)
+
+    # BUDGET_RULES があれば、全体のレポートの代わりに状態が変化した予算ルールだけを通知する
+    budget_rules = get_budget_rules(config)
+
+    # METRICS_MODE が off 以外なら各処理の時間・API 呼び出し回数などを計測する
+    metrics = instrumentation.configure(config["METRICS_MODE"], config["METRICS_OUTPUT_FILE"])
+    timer = PhaseTimer()
+
+    # boto3 CostExplorer クライアントをモック化できるよう必ず get_client() 経由にする。
+    # boto3 の遅延読み込みはスレッドセーフではないため、ワーカーを起動する前にメインスレッドで行う
+    if client is None:
+        client = timer.call("client", get_client)
+
+    start_date, end_date = get_date_range()
+    period = {"Start": start_date, "End": end_date}
+    start_day_str = datetime.strptime(start_date, "%Y-%m-%d").strftime("%m/%d")
+    end_day_str = (datetime.strptime(end_date, "%Y-%m-%d") - timedelta(days=1)).strftime("%m/%d")
+
+    executor = ThreadPoolExecutor(max_workers=MAIN_MAX_WORKERS)
+    dispatcher = create_dispatcher(config)
+    deliveries: List[Future] = []
+    dispatch_started: List[float] = []
+    cache = None
+    try:
+        # AWSアカウントIDの取得 (STS) を Cost Explorer の呼び出しと並行して行う
+        if account_id is None:
+            account_future = executor.submit(timer.call, "sts", get_account_id)
+        else:
+            account_future = Future()
+            account_future.set_result(account_id)
+
+        # CE_CACHE_DIR が設定されていれば Cost Explorer のレスポンスをキャッシュする
+        # (キャッシュキーや出力先はアカウントIDで分けるが、必要になるまで STS の完了を待たない)
+        if config["CE_CACHE_DIR"]:
+            cache = ResponseCache(
+                config["CE_CACHE_DIR"],
+                ttl_seconds=config["CE_CACHE_TTL_SECONDS"],
+                max_bytes=config["CE_CACHE_MAX_BYTES"],
+                namespace=account_future.result
+            )
+        # EXPORT_DIR が設定されていれば、取得した結果をアカウントごとのディレクトリに書き出す
+        exporter = None
+        if config["EXPORT_DIR"]:
+            exporter = cost_export.ExportWriter(
+                lambda: os.path.join(config["EXPORT_DIR"], f"account={account_future.result()}"),
+                export_format=config["EXPORT_FORMAT"]
+            )
+        explorer = CostExplorer(client, cache=cache, exporter=exporter, metrics=cost_metrics)
+
+        sections_future = executor.submit(
+            timer.call, "cost_query", build_report_sections,
+            explorer, config, account_future, period, start_day_str, end_day_str
+        )
+        # COMPARE_PERIODS が設定されていれば比較対象の期間も並行して取得する
+        # (締め済みの期間のため、CE_CACHE_DIR があれば2回目以降はキャッシュから読む)
+        comparison_futures = [
+            (label, executor.submit(
+                timer.call, f"compare_query.{name}", build_combined_cost_sections,
+                explorer, comparison_period, start_day_str, end_day_str
+            ))
+            for name, (label, comparison_period) in zip(
+                config["COMPARE_PERIODS"],
+                get_comparison_periods(start_date, end_date, config["COMPARE_PERIODS"])
+            )
+        ]
+        # ANOMALY_STATE_DIR が設定されていれば日次費用の急増の検知も並行して行う
+        # (過去分の取り込みを含むため、レポート本体より低い優先度で呼び出す)
+        anomaly_future = None
+        if config["ANOMALY_STATE_DIR"]:
+            batch_explorer = CostExplorer(
+                client, cache=cache, priority=ce_scheduler.PRIORITY_BATCH, metrics=cost_metrics[:1]
+            )
+            anomaly_future = executor.submit(
+                timer.call, "anomaly_query", detect_anomalies, batch_explorer, config, account_future, end_date
+            )
+
+        # DRILLDOWN_DIMENSIONS が設定されていれば2軸のドリルダウンも並行して取得する
+        drilldown_future = None
+        if config["DRILLDOWN_DIMENSIONS"]:
+            drilldown_future = executor.submit(
+                timer.call, "drilldown_query", build_drilldown_section,
+                explorer, period, config["DRILLDOWN_DIMENSIONS"], start_day_str, end_day_str,
+                top_n=config["DRILLDOWN_TOP_N"], max_parents=config["DRILLDOWN_MAX_PARENTS"]
+            )
+
+        # GRANULARITY が HOURLY なら、時間別のピーク・p95 も並行して取得する
+        hourly_future = None
+        if config["GRANULARITY"] == HOURLY_GRANULARITY:
+            hourly_future = executor.submit(
+                timer.call, "hourly_query", build_hourly_section,
+                explorer, start_date, end_date, start_day_str, end_day_str, top_n=config["HOURLY_TOP_N"]
+            )
+
+        account_id = account_future.result()
+        logger.info(f"AWS Account ID: {account_id}")
+        account_title = f"AWSアカウント {account_id}"
+
+        def publish(phase: str, sections: List[Dict[str, Any]], notify: bool = True) -> None:
+            # 表示し、全ての通知先への送信を開始する (送信の完了は最後にまとめて待つ)
+            with timer.phase(phase):
+                for section in sections:
+                    title, services_cost = section_to_report(section)
+                    print_report(f"{account_title}\n{title}", services_cost)
+            if dispatcher is not None and notify:
+                dispatch_started.append(time.perf_counter())
+                deliveries.extend(dispatcher.submit({"title": account_title, "sections": sections}))
+
+        # --- クレジット適用後 / クレジット適用前 ---
+        # 両区分を1通のメッセージにまとめ、揃った時点で送信を開始する
+        sections = sections_future.result()
+        for label, future in comparison_futures:
+            sections = [
+                compare_section(section, label, previous)
+                for section, previous in zip(sections, future.result())
+            ]
+        if not budget_rules:
+            publish("render", sections)
+        else:
+            # 全体のレポートは表示だけ行い、前回から状態が変化した予算ルールがあれば通知する
+            publish("render", sections, notify=False)
+            budget_section = timer.call(
+                "budget_rules", evaluate_budget_rules, config, budget_rules, account_id, sections
+            )
+            if budget_section is not None:
+                publish("render_budget", [budget_section])
+
+        # ドリルダウン・時間別・急増の検知結果はそれぞれ別のメッセージとして、揃った時点で送信する
+        if drilldown_future is not None:
+            publish("render_drilldown", [drilldown_future.result()])
+        if hourly_future is not None:
+            publish("render_hourly", [hourly_future.result()])
+        if anomaly_future is not None:
+            anomaly_section = anomaly_future.result()
+            if anomaly_section is not None:
+                publish("render_anomaly", [anomaly_section])
+    except BaseException:
+        if dispatcher is not None:
+            dispatcher.close()
+        raise
+    finally:
+        executor.shutdown(wait=True)
+        if cache is not None:
+            logger.info(f"Cost Explorer cache stats: {cache.stats}")
+            cache.close()
+
+    if dispatcher is not None:
+        try:
+            finish_dispatch(dispatcher, deliveries)
+        finally:
+            if dispatch_started:
+                timer.record("dispatch", dispatch_started[0], time.perf_counter())
+
+    summary = {"account_id": account_id, **timer.summary()}
+    logger.info(f"Phase timings: {json.dumps(summary, default=str)}")
+    if metrics.enabled:
+        for name, phase in summary["phases"].items():
+            metrics.observe(f"phase.{name}", phase["duration_ms"], unit="Milliseconds")
+        metrics.emit({"AccountId": str(account_id)})
+    return summary
+
+
+# --------------------------------------------------------------------
+# Lambda ハンドラ
+# --------------------------------------------------------------------
+# 実行環境 (コンテナ) 単位で保持する状態。ウォームスタート時は作成済みのクライアントと
+# アカウントIDを使い回し、クライアント作成と STS 呼び出しを省く。
+_container_state: Dict[str, Any] = {"client": None, "account_id": None, "invocations": 0}
+
+
+def lambda_handler(event, context) -> Dict[str, Any]:
+    """
+    Lambda ハンドラ。コールド/ウォームスタートの別と各処理時間を出力して返す。
+
+    イベントにレポートの指定 (parse_report_spec() を参照) がなければ、環境変数の設定で
+    1件のレポートを出力する (スケジュール実行)。SQS・EventBridge のレコードや {"reports": [...]}
+    で複数の指定を渡した場合は、クライアント・キャッシュ・スレッドプールを共有して1回の呼び出しで
+    全て実行する。SQS の場合、失敗した指定のメッセージを batchItemFailures で返す。
+
+    コールドスタート時のアカウントIDの取得 (STS) は main() 内で Cost Explorer の呼び出しと
+    並行して行い、取得したアカウントIDを以降の呼び出しで使い回す。
+    """
+    started = time.perf_counter()
+    cold_start = _container_state["client"] is None
+    if cold_start:
+        _container_state["client"] = get_client()
+    init_done = time.perf_counter()
+    _container_state["invocations"] += 1
+
+    event = event or {}
+    specs = extract_report_specs(event)
+    timings: Dict[str, Any] = {
+        "cold_start": cold_start,
+        "invocation": _container_state["invocations"],
+        "init_ms": round((init_done - started) * 1000, 3),
+    }
+    if specs is None:
+        result = main(client=_container_state["client"], account_id=_container_state["account_id"])
+        _container_state["account_id"] = result["account_id"]
+        timings.update({
+            "report_ms": round((time.perf_counter() - init_done) * 1000, 3),
+            "phases": result["phases"],
+            "overlap_ms": result["overlap_ms"],
+        })
+        print(json.dumps({"startup_timings": timings}))
+        return timings
+
+    if _container_state["account_id"] is None:
+        _container_state["account_id"] = get_account_id()
+    reports = run_report_specs(specs, _container_state["client"], _container_state["account_id"])
+    timings["report_ms"] = round((time.perf_counter() - init_done) * 1000, 3)
+    timings["reports"] = len(reports)
+    print(json.dumps({"startup_timings": timings}))
+
+    failed = [report for report in reports if report["status"] == "error"]
+    if "Records" in event:
+        # SQS の部分的なバッチ失敗 (ReportBatchItemFailures) として、失敗したメッセージだけを再試行させる
+        failed_ids = sorted({report["source"] for report in failed if report["source"]})
+        return {"batchItemFailures": [{"itemIdentifier": message_id} for message_id in failed_ids],
+                "reports": reports, "timings": timings}
+    if failed:
+        raise RuntimeError(
+            "レポートの作成に失敗しました: "
+            + "; ".join(f"{report['id']}: {report['error']}" for report in failed)
+        )
+    return {"reports": reports, "timings": timings}
@@ -0,0 +1,245 @@
+# src/ce_scheduler.py
+"""
+Cost Explorer API の呼び出しをプロセス全体で調停するスケジューラ。
+
+Cost Explorer はリクエストレートの上限が低いため、全ての呼び出しをトークンバケットで
+平準化し、スロットリングされた場合はレートを下げてジッター付きの指数バックオフで再試行する。
+待機中のリクエストは優先度の高い順 (値の小さい順) に実行するため、対話的なレポートは
+バッチ処理 (過去分の取り込みなど) より先に処理される。
+"""
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+from typing import Any, Callable, Optional
+
+import botocore.exceptions
+
+import instrumentation
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+DEFAULT_RATE_PER_SECOND = 5.0
+DEFAULT_BURST = 5
+DEFAULT_MAX_ATTEMPTS = 6
+DEFAULT_BACKOFF_SECONDS = 0.5
+DEFAULT_MAX_BACKOFF_SECONDS = 20.0
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 5.0
+DEFAULT_READ_TIMEOUT_SECONDS = 60.0
+
+# スロットリング時はレートを半分にし、成功するごとに上限の1割ずつ戻す
+MIN_RATE_PER_SECOND = 0.2
+RATE_DECREASE_FACTOR = 0.5
+RATE_RECOVERY_FRACTION = 0.1
+
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "Throttling",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+    "LimitExceededException",
+}
+
+logger = logging.getLogger(__name__)
+logger.disabled = True
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+def is_throttling_error(error: Exception) -> bool:
+    """
+    スロットリングによるエラーかどうかを判定する。
+    """
+    if not isinstance(error, botocore.exceptions.ClientError):
+        return False
+    return error.response.get("Error", {}).get("Code", "") in THROTTLING_ERROR_CODES
+
+
+class TokenBucket:
+    """
+    rate 件/秒でトークンを補充し、最大 capacity 件まで蓄えるトークンバケット。
+    """
+
+    def __init__(self, rate: float, capacity: float, clock: Callable[[], float] = time.monotonic) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self._clock = clock
+        self._updated = clock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self) -> float:
+        """
+        トークンを1つ取り出す。取り出せた場合は 0 を、取り出せない場合は次のトークンが
+        補充されるまでの秒数を返す。
+        """
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    """
+    Cost Explorer の呼び出しを優先度付きで順番に実行するスケジューラ。
+
+    呼び出しごとにトークンバケットからトークンを取り出してから実行する。トークン待ちの
+    リクエストは (優先度, 到着順) で並べ、先頭のリクエストだけがトークンを取り出せる。
+    スロットリングされた場合は補充レートを下げ (AIMD)、max_attempts 回まで再試行する。
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float = DEFAULT_RATE_PER_SECOND,
+        burst: int = DEFAULT_BURST,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+        max_backoff_seconds: float = DEFAULT_MAX_BACKOFF_SECONDS,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep
+    ) -> None:
+        self.max_rate = rate_per_second
+        self.bucket = TokenBucket(rate_per_second, burst, clock)
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.stats = {"calls": 0, "throttled": 0, "retries": 0, "failed": 0, "wait_seconds": 0.0}
+        self._clock = clock
+        self._sleep = sleep
+        self._waiting: list = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    @property
+    def rate(self) -> float:
+        return self.bucket.rate
+
+    def _acquire(self, priority: int) -> None:
+        started = self._clock()
+        with self._condition:
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, ticket)
+            self._condition.notify_all()
+        while True:
+            with self._condition:
+                while self._waiting[0] != ticket:
+                    self._condition.wait()
+                delay = self.bucket.try_take()
+                if delay == 0:
+                    heapq.heappop(self._waiting)
+                    self._condition.notify_all()
+                    self.stats["wait_seconds"] += self._clock() - started
+                    return
+            # 先頭のリクエストだけがトークンの補充を待つ。待っている間に優先度の高い
+            # リクエストが到着した場合は、そちらが先頭となって先にトークンを取り出す
+            self._sleep(delay)
+
+    def _on_success(self) -> None:
+        with self._condition:
+            self.stats["calls"] += 1
+            self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate * RATE_RECOVERY_FRACTION)
+
+    def _on_throttled(self) -> None:
+        with self._condition:
+            self.stats["throttled"] += 1
+            self.bucket.rate = max(MIN_RATE_PER_SECOND, self.bucket.rate * RATE_DECREASE_FACTOR)
+
+    def call(self, func: Callable[..., Any], priority: int = PRIORITY_INTERACTIVE, **params: Any) -> Any:
+        """
+        順番とトークンを待って func(**params) を実行し、結果を返す。
+
+        スロットリング以外のエラー、または max_attempts 回スロットリングされた場合は
+        最後の例外をそのまま送出する。
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            self._acquire(priority)
+            try:
+                result = func(**params)
+            except botocore.exceptions.ClientError as e:
+                if not is_throttling_error(e):
+                    raise
+                self._on_throttled()
+                instrumentation.current().count("ce.throttled")
+                if attempt == self.max_attempts:
+                    with self._condition:
+                        self.stats["failed"] += 1
+                    raise
+                # フルジッター: 0 ～ 上限付き指数バックオフの範囲でランダムに待つ
+                delay = random.uniform(
+                    0, min(self.max_backoff_seconds, self.backoff_seconds * (2 ** (attempt - 1)))
+                )
+                logger.warning(f"Cost Explorer throttled (attempt {attempt}), retrying in {delay:.2f}s")
+                with self._condition:
+                    self.stats["retries"] += 1
+                instrumentation.current().count("ce.retries")
+                self._sleep(delay)
+            else:
+                self._on_success()
+                return result
+
+
+def get_scheduler_config() -> dict:
+    """
+    環境変数からスケジューラの設定を取得する。
+
+    Returns:
+        dict: CE_RATE_PER_SECOND, CE_BURST, CE_MAX_ATTEMPTS, CE_CONNECT_TIMEOUT_SECONDS,
+              CE_READ_TIMEOUT_SECONDS をキーに含む辞書
+    """
+    return {
+        "CE_RATE_PER_SECOND": float(os.environ.get("CE_RATE_PER_SECOND", DEFAULT_RATE_PER_SECOND)),
+        "CE_BURST": int(os.environ.get("CE_BURST", DEFAULT_BURST)),
+        "CE_MAX_ATTEMPTS": int(os.environ.get("CE_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)),
+        "CE_CONNECT_TIMEOUT_SECONDS": float(
+            os.environ.get("CE_CONNECT_TIMEOUT_SECONDS", DEFAULT_CONNECT_TIMEOUT_SECONDS)
+        ),
+        "CE_READ_TIMEOUT_SECONDS": float(os.environ.get("CE_READ_TIMEOUT_SECONDS", DEFAULT_READ_TIMEOUT_SECONDS)),
+    }
+
+
+_default_scheduler: Optional[RequestScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler() -> RequestScheduler:
+    """
+    プロセス全体で共有するスケジューラを返す。初回の呼び出し時に環境変数の設定で作成する。
+    """
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            config = get_scheduler_config()
+            _default_scheduler = RequestScheduler(
+                rate_per_second=config["CE_RATE_PER_SECOND"],
+                burst=config["CE_BURST"],
+                max_attempts=config["CE_MAX_ATTEMPTS"]
+            )
+        return _default_scheduler
+
+
+def get_client_config() -> Any:
+    """
+    タイムアウトを設定した botocore の Config を返す。再試行はスケジューラで行うため、
+    botocore 側の再試行は無効にする。
+    """
+    from botocore.config import Config
+
+    config = get_scheduler_config()
+    return Config(
+        connect_timeout=config["CE_CONNECT_TIMEOUT_SECONDS"],
+        read_timeout=config["CE_READ_TIMEOUT_SECONDS"],
+        retries={"total_max_attempts": 1, "mode": "standard"}
+    )
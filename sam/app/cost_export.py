@@ -0,0 +1,493 @@
+# src/cost_export.py
+"""
+get_cost_and_usage の結果をファイルに書き出し、読み戻すモジュール。
+
+ページを受け取るたびに行を列 (int64 の配列) に追加し、期間ごとのパーティション
+(<directory>/granularity=<粒度>/period=<期間の開始日>/) に書き出す。パーティションは
+Hive 形式のディレクトリ名のため、後続の実行やダッシュボード・DuckDB・pandas・Polars などの
+他のツールが Cost Explorer を呼び直さずに集計できる。
+
+出力形式 (export_format):
+    arrow: Arrow IPC ファイル (Feather v2、非圧縮)。ディメンションは辞書エンコードし、金額は
+           decimal128(18, 6) で丸めずに持つ。ExportReader はファイルをメモリマップし、列を
+           コピーせずに pyarrow.compute で集計する。pyarrow が必要。
+    csv: 1行が1グループの CSV。pyarrow がない環境向けで、ExportReader は読み込んで列に変換する。
+    auto (既定): pyarrow がインストールされていれば arrow、なければ csv。
+
+どちらの形式も列は period_start, period_end, estimated, 各ディメンション, 各メトリクスの順。
+期間・粒度・フィルタ・ディメンションとメトリクスの名前・メトリクスの単位は、arrow では
+スキーマのメタデータ (キー "cost_export")、csv では同じ名前に METADATA_SUFFIX を付けた
+JSON ファイルに書き出す。
+"""
+import os
+import csv
+import json
+import uuid
+import hashlib
+import logging
+from array import array
+from decimal import Decimal
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Sequence, Tuple, Union
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+FORMAT_ARROW = "arrow"
+FORMAT_CSV = "csv"
+FORMAT_AUTO = "auto"
+DEFAULT_EXPORT_FORMAT = FORMAT_AUTO
+FILE_SUFFIXES = {FORMAT_ARROW: ".arrow", FORMAT_CSV: ".csv"}
+METADATA_SUFFIX = ".meta.json"
+STAGING_SUFFIX = ".tmp"
+METADATA_KEY = "cost_export"
+# ディメンション・メトリクスの前に置く期間の列
+PERIOD_COLUMNS = ("period_start", "period_end", "estimated")
+AMOUNT_SCALE = 1_000_000
+AMOUNT_PRECISION = 18
+AMOUNT_DIGITS = 6
+ROWS_PER_PART = 65536
+
+logger = logging.getLogger(__name__)
+logger.disabled = True
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+def query_shape(request: Dict[str, Any]) -> str:
+    """
+    期間とページ以外のリクエスト内容 (粒度・フィルタ・グルーピング・メトリクス) のハッシュを返す。
+
+    同じ形のクエリの結果は、期間のパーティションごとに新しいもので置き換える。
+    """
+    params = {k: v for k, v in request.items() if k not in ("TimePeriod", "NextPageToken")}
+    payload = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def partition_path(directory: str, granularity: str, period_start: str) -> str:
+    return os.path.join(directory, f"granularity={granularity}", f"period={period_start}")
+
+
+def format_amount(value: int) -> str:
+    """
+    AMOUNT_SCALE 倍した固定小数点の整数を、丸めずに小数点以下6桁の文字列にする。
+    """
+    whole, fraction = divmod(abs(value), AMOUNT_SCALE)
+    return f"{'-' if value < 0 else ''}{whole}.{fraction:06d}"
+
+
+def _import_pyarrow() -> Any:
+    """
+    Arrow 形式の読み書きに使う pyarrow を読み込む。インストールされていない場合は RuntimeError。
+    """
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.compute
+    except ImportError as e:
+        raise RuntimeError("Arrow 形式での出力・読み込みには pyarrow のインストールが必要です。") from e
+    return pyarrow
+
+
+def resolve_export_format(export_format: str) -> str:
+    """
+    出力形式を検証し、auto を pyarrow の有無に応じて arrow または csv に決める。不正な形式は ValueError。
+    """
+    if export_format == FORMAT_AUTO:
+        try:
+            _import_pyarrow()
+        except RuntimeError:
+            return FORMAT_CSV
+        return FORMAT_ARROW
+    if export_format not in FILE_SUFFIXES:
+        choices = ", ".join([*FILE_SUFFIXES, FORMAT_AUTO])
+        raise ValueError(f"出力形式の指定が不正です: {export_format} ({choices} のいずれか)")
+    if export_format == FORMAT_ARROW:
+        _import_pyarrow()
+    return export_format
+
+
+class _PartBuffer:
+    """
+    1つのパーティションに書き出す前の行を列ごとに保持するバッファ。
+    """
+
+    def __init__(self, time_period: Dict[str, str], dimensions: Sequence[str], metrics: Sequence[str]) -> None:
+        self.time_period = time_period
+        self.estimated = False
+        self.dimensions = list(dimensions)
+        self.metrics = list(metrics)
+        self.units = {metric: "" for metric in metrics}
+        self.values: List[List[str]] = [[] for _ in dimensions]
+        self.ids: List[Dict[str, int]] = [{} for _ in dimensions]
+        self.key_columns = [array("q") for _ in dimensions]
+        self.metric_columns = [array("q") for _ in metrics]
+
+    def __len__(self) -> int:
+        return len(self.metric_columns[0]) if self.metric_columns else 0
+
+    def add_row(self, keys: Sequence[str], metrics: Dict[str, Dict[str, str]]) -> None:
+        for column, key in enumerate(keys[:len(self.dimensions)]):
+            ids = self.ids[column]
+            value_id = ids.get(key)
+            if value_id is None:
+                value_id = ids[key] = len(self.values[column])
+                self.values[column].append(key)
+            self.key_columns[column].append(value_id)
+        for column, metric in enumerate(self.metrics):
+            value = metrics.get(metric, {})
+            if value.get("Unit"):
+                self.units[metric] = value["Unit"]
+            self.metric_columns[column].append(round(float(value.get("Amount", 0)) * AMOUNT_SCALE))
+
+    def write(self, path: str, granularity: str, filter_expression: Any, export_format: str) -> List[str]:
+        """
+        path (と csv ではメタデータのファイル) に STAGING_SUFFIX を付けた一時ファイルとして書き出し、
+        確定後のファイルのパスを返す。
+        """
+        metadata = {
+            "version": 1,
+            "granularity": granularity,
+            "time_period": self.time_period,
+            "estimated": self.estimated,
+            "filter": filter_expression,
+            "dimensions": self.dimensions,
+            "metrics": [{"name": m, "unit": self.units[m], "scale": AMOUNT_SCALE} for m in self.metrics],
+        }
+        if export_format == FORMAT_ARROW:
+            self._write_arrow(path + STAGING_SUFFIX, metadata)
+            return [path]
+        self._write_csv(path + STAGING_SUFFIX)
+        with open(path + METADATA_SUFFIX + STAGING_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump(metadata, f, ensure_ascii=False)
+        return [path, path + METADATA_SUFFIX]
+
+    def _write_csv(self, path: str) -> None:
+        period = (self.time_period.get("Start", ""), self.time_period.get("End", ""), str(self.estimated).lower())
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(PERIOD_COLUMNS + tuple(self.dimensions) + tuple(self.metrics))
+            writer.writerows(
+                period + tuple(values[value_id] for values, value_id in zip(self.values, ids))
+                + tuple(format_amount(amount) for amount in amounts)
+                for ids, amounts in zip(zip(*self.key_columns), zip(*self.metric_columns))
+            )
+
+    def _write_arrow(self, path: str, metadata: Dict[str, Any]) -> None:
+        pa = _import_pyarrow()
+        rows = len(self)
+        columns = {
+            "period_start": pa.repeat(self.time_period.get("Start", ""), rows),
+            "period_end": pa.repeat(self.time_period.get("End", ""), rows),
+            "estimated": pa.repeat(self.estimated, rows),
+        }
+        for dimension, values, ids in zip(self.dimensions, self.values, self.key_columns):
+            columns[dimension] = pa.DictionaryArray.from_arrays(
+                pa.array(ids, type=pa.int32()), pa.array(values, type=pa.string())
+            )
+        amount_type = pa.decimal128(AMOUNT_PRECISION, AMOUNT_DIGITS)
+        for metric, amounts in zip(self.metrics, self.metric_columns):
+            columns[metric] = pa.array(
+                [Decimal(amount).scaleb(-AMOUNT_DIGITS) for amount in amounts], type=amount_type
+            )
+        table = pa.table(columns).replace_schema_metadata(
+            {METADATA_KEY: json.dumps(metadata, ensure_ascii=False)}
+        )
+        # メモリマップしてそのまま参照できるよう、圧縮せずに書き出す
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+
+class ExportWriter:
+    """
+    get_cost_and_usage の結果をページ単位で受け取りながらファイルに書き出すライター。
+
+    export() で結果のストリームを包むと、結果をそのまま返しつつ行を書き出す。書き出し中の
+    ファイルは一時ファイルとし、ストリームを最後まで読み終えた時点で確定して、同じ形の
+    クエリの古いファイル (形式が異なるものも含む) を置き換える。途中で失敗した場合は古い
+    ファイルが残る。export_format は arrow / csv / auto (モジュールの説明を参照)。
+
+    directory には、出力先を返す関数も渡せる。関数は最初のファイルを書き出す時点で呼ぶため、
+    出力先をアカウントIDで分ける場合も、アカウントIDの取得を待たずに結果を読み始められる。
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Callable[[], str]],
+        rows_per_part: int = ROWS_PER_PART,
+        export_format: str = DEFAULT_EXPORT_FORMAT
+    ) -> None:
+        self.export_format = resolve_export_format(export_format)
+        self._directory = directory
+        self.rows_per_part = rows_per_part
+        self.stats = {"rows": 0, "parts": 0}
+
+    @property
+    def directory(self) -> str:
+        if callable(self._directory):
+            self._directory = self._directory()
+        return self._directory
+
+    def export(self, request: Dict[str, Any], results: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        ResultsByTime の要素を順に返しながら、パーティションごとのファイルに書き出す。
+        """
+        granularity = request.get("Granularity", "MONTHLY")
+        dimensions = [group["Key"] for group in request.get("GroupBy", [])]
+        metrics = list(request.get("Metrics", []))
+        shape = query_shape(request)
+        run_id = uuid.uuid4().hex[:12]
+        staged: List[Tuple[str, str]] = []
+        parts = 0
+        buffer: Optional[_PartBuffer] = None
+
+        def flush() -> None:
+            nonlocal parts
+            if buffer is None or not len(buffer):
+                return
+            directory = partition_path(self.directory, granularity, buffer.time_period["Start"][:10])
+            os.makedirs(directory, exist_ok=True)
+            suffix = FILE_SUFFIXES[self.export_format]
+            path = os.path.join(directory, f"{shape}-{run_id}-{parts:05d}{suffix}")
+            for written in buffer.write(path, granularity, request.get("Filter"), self.export_format):
+                staged.append((directory, written))
+            parts += 1
+            self.stats["rows"] += len(buffer)
+            self.stats["parts"] += 1
+
+        try:
+            for result in results:
+                time_period = result.get("TimePeriod", {})
+                if buffer is None or buffer.time_period != time_period or len(buffer) >= self.rows_per_part:
+                    flush()
+                    buffer = _PartBuffer(time_period, dimensions, metrics)
+                buffer.estimated = buffer.estimated or bool(result.get("Estimated"))
+                if dimensions:
+                    for group in result.get("Groups", []):
+                        buffer.add_row(group["Keys"], group.get("Metrics", {}))
+                else:
+                    buffer.add_row([], result.get("Total", {}))
+                yield result
+            flush()
+        except BaseException:
+            # 取得の失敗や読み込みの中断時は確定せず、書き出し途中のファイルを削除する
+            for _, path in staged:
+                os.remove(path + STAGING_SUFFIX)
+            raise
+        self._commit(shape, run_id, staged)
+
+    def _commit(self, shape: str, run_id: str, staged: Sequence[Tuple[str, str]]) -> None:
+        for _, path in staged:
+            os.replace(path + STAGING_SUFFIX, path)
+        suffixes = tuple(FILE_SUFFIXES.values()) + (METADATA_SUFFIX,)
+        for directory in {directory for directory, _ in staged}:
+            for name in os.listdir(directory):
+                if name.startswith(f"{shape}-") and name.endswith(suffixes) and run_id not in name:
+                    os.remove(os.path.join(directory, name))
+        logger.info(f"Exported {len(staged)} files to {self.directory}")
+
+
+class ExportPart:
+    """
+    書き出した1つのファイル。time_period, dimensions (ディメンションの名前のリスト),
+    metrics ({メトリクス: 単位などの辞書}) を持ち、aggregate() と iter_rows() で参照する。
+    """
+
+    rows: int
+    time_period: Dict[str, str]
+    dimensions: List[str]
+    metrics: Dict[str, Dict[str, Any]]
+
+    def aggregate(self, group_by: Sequence[str], metric: str) -> Dict[Tuple[str, ...], int]:
+        """
+        metric を group_by のディメンションごとに合計し、AMOUNT_SCALE 倍した整数で返す。
+        """
+        raise NotImplementedError
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        """
+        行を {ディメンション: 値, メトリクス: 金額} の辞書として返す。
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class ArrowPart(ExportPart):
+    """
+    メモリマップした1つの Arrow IPC ファイル。列はコピーせずに参照し、pyarrow.compute で集計する。
+    """
+
+    def __init__(self, path: str) -> None:
+        pa = _import_pyarrow()
+        self.path = path
+        self._pa = pa
+        self._source = pa.memory_map(path, "r")
+        try:
+            self.table = pa.ipc.open_file(self._source).read_all()
+        except Exception:
+            self._source.close()
+            raise
+        metadata = json.loads((self.table.schema.metadata or {}).get(METADATA_KEY.encode(), b"{}"))
+        self.rows = self.table.num_rows
+        self.time_period = metadata.get("time_period", {})
+        self.dimensions = list(metadata.get("dimensions", []))
+        self.metrics = {m["name"]: m for m in metadata.get("metrics", [])}
+
+    def aggregate(self, group_by: Sequence[str], metric: str) -> Dict[Tuple[str, ...], int]:
+        if not group_by:
+            total = self._pa.compute.sum(self.table.column(metric)).as_py()
+            return {(): int((total or Decimal(0)).scaleb(AMOUNT_DIGITS))}
+        grouped = self.table.group_by(list(group_by)).aggregate([(metric, "sum")])
+        keys = zip(*(grouped.column(name).to_pylist() for name in group_by))
+        sums = grouped.column(f"{metric}_sum").to_pylist()
+        return {key: int((amount or Decimal(0)).scaleb(AMOUNT_DIGITS)) for key, amount in zip(keys, sums)}
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        columns = self.dimensions + list(self.metrics)
+        for batch in self.table.select(columns).to_batches():
+            for row in batch.to_pylist():
+                item: Dict[str, Any] = {"period_start": self.time_period.get("Start")}
+                item.update({name: row[name] for name in self.dimensions})
+                item.update({name: float(row[name]) for name in self.metrics})
+                yield item
+
+    def close(self) -> None:
+        # 呼び出し元が列を保持している場合は、参照がなくなった時点でマップが解放される
+        self.table = None
+        self._source.close()
+
+
+class CsvPart(ExportPart):
+    """
+    CSV のファイルを読み込み、列を配列 (ディメンションは値の辞書のインデックス) に変換したもの。
+    ディメンションとメトリクスの名前はメタデータのファイルから読む。
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        metadata_path = path + METADATA_SUFFIX
+        if not os.path.exists(metadata_path):
+            raise ValueError(f"メタデータのファイルがありません: {metadata_path}")
+        with open(metadata_path, encoding="utf-8") as f:
+            metadata = json.load(f)
+        self.time_period = metadata.get("time_period", {})
+        self.dimensions = list(metadata.get("dimensions", []))
+        self.metrics = {m["name"]: m for m in metadata.get("metrics", [])}
+        self.values: Dict[str, List[str]] = {name: [] for name in self.dimensions}
+        self._key_columns = {name: array("q") for name in self.dimensions}
+        self._metric_columns = {name: array("q") for name in self.metrics}
+
+        ids: Dict[str, Dict[str, int]] = {name: {} for name in self.dimensions}
+        with open(path, encoding="utf-8", newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader)
+            positions = {name: position for position, name in enumerate(header)}
+            missing = [name for name in [*self.dimensions, *self.metrics] if name not in positions]
+            if missing:
+                raise ValueError(f"CSV に列がありません: {', '.join(missing)} ({path})")
+            for row in reader:
+                for name in self.dimensions:
+                    value = row[positions[name]]
+                    value_id = ids[name].get(value)
+                    if value_id is None:
+                        value_id = ids[name][value] = len(self.values[name])
+                        self.values[name].append(value)
+                    self._key_columns[name].append(value_id)
+                for name in self.metrics:
+                    self._metric_columns[name].append(round(float(row[positions[name]]) * AMOUNT_SCALE))
+        self.rows = len(next(iter(self._metric_columns.values()), array("q")))
+
+    def aggregate(self, group_by: Sequence[str], metric: str) -> Dict[Tuple[str, ...], int]:
+        key_columns = [self._key_columns[name] for name in group_by]
+        # 値の辞書のインデックスのまま集計し、最後に値に変換する
+        sums: Dict[Tuple[int, ...], int] = {}
+        for key, amount in zip(zip(*key_columns), self._metric_columns[metric]):
+            sums[key] = sums.get(key, 0) + amount
+        if not group_by:
+            return {(): sum(self._metric_columns[metric])}
+        return {
+            tuple(self.values[name][value_id] for name, value_id in zip(group_by, key)): amount
+            for key, amount in sums.items()
+        }
+
+    def iter_rows(self) -> Iterator[Dict[str, Any]]:
+        for row in range(self.rows):
+            item: Dict[str, Any] = {"period_start": self.time_period.get("Start")}
+            item.update({name: self.values[name][self._key_columns[name][row]] for name in self.dimensions})
+            item.update({name: self._metric_columns[name][row] / AMOUNT_SCALE for name in self.metrics})
+            yield item
+
+
+def open_part(path: str) -> ExportPart:
+    """
+    拡張子に応じてファイルを開く (Arrow はメモリマップ、CSV は読み込んで列に変換する)。
+    """
+    if path.endswith(FILE_SUFFIXES[FORMAT_ARROW]):
+        return ArrowPart(path)
+    return CsvPart(path)
+
+
+class ExportReader:
+    """
+    ExportWriter が書き出したディレクトリを読み込むリーダー。
+
+    パーティションのディレクトリ名で粒度と期間を絞り込んでから、該当するファイルだけを開く。
+    Arrow 形式のファイルはメモリマップし、列をコピーせずに集計する。
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+
+    def iter_paths(
+        self,
+        granularity: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        条件に合うパーティションのファイルを期間順に返す。期間は開始日で start 以上 end 未満。
+        """
+        if not os.path.isdir(self.directory):
+            return
+        for granularity_dir in sorted(os.listdir(self.directory)):
+            if granularity is not None and granularity_dir != f"granularity={granularity}":
+                continue
+            granularity_path = os.path.join(self.directory, granularity_dir)
+            for period_dir in sorted(os.listdir(granularity_path)):
+                period_start = period_dir.split("=", 1)[-1]
+                if (start is not None and period_start < start) or (end is not None and period_start >= end):
+                    continue
+                period_path = os.path.join(granularity_path, period_dir)
+                for name in sorted(os.listdir(period_path)):
+                    if name.endswith(tuple(FILE_SUFFIXES.values())):
+                        yield os.path.join(period_path, name)
+
+    def iter_parts(self, **conditions: Any) -> Iterator[ExportPart]:
+        for path in self.iter_paths(**conditions):
+            part = open_part(path)
+            try:
+                yield part
+            finally:
+                part.close()
+
+    def aggregate(
+        self,
+        group_by: Sequence[str],
+        metric: str,
+        granularity: Optional[str] = None,
+        start: Optional[str] = None,
+        end: Optional[str] = None
+    ) -> Dict[Tuple[str, ...], float]:
+        """
+        条件に合う全ファイルの metric を group_by のディメンションごとに合計する。
+        """
+        totals: Dict[Tuple[str, ...], int] = {}
+        for part in self.iter_parts(granularity=granularity, start=start, end=end):
+            if metric not in part.metrics or any(d not in part.dimensions for d in group_by):
+                continue
+            for key, amount in part.aggregate(group_by, metric).items():
+                totals[key] = totals.get(key, 0) + amount
+        return {key: amount / AMOUNT_SCALE for key, amount in totals.items()}
@@ -0,0 +1,164 @@
+# src/instrumentation.py
+"""
+処理時間・API 呼び出し回数・ペイロードサイズなどを記録する計測モジュール。
+
+configure() で計測を有効にすると、各処理が span() / count() / observe() で記録した値を
+集計し、emit() で CloudWatch Embedded Metric Format (EMF) の1行、またはローカルの JSON
+サマリとして出力する。無効時 (デフォルト) は何もしない NullInstrumentation を返すため、
+計測箇所のオーバーヘッドは関数呼び出し1回分に収まる。
+"""
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Any, Iterator, Optional, ContextManager
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+MODE_OFF = "off"
+MODE_EMF = "emf"
+MODE_JSON = "json"
+EMF_NAMESPACE = "AwsCostReport"
+# EMF の1レコードに含められるメトリクス数の上限
+EMF_MAX_METRICS = 100
+
+_NULL_CONTEXT = nullcontext()
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+class NullInstrumentation:
+    """
+    計測が無効な場合に使う、何も記録しない実装。
+    """
+
+    enabled = False
+
+    def span(self, name: str) -> ContextManager[None]:
+        return _NULL_CONTEXT
+
+    def count(self, name: str, value: float = 1) -> None:
+        pass
+
+    def observe(self, name: str, value: float, unit: str = "Count") -> None:
+        pass
+
+
+class Instrumentation:
+    """
+    計測値を名前ごとに集計する。スレッドセーフ。
+
+    span() は処理時間 (ミリ秒) を、observe() は任意の値 (バイト数・グループ数など) を
+    回数・合計・最小・最大で集計し、count() は回数を加算する。
+    """
+
+    enabled = True
+
+    def __init__(self, mode: str = MODE_JSON, output: str = "-") -> None:
+        self.mode = mode
+        self.output = output
+        self.counters: Dict[str, float] = {}
+        self.observations: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(f"{name}.duration", (time.perf_counter() - started) * 1000, unit="Milliseconds")
+
+    def count(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float, unit: str = "Count") -> None:
+        with self._lock:
+            stats = self.observations.get(name)
+            if stats is None:
+                self.observations[name] = {"count": 1, "sum": value, "min": value, "max": value, "unit": unit}
+            else:
+                stats["count"] += 1
+                stats["sum"] += value
+                stats["min"] = min(stats["min"], value)
+                stats["max"] = max(stats["max"], value)
+
+    def summary(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self.counters),
+                "observations": {
+                    name: {**stats, "sum": round(stats["sum"], 3), "min": round(stats["min"], 3),
+                           "max": round(stats["max"], 3)}
+                    for name, stats in self.observations.items()
+                },
+            }
+
+    def to_emf(self, dimensions: Dict[str, str], namespace: str = EMF_NAMESPACE) -> Dict[str, Any]:
+        """
+        集計値を EMF のレコードに変換する。span / observe の値は合計を、count は回数を出力する。
+        """
+        summary = self.summary()
+        values: Dict[str, Any] = {}
+        definitions = []
+        for name, value in summary["counters"].items():
+            values[name] = value
+            definitions.append({"Name": name, "Unit": "Count"})
+        for name, stats in summary["observations"].items():
+            values[name] = stats["sum"]
+            definitions.append({"Name": name, "Unit": stats["unit"]})
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": namespace,
+                    "Dimensions": [sorted(dimensions)],
+                    "Metrics": definitions[:EMF_MAX_METRICS],
+                }],
+            },
+            **dimensions,
+            **values,
+        }
+
+    def emit(self, dimensions: Optional[Dict[str, str]] = None) -> None:
+        """
+        mode に応じて EMF の1行 (標準出力) または JSON サマリ (output、"-" は標準出力) を出力する。
+        """
+        dimensions = dimensions or {}
+        if self.mode == MODE_EMF:
+            text = json.dumps(self.to_emf(dimensions), ensure_ascii=False)
+        else:
+            text = json.dumps({**dimensions, **self.summary()}, ensure_ascii=False)
+
+        if self.mode == MODE_EMF or self.output == "-":
+            sys.stdout.write(text + "\n")
+            sys.stdout.flush()
+        else:
+            with open(self.output, "a", encoding="utf-8") as f:
+                f.write(text + "\n")
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+_current: Any = NULL_INSTRUMENTATION
+
+
+def current() -> Any:
+    """
+    現在の計測オブジェクト (無効時は NullInstrumentation) を返す。
+    """
+    return _current
+
+
+def configure(mode: str = MODE_OFF, output: str = "-") -> Any:
+    """
+    計測を開始する (mode が "off" の場合は無効にする)。以前の計測値は破棄する。
+    """
+    global _current
+    if mode not in (MODE_OFF, MODE_EMF, MODE_JSON):
+        raise ValueError(f"METRICS_MODE の値が不正です: {mode} (off, emf, json のいずれか)")
+    _current = NULL_INSTRUMENTATION if mode == MODE_OFF else Instrumentation(mode, output)
+    return _current
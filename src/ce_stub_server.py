@@ -0,0 +1,182 @@
+# src/ce_stub_server.py
+"""
+Cost Explorer 互換のローカル HTTP サーバ (オフラインでの負荷試験用)。
+
+botocore が送る JSON 1.1 プロトコルの GetCostAndUsage と、STS の GetCallerIdentity
+(Query プロトコル) に応答する。レスポンスは ce_synthetic.SyntheticCostExplorer で決定的に
+生成するため、グループ数・ページサイズを変えて大きなレスポンスや NextPageToken による
+ページングを再現できる。応答の遅延とスロットリング (ThrottlingException) も注入できる。
+
+環境変数 CE_ENDPOINT_URL と STS_ENDPOINT_URL にサーバの URL を設定すると、
+cost_report.get_client() と get_account_id() がこのサーバを呼び出す。
+
+使い方:
+    python src/ce_stub_server.py --port 8787 --groups 100000 --page-size 5000
+"""
+import sys
+import json
+import time
+import argparse
+import threading
+from urllib.parse import parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Dict, Any, Optional, Tuple
+
+from ce_synthetic import SyntheticCostExplorer, ThrottlingClient, DEFAULT_GROUP_COUNT, DEFAULT_PAGE_SIZE
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+CE_TARGET_PREFIX = "AWSInsightsIndexService."
+DEFAULT_ACCOUNT_ID = "123456789012"
+STS_RESPONSE_TEMPLATE = (
+    '<GetCallerIdentityResponse xmlns="https://sts.amazonaws.com/doc/2011-06-15/">'
+    "<GetCallerIdentityResult>"
+    "<Arn>arn:aws:iam::{account_id}:user/ce-stub</Arn>"
+    "<UserId>AIDACESTUB</UserId>"
+    "<Account>{account_id}</Account>"
+    "</GetCallerIdentityResult>"
+    "<ResponseMetadata><RequestId>00000000-0000-0000-0000-000000000000</RequestId></ResponseMetadata>"
+    "</GetCallerIdentityResponse>"
+)
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+class LocalCostExplorerServer:
+    """
+    Cost Explorer と STS の代わりに応答するローカルの HTTP サーバ。
+
+    latency_seconds を指定すると各応答の前に待機する。throttle_first を指定すると最初の
+    その回数の GetCostAndUsage を、max_calls_per_second を指定すると直近1秒間の呼び出しが
+    その回数を超えたものを ThrottlingException で失敗させる。
+    """
+
+    def __init__(
+        self,
+        group_count: int = DEFAULT_GROUP_COUNT,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        seed: int = 0,
+        latency_seconds: float = 0.0,
+        throttle_first: int = 0,
+        max_calls_per_second: Optional[float] = None,
+        account_id: str = DEFAULT_ACCOUNT_ID,
+        port: int = 0
+    ) -> None:
+        self.synthetic = SyntheticCostExplorer(group_count=group_count, page_size=page_size, seed=seed)
+        self.client = ThrottlingClient(
+            self.synthetic, throttle_first=throttle_first, max_calls_per_second=max_calls_per_second
+        )
+        self.latency_seconds = latency_seconds
+        self.account_id = account_id
+        self.requests: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        owner = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                time.sleep(owner.latency_seconds)
+                target = self.headers.get("X-Amz-Target", "")
+                status, content_type, payload = owner.handle(target, body)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                self.send_header("x-amzn-RequestId", "00000000-0000-0000-0000-000000000000")
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "requests": len(self.requests),
+            "ce_calls": self.synthetic.call_count,
+            "throttled": self.client.throttled,
+        }
+
+    def handle(self, target: str, body: bytes) -> Tuple[int, str, bytes]:
+        """
+        リクエストを処理し、(HTTP ステータス, Content-Type, 本文) を返す。
+        """
+        if not target:
+            # STS (Query プロトコル): Action=GetCallerIdentity&Version=...
+            action = parse_qs(body.decode("utf-8")).get("Action", [""])[0]
+            with self._lock:
+                self.requests.append({"operation": action})
+            if action == "GetCallerIdentity":
+                return 200, "text/xml", STS_RESPONSE_TEMPLATE.format(account_id=self.account_id).encode("utf-8")
+            return self._error(400, "InvalidAction", f"Unsupported action: {action}")
+
+        operation = target[len(CE_TARGET_PREFIX):] if target.startswith(CE_TARGET_PREFIX) else target
+        params = json.loads(body or b"{}")
+        with self._lock:
+            self.requests.append({"operation": operation, "params": params})
+        if operation != "GetCostAndUsage":
+            return self._error(400, "UnknownOperationException", f"Unsupported operation: {operation}")
+
+        from botocore.exceptions import ClientError
+
+        try:
+            response = self.client.get_cost_and_usage(**params)
+        except ClientError as e:
+            return self._error(400, e.response["Error"]["Code"], e.response["Error"]["Message"])
+        return 200, "application/x-amz-json-1.1", json.dumps(response).encode("utf-8")
+
+    @staticmethod
+    def _error(status: int, code: str, message: str) -> Tuple[int, str, bytes]:
+        body = json.dumps({"__type": code, "message": message}).encode("utf-8")
+        return status, "application/x-amz-json-1.1", body
+
+    def __enter__(self) -> "LocalCostExplorerServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cost Explorer 互換のローカル HTTP サーバ")
+    parser.add_argument("--port", type=int, default=8787, help="待ち受けるポート")
+    parser.add_argument("--groups", type=int, default=DEFAULT_GROUP_COUNT, help="1期間あたりのグループ数")
+    parser.add_argument("--page-size", type=int, default=DEFAULT_PAGE_SIZE, help="1ページあたりのグループ数")
+    parser.add_argument("--seed", type=int, default=0, help="金額を生成するシード")
+    parser.add_argument("--latency", type=float, default=0.0, help="応答前に待機する秒数")
+    parser.add_argument("--max-calls-per-second", type=float, default=None, help="スロットリングする呼び出しレート")
+    args = parser.parse_args()
+
+    server = LocalCostExplorerServer(
+        group_count=args.groups,
+        page_size=args.page_size,
+        seed=args.seed,
+        latency_seconds=args.latency,
+        max_calls_per_second=args.max_calls_per_second,
+        port=args.port
+    )
+    with server:
+        print(f"CE_ENDPOINT_URL={server.url} STS_ENDPOINT_URL={server.url}", flush=True)
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            print(f"Stopped: {server.stats}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
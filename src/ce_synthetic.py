@@ -0,0 +1,251 @@
+# src/ce_synthetic.py
+"""
+Cost Explorer の get_cost_and_usage レスポンスを決定的に生成するモジュール。
+
+ベンチマークやオフラインでの負荷試験で、実際の AWS を呼び出さずに大量のグループ・
+ページ・期間を含むレスポンスを再現するために使う。
+"""
+import time
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta
+from typing import List, Dict, Any, Callable, Iterator, Optional, Sequence
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+DEFAULT_GROUP_COUNT = 1000
+DEFAULT_PAGE_SIZE = 5000
+RECORD_TYPES = ("Usage", "Tax", "Credit")
+CREDIT_RECORD_TYPE = "Credit"
+DIMENSION_FANOUT = 50
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+def split_periods(start: str, end: str, granularity: str) -> List[Dict[str, str]]:
+    """
+    期間を粒度 (MONTHLY / DAILY / HOURLY) ごとの TimePeriod のリストに分割する。
+    """
+    if granularity == "HOURLY":
+        fmt = "%Y-%m-%dT%H:%M:%SZ"
+        current = datetime.strptime(start, fmt) if "T" in start else datetime.fromisoformat(start)
+        last = datetime.strptime(end, fmt) if "T" in end else datetime.fromisoformat(end)
+        periods = []
+        while current < last:
+            following = current + timedelta(hours=1)
+            periods.append({"Start": current.strftime(fmt), "End": following.strftime(fmt)})
+            current = following
+        return periods
+
+    current = date.fromisoformat(start[:10])
+    last = date.fromisoformat(end[:10])
+    periods = []
+    while current < last:
+        if granularity == "DAILY":
+            following = current + timedelta(days=1)
+        else:
+            following = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+        following = min(following, last)
+        periods.append({"Start": current.isoformat(), "End": following.isoformat()})
+        current = following
+    return periods
+
+
+def synthetic_amount(seed: int, period_index: int, group_index: int) -> float:
+    """
+    シード・期間・グループ番号から決定的な金額 (0.00～999.99) を返す。
+    """
+    value = (group_index * 2654435761 + period_index * 40503 + seed * 97) % 100000
+    return value / 100
+
+
+def group_keys(group_by: Sequence[Dict[str, str]], group_index: int) -> List[str]:
+    """
+    グループ番号から GroupBy の各ディメンションのキーを作成する。
+
+    後ろのディメンションほど速く変化する。2番目以降のディメンションは、RECORD_TYPE なら
+    Usage / Tax / Credit の3種類、それ以外は DIMENSION_FANOUT 種類の値をとる。
+    """
+    keys: List[str] = []
+    remaining = group_index
+    for position in range(len(group_by) - 1, -1, -1):
+        key = group_by[position]["Key"]
+        if position == 0:
+            value = remaining
+        else:
+            fanout = len(RECORD_TYPES) if key == "RECORD_TYPE" else DIMENSION_FANOUT
+            remaining, value = divmod(remaining, fanout)
+        if key == "RECORD_TYPE":
+            keys.append(RECORD_TYPES[value % len(RECORD_TYPES)])
+        elif key == "SERVICE":
+            keys.append(f"Service {value:06d}")
+        else:
+            keys.append(f"{key.lower()}-{value:06d}")
+    keys.reverse()
+    return keys
+
+
+def excludes_credit(filter_expression: Optional[Dict[str, Any]]) -> bool:
+    """
+    クレジットを除外するフィルタ (Not RECORD_TYPE = Credit。And の中にある場合を含む) かどうかを判定する。
+    """
+    if not filter_expression:
+        return False
+    if "And" in filter_expression:
+        return any(excludes_credit(expression) for expression in filter_expression["And"])
+    dimensions = filter_expression.get("Not", {}).get("Dimensions", {})
+    return dimensions.get("Key") == "RECORD_TYPE" and CREDIT_RECORD_TYPE in dimensions.get("Values", [])
+
+
+def is_credit_group(group_by: Sequence[Dict[str, str]], keys: Sequence[str]) -> bool:
+    """
+    グループが RECORD_TYPE = Credit かどうかを判定する。
+    """
+    for group, key in zip(group_by, keys):
+        if group["Key"] == "RECORD_TYPE":
+            return key == CREDIT_RECORD_TYPE
+    return False
+
+
+class SyntheticCostExplorer:
+    """
+    get_cost_and_usage と同じ引数を受け取り、決定的なレスポンスを返す偽の CE クライアント。
+
+    group_count は1期間あたりのグループ数。全期間のグループを page_size 件ごとの
+    ページに分け、NextPageToken (ページ番号) でたどれるようにする。レスポンスは
+    要求されたページの分だけをその場で生成するため、グループ数が多くてもメモリは増えない。
+    """
+
+    def __init__(
+        self,
+        group_count: int = DEFAULT_GROUP_COUNT,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        seed: int = 0
+    ) -> None:
+        self.group_count = group_count
+        self.page_size = page_size
+        self.seed = seed
+        self.call_count = 0
+        self._lock = threading.Lock()
+
+    def get_cost_and_usage(self, **kwargs: Any) -> Dict[str, Any]:
+        with self._lock:
+            self.call_count += 1
+        period = kwargs["TimePeriod"]
+        periods = split_periods(period["Start"], period["End"], kwargs.get("Granularity", "MONTHLY"))
+        metrics = kwargs.get("Metrics", ["AmortizedCost"])
+        group_by = kwargs.get("GroupBy", [])
+        skip_credit = excludes_credit(kwargs.get("Filter"))
+        page = int(kwargs.get("NextPageToken") or 0)
+
+        if not group_by:
+            return {"ResultsByTime": [
+                self._total_result(p, index, metrics) for index, p in enumerate(periods)
+            ]}
+
+        total_groups = self.group_count * len(periods)
+        first = page * self.page_size
+        last = min(first + self.page_size, total_groups)
+        results: List[Dict[str, Any]] = []
+        for flat_index in range(first, last):
+            period_index, group_index = divmod(flat_index, self.group_count)
+            if not results or results[-1]["TimePeriod"] != periods[period_index]:
+                results.append({
+                    "TimePeriod": periods[period_index], "Total": {}, "Groups": [], "Estimated": False
+                })
+            keys = group_keys(group_by, group_index)
+            amount = synthetic_amount(self.seed, period_index, group_index)
+            if is_credit_group(group_by, keys):
+                if skip_credit:
+                    continue
+                amount = -amount / 10
+            results[-1]["Groups"].append({
+                "Keys": keys,
+                "Metrics": {metric: {"Amount": f"{amount:.6f}", "Unit": "USD"} for metric in metrics},
+            })
+
+        response: Dict[str, Any] = {"ResultsByTime": results}
+        if last < total_groups:
+            response["NextPageToken"] = str(page + 1)
+        return response
+
+    def _total_result(
+        self,
+        period: Dict[str, str],
+        period_index: int,
+        metrics: Sequence[str]
+    ) -> Dict[str, Any]:
+        total = sum(synthetic_amount(self.seed, period_index, i) for i in range(self.group_count))
+        return {
+            "TimePeriod": period,
+            "Total": {metric: {"Amount": f"{total:.6f}", "Unit": "USD"} for metric in metrics},
+            "Groups": [],
+            "Estimated": False,
+        }
+
+    def iter_responses(self, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+        """
+        NextPageToken をたどって全ページのレスポンスを順に返す。
+        """
+        token: Optional[str] = None
+        while True:
+            params = dict(kwargs)
+            if token:
+                params["NextPageToken"] = token
+            response = self.get_cost_and_usage(**params)
+            yield response
+            token = response.get("NextPageToken")
+            if not token:
+                return
+
+
+class ThrottlingClient:
+    """
+    CE クライアントをラップし、スロットリング (ThrottlingException) を注入する偽のクライアント。
+
+    最初の throttle_first 回の呼び出しと、直近1秒間の呼び出しが max_calls_per_second 回を
+    超えた呼び出しを ClientError で失敗させる。失敗した呼び出しは inner に渡さない。
+    """
+
+    def __init__(
+        self,
+        inner: Any,
+        throttle_first: int = 0,
+        max_calls_per_second: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.inner = inner
+        self.throttle_first = throttle_first
+        self.max_calls_per_second = max_calls_per_second
+        self.calls: List[Dict[str, Any]] = []
+        self.throttled = 0
+        self._clock = clock
+        self._recent: deque = deque()
+        self._lock = threading.Lock()
+
+    def _should_throttle(self) -> bool:
+        with self._lock:
+            now = self._clock()
+            while self._recent and self._recent[0] <= now - 1.0:
+                self._recent.popleft()
+            throttle = self.throttled < self.throttle_first or (
+                self.max_calls_per_second is not None and len(self._recent) >= self.max_calls_per_second
+            )
+            if throttle:
+                self.throttled += 1
+            else:
+                self._recent.append(now)
+            return throttle
+
+    def get_cost_and_usage(self, **kwargs: Any) -> Dict[str, Any]:
+        from botocore.exceptions import ClientError
+
+        if self._should_throttle():
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}}, "GetCostAndUsage"
+            )
+        with self._lock:
+            self.calls.append(kwargs)
+        return self.inner.get_cost_and_usage(**kwargs)
@@ -0,0 +1,109 @@
+# src/cost_records.py
+"""
+レポートの行 (サービスごとの費用) を表すコンパクトなレコード型のモジュール。
+
+ServiceCost は __slots__ で属性を固定したレコードで、行ごとの辞書 (キーのハッシュ表) を
+持たないため、辞書で表す場合の半分以下のメモリで済む。サービス名などのディメンションの値は
+sys.intern() でインターンし、複数のアカウント・期間にまたがる大量の行でも同じ文字列を
+1つだけ保持する。
+
+レポートの各処理 (整形・比較・予算ルール・レンダラ) は属性で値を読む。外部から受け取った
+辞書形式の行は as_service_costs() で変換でき、既存の呼び出し元のために item["billing"] の
+ような読み取りにも対応する。
+"""
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+SERVICE_COST_FIELDS = ("service_name", "billing", "changes", "extra_amounts")
+
+_intern = sys.intern
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+class ServiceCost:
+    """
+    サービス (または GroupBy のキー) ごとの費用の1行。
+
+    changes は比較対象の期間からの増減 (label, previous, delta, percent の辞書) のタプル。
+    extra_amounts は2つ目以降のメトリクス (区分の extra_metrics の順) の値のタプルで、
+    メトリクスの名前は行ごとに持たず区分で1度だけ持つ。行は大量に作るため、コンストラクタは
+    changes・extra_amounts をタプルとしてそのまま保持する (リストなどは from_dict() で変換する)。
+    """
+
+    __slots__ = SERVICE_COST_FIELDS
+
+    def __init__(
+        self,
+        service_name: str,
+        billing: float,
+        changes: Tuple[Dict[str, Any], ...] = (),
+        extra_amounts: Tuple[float, ...] = ()
+    ) -> None:
+        self.service_name = _intern(service_name)
+        self.billing = billing
+        self.changes = changes
+        self.extra_amounts = extra_amounts
+
+    @classmethod
+    def from_dict(cls, item: Dict[str, Any], extra_metrics: Sequence[str] = ()) -> "ServiceCost":
+        metrics = item.get("metrics", {})
+        return cls(
+            item["service_name"], float(item["billing"]), tuple(item.get("changes", ())),
+            tuple(float(metrics.get(name, 0.0)) for name in extra_metrics)
+        )
+
+    def to_dict(self, extra_metrics: Sequence[str] = ()) -> Dict[str, Any]:
+        """
+        JSON に出力するための辞書に変換する。changes は増減がある場合だけ、metrics は
+        extra_metrics (2つ目以降のメトリクスの名前) を渡した場合だけ含める。
+        """
+        item: Dict[str, Any] = {"service_name": self.service_name, "billing": self.billing}
+        if extra_metrics:
+            item["metrics"] = dict(zip(extra_metrics, self.extra_amounts))
+        if self.changes:
+            item["changes"] = list(self.changes)
+        return item
+
+    def with_change(self, change: Dict[str, Any]) -> "ServiceCost":
+        """
+        増減を1つ追加したレコードを返す。
+        """
+        return ServiceCost(self.service_name, self.billing, (*self.changes, change), self.extra_amounts)
+
+    def __getitem__(self, key: str) -> Any:
+        if key not in SERVICE_COST_FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key: object) -> bool:
+        return key in SERVICE_COST_FIELDS
+
+    def get(self, key: str, default: Optional[Any] = None) -> Any:
+        return getattr(self, key) if key in SERVICE_COST_FIELDS else default
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ServiceCost):
+            return NotImplemented
+        return (
+            (self.service_name, self.billing, self.changes, self.extra_amounts)
+            == (other.service_name, other.billing, other.changes, other.extra_amounts)
+        )
+
+    def __repr__(self) -> str:
+        extra = f", extra_amounts={self.extra_amounts!r}" if self.extra_amounts else ""
+        return f"ServiceCost({self.service_name!r}, {self.billing!r}, changes={self.changes!r}{extra})"
+
+
+def as_service_costs(items: Iterable[Any], extra_metrics: Sequence[str] = ()) -> List[ServiceCost]:
+    """
+    ServiceCost または辞書形式の行のリストを ServiceCost のリストにそろえる。
+    """
+    return [
+        item if isinstance(item, ServiceCost) else ServiceCost.from_dict(item, extra_metrics)
+        for item in items
+    ]
@@ -0,0 +1,212 @@
+# src/multi_account.py
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Sequence
+
+import boto3
+import botocore.exceptions
+
+import cost_report
+from cost_records import ServiceCost
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+ROLE_SESSION_NAME = "aws-cost-explore"
+DEFAULT_MAX_WORKERS = 8
+
+# ワーカースレッドごとのベースセッション・STSクライアント
+# (boto3.Session はスレッドセーフではないため、スレッド間で共有しない)
+_thread_local = threading.local()
+
+
+# --------------------------------------------------------------------
+# 実行時に環境変数を取得する関数
+# --------------------------------------------------------------------
+def get_multi_account_config() -> dict:
+    """
+    マルチアカウントレポート用の環境変数を実行時に取得して返す
+
+    Returns:
+        dict: TARGETS (ロールARNまたはプロファイル名のリスト), MAX_WORKERS をキーに含む辞書
+    """
+    targets = os.environ.get("REPORT_TARGETS", "")
+    return {
+        "TARGETS": [t.strip() for t in targets.split(",") if t.strip()],
+        "MAX_WORKERS": int(os.environ.get("REPORT_MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+    }
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+def is_role_arn(target: str) -> bool:
+    """
+    対象がIAMロールARNかどうかを判定する (それ以外はプロファイル名として扱う)。
+    """
+    return target.startswith("arn:aws")
+
+
+def _get_worker_sts_client() -> Any:
+    """
+    ワーカースレッド専用のSTSクライアントを返す。スレッド内では使い回す。
+    """
+    sts_client = getattr(_thread_local, "sts_client", None)
+    if sts_client is None:
+        _thread_local.session = boto3.Session()
+        sts_client = _thread_local.session.client("sts")
+        _thread_local.sts_client = sts_client
+    return sts_client
+
+
+def get_account_session(target: str) -> boto3.Session:
+    """
+    ロールARNなら AssumeRole、プロファイル名ならそのプロファイルでセッションを作成する。
+    """
+    if not is_role_arn(target):
+        return boto3.Session(profile_name=target)
+
+    try:
+        credentials = _get_worker_sts_client().assume_role(
+            RoleArn=target,
+            RoleSessionName=ROLE_SESSION_NAME
+        )["Credentials"]
+    except botocore.exceptions.ClientError as e:
+        cost_report.logger.error(f"Failed to assume role {target}: {e}")
+        raise RuntimeError(f"ロール {target} の引き受けに失敗しました。") from e
+
+    return boto3.Session(
+        aws_access_key_id=credentials["AccessKeyId"],
+        aws_secret_access_key=credentials["SecretAccessKey"],
+        aws_session_token=credentials["SessionToken"],
+    )
+
+
+def get_session_account_id(session: boto3.Session, target: str) -> str:
+    """
+    セッションのAWSアカウントIDを取得する。ロールARNの場合はARNから取り出しSTS呼び出しを省く。
+    """
+    if is_role_arn(target):
+        return target.split(":")[4]
+    try:
+        return session.client("sts").get_caller_identity()["Account"]
+    except botocore.exceptions.ClientError as e:
+        cost_report.logger.error(f"Failed to fetch AWS Account ID: {e}")
+        raise RuntimeError("AWS Account IDの取得に失敗しました。") from e
+
+
+def run_account_report(target: str, period: Dict[str, str]) -> Dict[str, Any]:
+    """
+    1アカウント分のクレジット適用後/適用前の費用を取得する。
+
+    失敗した場合も例外は送出せず、error に内容を入れて返す。
+    """
+    result: Dict[str, Any] = {"target": target, "account_id": None, "error": None}
+    try:
+        session = get_account_session(target)
+        result["account_id"] = get_session_account_id(session, target)
+        explorer = cost_report.CostExplorer(
+            session.client(
+                "ce", region_name=cost_report.REGION_NAME, config=cost_report.ce_scheduler.get_client_config()
+            )
+        )
+        pages = explorer.iter_cost_and_usage_by_record_type(period)
+        after_credit, before_credit = explorer.split_by_credit(pages)
+        result.update({
+            "total_after_credit": explorer.get_total_cost(after_credit),
+            "total_before_credit": explorer.get_total_cost(before_credit),
+            "services_after_credit": list(explorer.get_service_costs(after_credit)),
+            "services_before_credit": list(explorer.get_service_costs(before_credit)),
+        })
+    except (RuntimeError, botocore.exceptions.BotoCoreError) as e:
+        cost_report.logger.error(f"Failed to build cost report for {target}: {e}")
+        result["error"] = str(e)
+    return result
+
+
+def rollup_reports(reports: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    アカウントごとの結果を合算する。失敗したアカウントは集計から除外する。
+    """
+    rollup: Dict[str, Any] = {
+        "account_count": 0,
+        "failed_count": 0,
+        "total_after_credit": 0.0,
+        "total_before_credit": 0.0,
+    }
+    services: Dict[str, Dict[str, float]] = {"after": {}, "before": {}}
+    for report in reports:
+        if report["error"]:
+            rollup["failed_count"] += 1
+            continue
+        rollup["account_count"] += 1
+        rollup["total_after_credit"] += report["total_after_credit"]
+        rollup["total_before_credit"] += report["total_before_credit"]
+        for view in ("after", "before"):
+            for item in report[f"services_{view}_credit"]:
+                services[view][item.service_name] = services[view].get(item.service_name, 0.0) + item.billing
+
+    for view in ("after", "before"):
+        rollup[f"services_{view}_credit"] = [
+            ServiceCost(name, billing)
+            for name, billing in sorted(services[view].items(), key=lambda kv: kv[1], reverse=True)
+        ]
+    return rollup
+
+
+def run_multi_account_report(
+    targets: Sequence[str],
+    period: Dict[str, str],
+    max_workers: int = DEFAULT_MAX_WORKERS
+) -> Dict[str, Any]:
+    """
+    複数アカウントのレポートを上限付きスレッドプールで並行取得し、合算結果とともに返す。
+
+    Returns:
+        dict: accounts (アカウントごとの結果, targets と同じ順), rollup (合算結果)
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(targets) or 1))) as executor:
+        reports = list(executor.map(lambda target: run_account_report(target, period), targets))
+    return {"accounts": reports, "rollup": rollup_reports(reports)}
+
+
+def main(targets: Optional[List[str]] = None) -> None:
+    """
+    メイン関数。REPORT_TARGETS の全アカウントのレポートと合算結果を表示する。
+    """
+    config = get_multi_account_config()
+    targets = targets if targets is not None else config["TARGETS"]
+    if not targets:
+        raise ValueError("REPORT_TARGETS is not set in the environment variables.")
+
+    start_date, end_date = cost_report.get_date_range()
+    period = {"Start": start_date, "End": end_date}
+    start_day_str = datetime.strptime(start_date, "%Y-%m-%d").strftime("%m/%d")
+    end_day_str = (datetime.strptime(end_date, "%Y-%m-%d") - timedelta(days=1)).strftime("%m/%d")
+
+    result = run_multi_account_report(targets, period, max_workers=config["MAX_WORKERS"])
+
+    for report in result["accounts"]:
+        if report["error"]:
+            cost_report.print_report(f"{report['target']}\nレポートの取得に失敗しました: {report['error']}", [])
+            continue
+        title = (
+            f"AWSアカウント {report['account_id']}\n"
+            f"{start_day_str}～{end_day_str}のクレジット適用後費用は、{report['total_after_credit']:.2f} USD、"
+            f"適用前費用は、{report['total_before_credit']:.2f} USD です。"
+        )
+        cost_report.print_report(title, cost_report.format_service_costs(report["services_before_credit"]))
+
+    rollup = result["rollup"]
+    title = (
+        f"{rollup['account_count']}アカウント合計 (失敗 {rollup['failed_count']}件)\n"
+        f"{start_day_str}～{end_day_str}のクレジット適用後費用は、{rollup['total_after_credit']:.2f} USD、"
+        f"適用前費用は、{rollup['total_before_credit']:.2f} USD です。"
+    )
+    cost_report.print_report(title, cost_report.format_service_costs(rollup["services_before_credit"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+# src/notifier.py
+from __future__ import annotations
+
+import sys
+import time
+import random
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait
+from typing import List, Dict, Any, Optional, Sequence, TYPE_CHECKING
+
+import renderer
+import instrumentation
+
+# requests の読み込みはコールドスタートを遅くするため、送信時まで遅らせる
+if TYPE_CHECKING:
+    import requests
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+DEFAULT_TIMEOUT_SECONDS = 10.0
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_BACKOFF_SECONDS = 0.5
+DEFAULT_MAX_WORKERS = 8
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+SNS_SUBJECT_MAX_LENGTH = 100
+
+logger = logging.getLogger(__name__)
+logger.disabled = True
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+class DeliveryError(Exception):
+    """
+    通知の送信失敗。retryable が True の場合は再送する。
+    """
+
+    def __init__(self, message: str, retryable: bool = True) -> None:
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def create_http_session(pool_size: int = DEFAULT_MAX_WORKERS) -> requests.Session:
+    """
+    keep-alive で接続を使い回す requests.Session を作成する。再送は Dispatcher 側で行う。
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class WebhookSink:
+    """
+    レンダラーで作成した JSON を Webhook に POST する通知先の基底クラス。
+
+    通知先は renderer (レポートを1件以上のメッセージ本文に変換する) と、本文1件を送信する
+    send_payload() を持つ。再送は NotificationDispatcher が未送信の本文だけに対して行う。
+    """
+
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = DEFAULT_TIMEOUT_SECONDS) -> None:
+        self.url = url
+        self.timeout = timeout
+        self.renderer = self.create_renderer()
+
+    def create_renderer(self) -> renderer.Renderer:
+        raise NotImplementedError
+
+    def send_payload(self, report: Dict[str, Any], payload: str, session: requests.Session) -> int:
+        """
+        メッセージ本文を1件送信し、送信したバイト数を返す。
+        """
+        import requests
+
+        body = payload.encode("utf-8")
+        try:
+            response = session.post(
+                url=self.url,
+                data=body,
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout
+            )
+        except requests.exceptions.RequestException as e:
+            raise DeliveryError(f"{self.name}: {e}") from e
+        if response.status_code >= 400:
+            raise DeliveryError(
+                f"{self.name}: HTTP {response.status_code}",
+                retryable=response.status_code in RETRYABLE_STATUS_CODES
+            )
+        return len(body)
+
+
+class TeamsSink(WebhookSink):
+    """
+    Teams Webhook に Adaptive Card 形式で送信する通知先。
+    """
+
+    name = "teams"
+
+    def create_renderer(self) -> renderer.Renderer:
+        return renderer.TeamsCardRenderer()
+
+
+class SlackSink(WebhookSink):
+    """
+    Slack Incoming Webhook に Block Kit 形式で送信する通知先。
+    """
+
+    name = "slack"
+
+    def create_renderer(self) -> renderer.Renderer:
+        return renderer.SlackBlocksRenderer()
+
+
+class SnsSink:
+    """
+    Amazon SNS トピックに Markdown 形式で送信する通知先。
+    """
+
+    name = "sns"
+
+    def __init__(self, topic_arn: str, client: Any = None, timeout: float = DEFAULT_TIMEOUT_SECONDS) -> None:
+        self.topic_arn = topic_arn
+        self.timeout = timeout
+        self.renderer = renderer.MarkdownRenderer(max_bytes=renderer.SNS_MAX_BYTES)
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> Any:
+        with self._lock:
+            if self._client is None:
+                import boto3
+                from botocore.config import Config
+
+                self._client = boto3.client(
+                    "sns",
+                    config=Config(connect_timeout=self.timeout, read_timeout=self.timeout, retries={"max_attempts": 1})
+                )
+            return self._client
+
+    def send_payload(self, report: Dict[str, Any], payload: str, session: requests.Session) -> int:
+        import botocore.exceptions
+
+        subject = report.get("title", "").replace("\n", " ")[:SNS_SUBJECT_MAX_LENGTH] or "AWS cost report"
+        try:
+            self.client.publish(TopicArn=self.topic_arn, Subject=subject, Message=payload)
+        except botocore.exceptions.ClientError as e:
+            code = e.response.get("Error", {}).get("Code", "")
+            raise DeliveryError(f"{self.name}: {e}", retryable=code in ("Throttling", "ThrottlingException")) from e
+        except botocore.exceptions.BotoCoreError as e:
+            raise DeliveryError(f"{self.name}: {e}") from e
+        return len(payload.encode("utf-8"))
+
+
+class FileSink:
+    """
+    ファイル (path が "-" の場合は標準出力) に追記する通知先。
+    拡張子が .json の場合は JSON、それ以外は Markdown で出力する。
+    """
+
+    name = "file"
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.renderer = renderer.JsonRenderer() if path.endswith(".json") else renderer.MarkdownRenderer()
+        self._lock = threading.Lock()
+
+    def send_payload(self, report: Dict[str, Any], payload: str, session: requests.Session) -> int:
+        text = f"{payload}\n\n"
+        with self._lock:
+            if self.path == "-":
+                sys.stdout.write(text)
+                sys.stdout.flush()
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(text)
+        return len(text.encode("utf-8"))
+
+
+class NotificationDispatcher:
+    """
+    複数の通知先へレポートを並行して送信するディスパッチャ。
+
+    HTTP の通知先は keep-alive の接続プールを共有する。送信失敗時は指数バックオフ
+    (ジッター付き) で max_attempts 回まで再送し、通知先ごとの送信結果を metrics に記録する。
+    レポートが複数のメッセージに分割される場合、再送するのは失敗したメッセージ以降だけで、
+    送信済みのメッセージは重複して送らない。
+    """
+
+    def __init__(
+        self,
+        sinks: Sequence[Any],
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        session: Optional[requests.Session] = None
+    ) -> None:
+        self.sinks = list(sinks)
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.session = session or create_http_session(max_workers)
+        self.metrics: Dict[str, Dict[str, float]] = {
+            sink.name: {"attempts": 0, "delivered": 0, "failed": 0, "bytes": 0, "seconds": 0.0}
+            for sink in self.sinks
+        }
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def _record(self, sink_name: str, **values: float) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self.metrics[sink_name][key] += value
+
+    def _deliver(self, sink: Any, report: Dict[str, Any]) -> Dict[str, Any]:
+        with instrumentation.current().span(f"notify.{sink.name}"):
+            return self._deliver_with_retry(sink, report)
+
+    def _deliver_with_retry(self, sink: Any, report: Dict[str, Any]) -> Dict[str, Any]:
+        metrics = instrumentation.current()
+        started = time.perf_counter()
+        error: Optional[str] = None
+        payloads = sink.renderer.render(report)
+        delivered = 0
+        sent_bytes = 0
+        for attempt in range(1, self.max_attempts + 1):
+            self._record(sink.name, attempts=1)
+            if attempt > 1:
+                metrics.count("notify.retries")
+            try:
+                while delivered < len(payloads):
+                    sent_bytes += sink.send_payload(report, payloads[delivered], self.session)
+                    delivered += 1
+                self._record(sink.name, delivered=1, bytes=sent_bytes, seconds=time.perf_counter() - started)
+                metrics.observe(f"notify.{sink.name}.bytes", sent_bytes, unit="Bytes")
+                return {"sink": sink.name, "delivered": True, "attempts": attempt, "error": None}
+            except DeliveryError as e:
+                error = str(e)
+                logger.warning(f"Notification to {sink.name} failed (attempt {attempt}): {e}")
+                if not e.retryable or attempt == self.max_attempts:
+                    break
+                delay = self.backoff_seconds * (2 ** (attempt - 1))
+                time.sleep(delay + random.uniform(0, delay))
+
+        self._record(sink.name, failed=1, seconds=time.perf_counter() - started)
+        metrics.count("notify.failures")
+        return {"sink": sink.name, "delivered": False, "attempts": attempt, "error": error}
+
+    def submit(self, report: Dict[str, Any]) -> List[Future]:
+        """
+        全通知先への送信を開始し、送信結果の Future を返す。
+
+        report は title と sections を持つ辞書 (renderer.Renderer を参照)。
+        """
+        return [self._executor.submit(self._deliver, sink, report) for sink in self.sinks]
+
+    def dispatch(self, reports: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        複数のレポートを全通知先へ並行して送信し、完了まで待って送信結果を返す。
+        """
+        futures = [future for report in reports for future in self.submit(report)]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+
+def build_sinks(config: Dict[str, Any]) -> List[Any]:
+    """
+    設定から通知先のリストを作成する。
+
+    Args:
+        config: cost_report.get_config() の戻り値
+    """
+    timeout = config.get("NOTIFY_TIMEOUT_SECONDS", DEFAULT_TIMEOUT_SECONDS)
+    sinks: List[Any] = []
+    if config.get("USE_TEAMS_POST"):
+        sinks.append(TeamsSink(config["TEAMS_WEBHOOK_URL"], timeout=timeout))
+    if config.get("SLACK_WEBHOOK_URL"):
+        sinks.append(SlackSink(config["SLACK_WEBHOOK_URL"], timeout=timeout))
+    if config.get("SNS_TOPIC_ARN"):
+        sinks.append(SnsSink(config["SNS_TOPIC_ARN"], timeout=timeout))
+    if config.get("REPORT_OUTPUT_FILE"):
+        sinks.append(FileSink(config["REPORT_OUTPUT_FILE"]))
+    return sinks
+
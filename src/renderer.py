@@ -0,0 +1,345 @@
+# src/renderer.py
+import json
+from string import Template
+from typing import List, Dict, Any, Optional, Sequence
+
+import instrumentation
+from cost_records import ServiceCost, as_service_costs
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+# 各プラットフォームが受け付けるメッセージサイズの上限 (バイト)
+TEAMS_MAX_BYTES = 28 * 1024
+SLACK_MAX_BYTES = 40 * 1000
+SLACK_MAX_SECTION_CHARS = 3000
+SLACK_MAX_HEADER_CHARS = 150
+SLACK_MAX_BLOCKS = 50
+SNS_MAX_BYTES = 256 * 1024
+
+# サイズ超過時に試す上位件数 (大きい順)
+TOP_N_STEPS = (50, 30, 20, 10, 5, 3, 1)
+NO_SERVICE_COSTS_TEXT = "サービスごとの費用データはありません。"
+OTHERS_LABEL = "その他"
+# 比較対象の期間の費用が0以下で、増減率を計算できない場合の表示
+NEW_COST_LABEL = "新規"
+
+# --------------------------------------------------------------------
+# テンプレート (モジュール読み込み時に1度だけ組み立てる)
+# --------------------------------------------------------------------
+SERVICE_LINE_TEMPLATE = Template("- ${name}: ${billing} USD${metrics}${changes}")
+CHANGE_TEMPLATE = Template("${label}比 ${delta} USD (${percent})")
+METRIC_TEMPLATE = Template("${name} ${amount}")
+OTHERS_LINE_TEMPLATE = Template("- ${label} (${count}サービス): ${billing} USD")
+MARKDOWN_SECTION_TEMPLATE = Template("### ${title}\n\n${lines}")
+SLACK_SECTION_TEMPLATE = Template("*${title}*\n${lines}")
+
+_TEXT_PLACEHOLDER = "__REPORT_TEXT__"
+
+
+def _compile_envelope(envelope: Dict[str, Any]) -> Sequence[str]:
+    """
+    固定部分を事前にシリアライズし、本文の前後の文字列に分けて返す。
+    """
+    prefix, suffix = json.dumps(envelope, ensure_ascii=False).split(json.dumps(_TEXT_PLACEHOLDER))
+    return prefix, suffix
+
+
+TEAMS_ENVELOPE = _compile_envelope({
+    "attachments": [
+        {
+            "contentType": "application/vnd.microsoft.card.adaptive",
+            "content": {
+                "$schema": "http://adaptivecards.io/schemas/adaptive-card.json",
+                "type": "AdaptiveCard",
+                "version": "1.2",
+                "body": [
+                    {
+                        "type": "TextBlock",
+                        "text": _TEXT_PLACEHOLDER,
+                        "wrap": True,
+                        "markdown": True
+                    }
+                ]
+            }
+        }
+    ]
+})
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+def format_changes(changes: Sequence[Dict[str, Any]]) -> str:
+    """
+    比較対象の期間からの増減 (label, delta, percent の辞書のリスト) を行末に付ける文字列に整形する。
+    """
+    if not changes:
+        return ""
+    texts = [
+        CHANGE_TEMPLATE.substitute(
+            label=change["label"],
+            delta=f"{change['delta']:+.2f}",
+            percent=NEW_COST_LABEL if change["percent"] is None else f"{change['percent']:+.1f}%"
+        )
+        for change in changes
+    ]
+    return f" ({', '.join(texts)})"
+
+
+def format_metric_amounts(names: Sequence[str], amounts: Sequence[float]) -> str:
+    """
+    2つ目以降のメトリクスの値を金額の後ろに付ける文字列に整形する。メトリクスがなければ空文字列。
+    """
+    if not names:
+        return ""
+    texts = [METRIC_TEMPLATE.substitute(name=name, amount=f"{amount:.2f}") for name, amount in zip(names, amounts)]
+    return f" [{' / '.join(texts)}]"
+
+
+def section_lines(section: Dict[str, Any], top_n: Optional[int] = None) -> List[str]:
+    """
+    区分のサービス別費用を表示行に整形する。
+
+    top_n を指定した場合は費用の大きい順に top_n 件を残し、残りを「その他」の1行にまとめる。
+    services の代わりに整形済みの lines を持つ区分はそのまま返す。
+    """
+    if "services" not in section:
+        lines = list(section.get("lines", []))
+        if top_n is not None and len(lines) > top_n:
+            lines = lines[:top_n] + [f"- {OTHERS_LABEL} ({len(lines) - top_n}件)"]
+        return lines
+
+    extra_metrics = section.get("extra_metrics", ())
+    services = as_service_costs(section["services"], extra_metrics)
+    others: Sequence[ServiceCost] = ()
+    if top_n is not None and len(services) > top_n:
+        ranked = sorted(services, key=lambda item: item.billing, reverse=True)
+        services, others = ranked[:top_n], ranked[top_n:]
+
+    lines = [
+        SERVICE_LINE_TEMPLATE.substitute(
+            name=item.service_name,
+            billing=f"{item.billing:.2f}",
+            metrics=format_metric_amounts(extra_metrics, item.extra_amounts),
+            changes=format_changes(item.changes)
+        )
+        for item in services
+    ]
+    if others:
+        lines.append(OTHERS_LINE_TEMPLATE.substitute(
+            label=OTHERS_LABEL,
+            count=len(others),
+            billing=f"{sum(item.billing for item in others):.2f}"
+        ))
+    return lines
+
+
+class Renderer:
+    """
+    レポートを各プラットフォーム向けのメッセージ本文に変換する基底クラス。
+
+    レポートは title (見出し) と sections (区分のリスト) を持つ辞書。区分は title と
+    services (ServiceCost、または service_name, billing の辞書のリスト) または lines (整形済みの行) を持つ。
+    複数のメトリクスを取得した区分は、2つ目以降のメトリクスの名前 (extra_metrics) と合計 (extra_totals) を持つ。
+    """
+
+    name = "base"
+    content_type = "text/plain"
+    max_bytes: Optional[int] = None
+
+    def render_one(self, report: Dict[str, Any], top_n: Optional[int] = None) -> str:
+        raise NotImplementedError
+
+    def render(self, report: Dict[str, Any]) -> List[str]:
+        """
+        レポートをメッセージ本文のリストに変換する。
+
+        上限サイズを超える場合は上位件数を絞って「その他」にまとめ、それでも収まらない
+        場合は区分ごとのメッセージに分割する。通常は1件のみを返す。
+        """
+        metrics = instrumentation.current()
+        with metrics.span(f"render.{self.name}"):
+            bodies = self._render(report)
+        if metrics.enabled:
+            metrics.observe(f"render.{self.name}.bytes", sum(len(b.encode("utf-8")) for b in bodies), unit="Bytes")
+            metrics.observe(f"render.{self.name}.messages", len(bodies))
+        return bodies
+
+    def _render(self, report: Dict[str, Any]) -> List[str]:
+        body = self.render_one(report)
+        if self._fits(body):
+            return [body]
+
+        for top_n in TOP_N_STEPS:
+            body = self.render_one(report, top_n=top_n)
+            if self._fits(body):
+                return [body]
+
+        sections = report.get("sections", [])
+        if len(sections) <= 1:
+            return [self._truncate(body)]
+        return [
+            body
+            for section in sections
+            for body in self._render({**report, "sections": [section]})
+        ]
+
+    def _fits(self, body: str) -> bool:
+        return self.max_bytes is None or len(body.encode("utf-8")) <= self.max_bytes
+
+    def _truncate(self, body: str) -> str:
+        return body.encode("utf-8")[:self.max_bytes].decode("utf-8", errors="ignore")
+
+
+class MarkdownRenderer(Renderer):
+    """
+    Markdown 形式のテキストに変換する。
+    """
+
+    name = "markdown"
+    content_type = "text/markdown"
+
+    def __init__(self, max_bytes: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes
+
+    def render_text(self, report: Dict[str, Any], top_n: Optional[int] = None) -> str:
+        parts = [f"## {report['title']}"] if report.get("title") else []
+        for section in report.get("sections", []):
+            lines = section_lines(section, top_n)
+            parts.append(MARKDOWN_SECTION_TEMPLATE.substitute(
+                title=section["title"],
+                lines="\n".join(lines) if lines else NO_SERVICE_COSTS_TEXT
+            ))
+        return "\n\n".join(parts)
+
+    def render_one(self, report: Dict[str, Any], top_n: Optional[int] = None) -> str:
+        return self.render_text(report, top_n)
+
+
+class TeamsCardRenderer(MarkdownRenderer):
+    """
+    Teams Webhook 向けの Adaptive Card に変換する。
+    """
+
+    name = "teams"
+    content_type = "application/json"
+
+    def __init__(self, max_bytes: int = TEAMS_MAX_BYTES) -> None:
+        super().__init__(max_bytes)
+
+    def render_one(self, report: Dict[str, Any], top_n: Optional[int] = None) -> str:
+        prefix, suffix = TEAMS_ENVELOPE
+        return prefix + json.dumps(self.render_text(report, top_n), ensure_ascii=False) + suffix
+
+    def _truncate(self, body: str) -> str:
+        # JSON として壊さないよう、本文テキストを切り詰めてから組み立て直す
+        prefix, suffix = TEAMS_ENVELOPE
+        text = json.loads(body[len(prefix):len(body) - len(suffix)])
+        while text and not self._fits(prefix + json.dumps(text, ensure_ascii=False) + suffix):
+            text = text[:int(len(text) * 0.9)]
+        return prefix + json.dumps(text, ensure_ascii=False) + suffix
+
+
+class SlackBlocksRenderer(Renderer):
+    """
+    Slack Incoming Webhook 向けの Block Kit メッセージに変換する。
+    """
+
+    name = "slack"
+    content_type = "application/json"
+
+    def __init__(self, max_bytes: int = SLACK_MAX_BYTES) -> None:
+        self.max_bytes = max_bytes
+
+    def render_one(self, report: Dict[str, Any], top_n: Optional[int] = None) -> str:
+        blocks: List[Dict[str, Any]] = []
+        texts = [report["title"]] if report.get("title") else []
+        if report.get("title"):
+            blocks.append({
+                "type": "header",
+                "text": {"type": "plain_text", "text": self._header_text(report["title"])},
+            })
+        for section in report.get("sections", []):
+            lines = section_lines(section, top_n)
+            text = SLACK_SECTION_TEMPLATE.substitute(
+                title=section["title"],
+                lines="\n".join(lines) if lines else NO_SERVICE_COSTS_TEXT
+            )
+            texts.append(text)
+            blocks.extend(
+                {"type": "section", "text": {"type": "mrkdwn", "text": chunk}}
+                for chunk in self._split_section(text)
+            )
+        return json.dumps({"text": "\n".join(texts), "blocks": blocks}, ensure_ascii=False)
+
+    @staticmethod
+    def _header_text(title: str) -> str:
+        """
+        header ブロックの上限文字数 (SLACK_MAX_HEADER_CHARS) を超える見出しを末尾で切り詰める。
+        """
+        if len(title) <= SLACK_MAX_HEADER_CHARS:
+            return title
+        return title[:SLACK_MAX_HEADER_CHARS - 1] + "…"
+
+    @staticmethod
+    def _split_section(text: str) -> List[str]:
+        """
+        区分のテキストを、section ブロックの上限文字数 (SLACK_MAX_SECTION_CHARS) 以下になるよう
+        行単位で複数のブロックに分ける。行の途中では分けない。
+        """
+        if len(text) <= SLACK_MAX_SECTION_CHARS:
+            return [text]
+        chunks: List[str] = []
+        current: List[str] = []
+        length = 0
+        for line in text.split("\n"):
+            if current and length + 1 + len(line) > SLACK_MAX_SECTION_CHARS:
+                chunks.append("\n".join(current))
+                current, length = [], 0
+            length += len(line) + (1 if current else 0)
+            current.append(line)
+        chunks.append("\n".join(current))
+        return chunks
+
+    def _fits(self, body: str) -> bool:
+        # ブロック数が上限 (SLACK_MAX_BLOCKS) を超える場合も、上位件数の絞り込みと区分ごとの分割に回す
+        return super()._fits(body) and len(json.loads(body).get("blocks", ())) <= SLACK_MAX_BLOCKS
+
+    def _truncate(self, body: str) -> str:
+        message = json.loads(body)
+        text = message["text"]
+        while text and not self._fits(json.dumps({"text": text}, ensure_ascii=False)):
+            text = text[:int(len(text) * 0.9)]
+        return json.dumps({"text": text}, ensure_ascii=False)
+
+
+class JsonRenderer(Renderer):
+    """
+    機械処理向けの JSON に変換する。サイズ上限はなく、金額は数値のまま出力する。
+    """
+
+    name = "json"
+    content_type = "application/json"
+
+    def render_one(self, report: Dict[str, Any], top_n: Optional[int] = None) -> str:
+        return json.dumps({
+            "title": report.get("title"),
+            "sections": [self._section(section) for section in report.get("sections", [])],
+        }, ensure_ascii=False)
+
+    @staticmethod
+    def _section(section: Dict[str, Any]) -> Dict[str, Any]:
+        extra_metrics = section.get("extra_metrics", ())
+        body = {
+            "title": section["title"],
+            "total": section.get("total"),
+            "comparisons": section.get("comparisons", []),
+            "services": (
+                [item.to_dict(extra_metrics) for item in as_service_costs(section["services"], extra_metrics)]
+                if "services" in section else section.get("lines", [])
+            ),
+        }
+        if extra_metrics:
+            body["metrics"] = dict(zip(extra_metrics, section.get("extra_totals", ())))
+        return body
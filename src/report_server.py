@@ -0,0 +1,379 @@
+# src/report_server.py
+"""
+費用レポートをローカルの HTTP で提供する常駐サーバ。
+
+複数のチームがそれぞれ cost_report.py を実行すると、その数だけ Cost Explorer の呼び出しが
+増える。このサーバはレポートをメモリ上にキャッシュし、古くなった値は返しながら裏で
+1回だけ取り直す (stale-while-revalidate)。同じレポートへの同時リクエストは1つの取得に
+まとめるため、利用者が何十いても Cost Explorer の呼び出しは1利用者分とほぼ変わらない。
+
+コンテナの既存のエントリポイント (python src/cost_report.py) で、環境変数 RUN_MODE=server を
+設定すると起動する。
+
+エンドポイント:
+    GET /report?start=YYYY-MM-DD&end=YYYY-MM-DD&compare=previous_month&drilldown=SERVICE,USAGE_TYPE
+               &top_n=5&format=json|markdown
+    GET /stats
+    GET /healthz
+"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from typing import List, Dict, Any, Callable, Hashable, Optional, Tuple
+
+import renderer
+import cost_report
+
+# --------------------------------------------------------------------
+# 定数定義
+# --------------------------------------------------------------------
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+# この秒数以内の値はそのまま返し、DEFAULT_STALE_SECONDS 以内の値は返しながら裏で取り直す
+DEFAULT_FRESH_SECONDS = 300
+DEFAULT_STALE_SECONDS = 3600
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_REFRESH_WORKERS = 4
+RENDERERS = {"json": renderer.JsonRenderer, "markdown": renderer.MarkdownRenderer}
+
+# ロギング設定
+logger = logging.getLogger(__name__)
+logger.disabled = True
+
+
+# --------------------------------------------------------------------
+# 実行時に環境変数を取得する関数
+# --------------------------------------------------------------------
+def get_server_config() -> dict:
+    """
+    環境変数を実行時に取得して返す
+
+    Returns:
+        dict: SERVER_HOST, SERVER_PORT, SERVER_FRESH_SECONDS, SERVER_STALE_SECONDS,
+              SERVER_MAX_ENTRIES をキーに含む辞書
+    """
+    return {
+        "SERVER_HOST": os.environ.get("SERVER_HOST", DEFAULT_HOST),
+        "SERVER_PORT": int(os.environ.get("SERVER_PORT", DEFAULT_PORT)),
+        "SERVER_FRESH_SECONDS": float(os.environ.get("SERVER_FRESH_SECONDS", DEFAULT_FRESH_SECONDS)),
+        "SERVER_STALE_SECONDS": float(os.environ.get("SERVER_STALE_SECONDS", DEFAULT_STALE_SECONDS)),
+        "SERVER_MAX_ENTRIES": int(os.environ.get("SERVER_MAX_ENTRIES", DEFAULT_MAX_ENTRIES)),
+    }
+
+
+# --------------------------------------------------------------------
+# クラス・関数定義
+# --------------------------------------------------------------------
+class StaleWhileRevalidateCache:
+    """
+    値をメモリに保持するキャッシュ。スレッドセーフ。
+
+    取得から fresh_seconds 以内の値はそのまま返す。stale_seconds 以内の値は古いまま返し、
+    バックグラウンドで1回だけ取り直す。それより古いか未取得の場合は取得を待つが、同じキーを
+    取得中であれば新たに取得せず、その結果を待つ (リクエストの集約)。
+    件数が max_entries を超えた場合は参照が古いものから削除する。
+    """
+
+    def __init__(
+        self,
+        fresh_seconds: float = DEFAULT_FRESH_SECONDS,
+        stale_seconds: float = DEFAULT_STALE_SECONDS,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        executor: Optional[ThreadPoolExecutor] = None,
+        clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.fresh_seconds = fresh_seconds
+        self.stale_seconds = max(stale_seconds, fresh_seconds)
+        self.max_entries = max_entries
+        self.executor = executor or ThreadPoolExecutor(max_workers=DEFAULT_REFRESH_WORKERS)
+        self.clock = clock
+        self.stats = {"hits": 0, "stale_hits": 0, "misses": 0, "collapsed": 0, "refreshes": 0, "errors": 0}
+        self._entries: "OrderedDict[Hashable, Tuple[Any, float]]" = OrderedDict()
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, loader: Callable[[], Any]) -> Any:
+        """
+        key の値を返す。取得が必要な場合は loader() を呼び出す。
+        """
+        refresh: Optional[Future] = None
+        with self._lock:
+            entry = self._entries.get(key)
+            age = self.clock() - entry[1] if entry is not None else None
+            if age is not None and age <= self.stale_seconds:
+                self._entries.move_to_end(key)
+                if age <= self.fresh_seconds:
+                    self.stats["hits"] += 1
+                    return entry[0]
+                self.stats["stale_hits"] += 1
+                if key not in self._inflight:
+                    self.stats["refreshes"] += 1
+                    refresh = self._inflight[key] = Future()
+                future = None
+            else:
+                future = self._inflight.get(key)
+                owner = future is None
+                if owner:
+                    self.stats["misses"] += 1
+                    future = self._inflight[key] = Future()
+                else:
+                    self.stats["collapsed"] += 1
+
+        if future is None:
+            # 取り直しはロックを放してから投入する
+            if refresh is not None:
+                self.executor.submit(self._load, key, loader, refresh)
+            return entry[0]
+        if owner:
+            self._load(key, loader, future)
+        return future.result()
+
+    def _load(self, key: Hashable, loader: Callable[[], Any], future: Future) -> None:
+        try:
+            value = loader()
+        except Exception as e:
+            # 取り直しに失敗した場合、古い値は stale_seconds が過ぎるまで返し続ける
+            logger.error(f"Failed to load {key}: {e}")
+            with self._lock:
+                self.stats["errors"] += 1
+                self._inflight.pop(key, None)
+            future.set_exception(e)
+            return
+
+        with self._lock:
+            self._entries[key] = (value, self.clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._inflight.pop(key, None)
+        future.set_result(value)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+class ReportService:
+    """
+    クエリパラメータからレポートを作成し、StaleWhileRevalidateCache 経由で返す。
+
+    比較対象の期間は締め済みのため、CostExplorer に ResponseCache を渡しておけば、比較の指定が
+    異なるレポート同士でも同じ期間の Cost Explorer の呼び出しは1回で済む。
+    """
+
+    def __init__(
+        self,
+        explorer: cost_report.CostExplorer,
+        account_id: str,
+        cache: Optional[StaleWhileRevalidateCache] = None
+    ) -> None:
+        self.explorer = explorer
+        self.account_id = account_id
+        self.cache = cache or StaleWhileRevalidateCache()
+
+    @staticmethod
+    def parse_query(query: Dict[str, List[str]]) -> Tuple[Any, ...]:
+        """
+        クエリパラメータを正規化し、キャッシュのキーに使えるタプルにする。不正な値は ValueError。
+        """
+        def param(name: str, default: str = "") -> str:
+            return query.get(name, [default])[-1].strip()
+
+        def names(name: str) -> Tuple[str, ...]:
+            return tuple(value.strip() for value in param(name).split(",") if value.strip())
+
+        default_start, default_end = cost_report.get_date_range()
+        start, end = param("start", default_start), param("end", default_end)
+        try:
+            start_date, end_date = date.fromisoformat(start), date.fromisoformat(end)
+        except ValueError as e:
+            raise ValueError(f"期間の指定が不正です: start={start}, end={end}") from e
+        if start_date >= end_date:
+            raise ValueError(f"start は end より前の日付を指定してください: start={start}, end={end}")
+
+        comparisons = tuple(
+            (label, period["Start"], period["End"])
+            for label, period in cost_report.get_comparison_periods(
+                start, end, [name.lower() for name in names("compare")]
+            )
+        )
+        drilldown = names("drilldown")
+        if drilldown and len(drilldown) != 2:
+            raise ValueError(f"drilldown には2つのディメンションを指定してください: {','.join(drilldown)}")
+        top_n = int(param("top_n", str(cost_report.DEFAULT_DRILLDOWN_TOP_N)))
+        return start, end, comparisons, drilldown, top_n
+
+    def get_report(self, query: Dict[str, List[str]]) -> Dict[str, Any]:
+        """
+        クエリパラメータに対応するレポート (renderer.Renderer の形式) を返す。
+        """
+        spec = self.parse_query(query)
+        return self.cache.get(("report",) + spec, lambda: self.build_report(*spec))
+
+    def _sections(self, start: str, end: str, start_day: str, end_day: str) -> List[Dict[str, Any]]:
+        return cost_report.build_combined_cost_sections(
+            self.explorer, {"Start": start, "End": end}, start_day, end_day
+        )
+
+    def build_report(
+        self,
+        start: str,
+        end: str,
+        comparisons: Tuple[Tuple[str, str, str], ...],
+        drilldown: Tuple[str, ...],
+        top_n: int
+    ) -> Dict[str, Any]:
+        """
+        クレジット適用後/適用前の区分 (比較対象の期間との増減、ドリルダウンを含む) を作成する。
+        比較対象の期間とドリルダウンは並行して取得する。
+        """
+        start_day = datetime.strptime(start, "%Y-%m-%d").strftime("%m/%d")
+        end_day = (datetime.strptime(end, "%Y-%m-%d") - timedelta(days=1)).strftime("%m/%d")
+        with ThreadPoolExecutor(max_workers=len(comparisons) + 1) as executor:
+            previous_futures = [
+                (label, executor.submit(self._sections, previous_start, previous_end, start_day, end_day))
+                for label, previous_start, previous_end in comparisons
+            ]
+            drilldown_future = None
+            if drilldown:
+                drilldown_future = executor.submit(
+                    cost_report.build_drilldown_section,
+                    self.explorer, {"Start": start, "End": end}, drilldown, start_day, end_day, top_n=top_n
+                )
+            sections = self._sections(start, end, start_day, end_day)
+            for label, future in previous_futures:
+                sections = [
+                    cost_report.compare_section(section, label, previous)
+                    for section, previous in zip(sections, future.result())
+                ]
+            if drilldown_future is not None:
+                sections = sections + [drilldown_future.result()]
+        return {"title": f"AWSアカウント {self.account_id}", "sections": sections}
+
+    @property
+    def stats(self) -> Dict[str, Any]:
+        return {"cache": dict(self.cache.stats), "scheduler": dict(self.explorer.scheduler.stats)}
+
+
+class ReportServer:
+    """
+    ReportService をローカルの HTTP で公開するサーバ。
+    """
+
+    def __init__(self, service: ReportService, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        self.service = service
+        owner = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self) -> None:
+                status, content_type, payload = owner.handle(self.path)
+                self.send_response(status)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), _Handler)
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def handle(self, path: str) -> Tuple[int, str, bytes]:
+        """
+        リクエストを処理し、(HTTP ステータス, Content-Type, 本文) を返す。
+        """
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+        try:
+            if url.path == "/healthz":
+                return self._json(200, {"status": "ok"})
+            if url.path == "/stats":
+                return self._json(200, self.service.stats)
+            if url.path != "/report":
+                return self._json(404, {"error": f"Not found: {url.path}"})
+
+            output_format = query.get("format", ["json"])[-1]
+            if output_format not in RENDERERS:
+                raise ValueError(f"format の値が不正です: {output_format} ({', '.join(RENDERERS)} のいずれか)")
+            report_renderer = RENDERERS[output_format]()
+            body = report_renderer.render_one(self.service.get_report(query))
+            return 200, report_renderer.content_type, body.encode("utf-8")
+        except ValueError as e:
+            return self._json(400, {"error": str(e)})
+        except Exception as e:
+            logger.error(f"Failed to build report: {e}")
+            return self._json(502, {"error": str(e)})
+
+    @staticmethod
+    def _json(status: int, body: Dict[str, Any]) -> Tuple[int, str, bytes]:
+        return status, "application/json", json.dumps(body, ensure_ascii=False).encode("utf-8")
+
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    def __enter__(self) -> "ReportServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def serve() -> None:
+    """
+    サーバを起動し、停止されるまでリクエストを処理する (RUN_MODE=server のエントリポイント)。
+
+    Cost Explorer クライアントとアカウントIDは起動時に1度だけ取得し、全リクエストで共有する。
+    """
+    config = cost_report.get_config()
+    server_config = get_server_config()
+    client = cost_report.get_client()
+    account_id = cost_report.get_account_id()
+    response_cache = None
+    if config["CE_CACHE_DIR"]:
+        response_cache = cost_report.ResponseCache(
+            config["CE_CACHE_DIR"],
+            ttl_seconds=config["CE_CACHE_TTL_SECONDS"],
+            max_bytes=config["CE_CACHE_MAX_BYTES"],
+            namespace=account_id
+        )
+    cache = StaleWhileRevalidateCache(
+        fresh_seconds=server_config["SERVER_FRESH_SECONDS"],
+        stale_seconds=server_config["SERVER_STALE_SECONDS"],
+        max_entries=server_config["SERVER_MAX_ENTRIES"]
+    )
+    explorer = cost_report.CostExplorer(
+        client, cache=response_cache, metrics=cost_report.get_cost_metrics(config)
+    )
+    service = ReportService(explorer, account_id, cache)
+    server = ReportServer(service, server_config["SERVER_HOST"], server_config["SERVER_PORT"])
+    print(f"Serving cost reports for AWSアカウント {account_id} on {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cache.close()
+        if response_cache is not None:
+            response_cache.close()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,35 @@
+import pytest
+
+import ce_scheduler
+import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def unlimited_scheduler(monkeypatch):
+    """
+    共有スケジューラをレート制限なしのものに置き換え、テスト間で状態を共有しないようにするフィクスチャ。
+    """
+    scheduler = ce_scheduler.RequestScheduler(rate_per_second=1e9, burst=10**6)
+    monkeypatch.setattr(ce_scheduler, "_default_scheduler", scheduler)
+    return scheduler
+
+
+@pytest.fixture(autouse=True)
+def instrumentation_off(monkeypatch):
+    """
+    テストごとに計測を無効な状態に戻すフィクスチャ。
+    """
+    monkeypatch.setattr(instrumentation, "_current", instrumentation.NULL_INSTRUMENTATION)
+
+
+@pytest.fixture
+def aws_env(monkeypatch):
+    """
+    ダミーの認証情報を設定し、実際の AWS の設定を読み込まないようにするフィクスチャ。
+    """
+    for name in ("AWS_PROFILE", "AWS_CONFIG_FILE", "AWS_SHARED_CREDENTIALS_FILE"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_EC2_METADATA_DISABLED", "true")
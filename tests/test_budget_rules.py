@@ -0,0 +1,176 @@
+import json
+
+import pytest
+
+# テスト対象コードをインポート
+import cost_report
+import cost_records
+import ce_stub_server
+
+
+def make_section(include_credit, total, services, comparisons=None):
+    section = {
+        "title": "title",
+        "total": total,
+        "services": [cost_records.ServiceCost(name, billing) for name, billing in services.items()],
+        "include_credit": include_credit,
+    }
+    if comparisons is not None:
+        section["comparisons"] = comparisons
+    return section
+
+
+RULES = json.dumps([
+    {"id": "total", "type": "threshold", "amount": 100, "warning_percent": 80},
+    {"id": "ec2", "type": "service_budget", "service": "Amazon EC2", "amount": 50, "credit": "before"},
+    {"id": "growth", "type": "percent_change", "percent": 20},
+])
+
+
+def test_load_budget_rules_fills_defaults():
+    """
+    ルールの既定値 (credit=after, compare=previous_month) が補われるかをテスト。
+    """
+    rules = cost_report.load_budget_rules(RULES)
+    assert [rule["id"] for rule in rules] == ["total", "ec2", "growth"]
+    assert rules[0]["credit"] == "after"
+    assert rules[1]["limit"] == 50.0
+    assert rules[2]["compare"] == "previous_month"
+
+
+@pytest.mark.parametrize("text", [
+    "not json",
+    '{"id": "a"}',
+    '[{"type": "threshold", "amount": 1}]',
+    '[{"id": "a", "type": "forecast", "amount": 1}]',
+    '[{"id": "a", "type": "threshold"}]',
+    '[{"id": "a", "type": "service_budget", "amount": 1}]',
+    '[{"id": "a", "type": "threshold", "amount": 1, "credit": "net"}]',
+    '[{"id": "a", "type": "threshold", "amount": 1}, {"id": "a", "type": "threshold", "amount": 2}]',
+])
+def test_load_budget_rules_rejects_invalid(text):
+    """
+    不正なルール定義は ValueError になるかをテスト。
+    """
+    with pytest.raises(ValueError):
+        cost_report.load_budget_rules(text)
+
+
+def test_load_budget_rules_requires_compare_period():
+    """
+    percent_change のルールの compare が COMPARE_PERIODS にない場合は ValueError になるかをテスト。
+    """
+    assert cost_report.load_budget_rules(RULES, compare_periods=["previous_month"])[2]["compare"] == "previous_month"
+    with pytest.raises(ValueError, match="growth"):
+        cost_report.load_budget_rules(RULES, compare_periods=[])
+    with pytest.raises(ValueError, match="growth"):
+        cost_report.load_budget_rules(RULES, compare_periods=["previous_year"])
+
+
+def test_get_budget_rules_validates_compare_periods(aws_env, monkeypatch, tmp_path):
+    """
+    COMPARE_PERIODS に比較対象の期間がない percent_change のルールは、読み込み時に ValueError になるかをテスト。
+    """
+    monkeypatch.setenv("BUDGET_RULES", RULES)
+    monkeypatch.setenv("BUDGET_STATE_DIR", str(tmp_path))
+    monkeypatch.delenv("COMPARE_PERIODS", raising=False)
+    with pytest.raises(ValueError, match="COMPARE_PERIODS"):
+        cost_report.get_budget_rules(cost_report.get_config())
+
+    monkeypatch.setenv("COMPARE_PERIODS", "previous_month")
+    assert len(cost_report.get_budget_rules(cost_report.get_config())) == 3
+
+
+def test_engine_reports_only_state_changes(tmp_path):
+    """
+    前回の実行から状態が変化したルールだけを返し、状態が実行をまたいで保存されるかをテスト。
+    """
+    rules = cost_report.load_budget_rules(RULES)
+    sections = [
+        make_section(True, 85.0, {"Amazon EC2": 40.0}),
+        make_section(False, 90.0, {"Amazon EC2": 60.0}),
+    ]
+
+    engine = cost_report.BudgetRuleEngine(str(tmp_path), rules, namespace="123456789012")
+    changes = engine.evaluate(sections)
+    engine.save()
+    engine.close()
+    # 比較対象の期間がない growth は判定せず、状態を変えない
+    assert [(c["rule"]["id"], c["previous_state"], c["state"]) for c in changes] == [
+        ("total", "ok", "warning"), ("ec2", "ok", "breach"),
+    ]
+
+    # 同じ状態が続く場合は何も返さない
+    engine = cost_report.BudgetRuleEngine(str(tmp_path), rules, namespace="123456789012")
+    assert engine.evaluate(sections) == []
+    engine.close()
+
+    # 超過が解消したものと、増加率が上限を超えたものだけを返す
+    sections = [
+        make_section(True, 85.0, {"Amazon EC2": 40.0},
+                     comparisons=[{"label": "前月同期間", "delta": 30.0, "percent": 25.0}]),
+        make_section(False, 90.0, {"Amazon EC2": 45.0}),
+    ]
+    engine = cost_report.BudgetRuleEngine(str(tmp_path), rules, namespace="123456789012")
+    changes = engine.evaluate(sections)
+    engine.close()
+    assert [(c["rule"]["id"], c["previous_state"], c["state"]) for c in changes] == [
+        ("ec2", "breach", "ok"), ("growth", "ok", "breach"),
+    ]
+
+    # アカウントIDごとに状態を分ける
+    engine = cost_report.BudgetRuleEngine(str(tmp_path), rules, namespace="210987654321")
+    assert [c["rule"]["id"] for c in engine.evaluate(sections)] == ["total", "growth"]
+    engine.close()
+
+
+def test_evaluate_budget_rules_section(tmp_path):
+    """
+    状態が変化したルールの区分の見出しと行をテスト。
+    """
+    config = {"BUDGET_STATE_DIR": str(tmp_path)}
+    rules = cost_report.load_budget_rules(RULES)
+    sections = [make_section(True, 120.0, {}), make_section(False, 130.0, {"Amazon EC2": 10.0})]
+
+    section = cost_report.evaluate_budget_rules(config, rules, "123456789012", sections)
+
+    assert section["title"] == "予算ルールの状態が変化したものが 1 件あります。"
+    assert section["lines"] == ["- total: 正常 → 超過 (合計 120.00 USD / 予算 100.00 USD)"]
+    assert cost_report.evaluate_budget_rules(config, rules, "123456789012", sections) is None
+
+
+def test_budget_rules_require_state_dir(aws_env, monkeypatch):
+    """
+    BUDGET_RULES を設定して BUDGET_STATE_DIR がない場合は ValueError になるかをテスト。
+    """
+    monkeypatch.setenv("BUDGET_RULES", RULES)
+    monkeypatch.setenv("COMPARE_PERIODS", "previous_month")
+    monkeypatch.delenv("BUDGET_STATE_DIR", raising=False)
+    with pytest.raises(ValueError, match="BUDGET_STATE_DIR"):
+        cost_report.get_budget_rules(cost_report.get_config())
+
+
+def test_main_notifies_only_budget_changes(aws_env, monkeypatch, tmp_path):
+    """
+    予算ルールがあると、状態が変化したルールだけを通知し、変化がなければ何も通知しないかをテスト。
+    """
+    output = tmp_path / "report.md"
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps([{"id": "total", "type": "threshold", "amount": 1}]), encoding="utf-8")
+    with ce_stub_server.LocalCostExplorerServer(group_count=20) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("STS_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("REPORT_OUTPUT_FILE", str(output))
+        monkeypatch.setenv("BUDGET_RULES_FILE", str(rules_file))
+        monkeypatch.setenv("BUDGET_STATE_DIR", str(tmp_path / "state"))
+
+        summary = cost_report.main()
+        text = output.read_text(encoding="utf-8")
+        assert "budget_rules" in summary["phases"]
+        assert "予算ルールの状態が変化したものが 1 件あります。" in text
+        assert "- total: 正常 → 超過" in text
+        assert "- Service 000000:" not in text
+
+        output.unlink()
+        cost_report.main()
+    assert not output.exists()
@@ -0,0 +1,139 @@
+import time
+import threading
+
+import pytest
+import botocore.exceptions
+
+# テスト対象コードをインポート
+import cost_report
+import ce_scheduler
+import ce_synthetic
+
+
+class FakeClock:
+    """
+    sleep で進む疑似的な時計。
+    """
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def test_token_bucket_limits_rate():
+    """
+    バースト分を使い切った後は、補充レートに応じた待ち時間を返すかをテスト。
+    """
+    clock = FakeClock()
+    bucket = ce_scheduler.TokenBucket(rate=2.0, capacity=2, clock=clock)
+
+    assert bucket.try_take() == 0
+    assert bucket.try_take() == 0
+    assert bucket.try_take() == pytest.approx(0.5)
+    clock.sleep(0.5)
+    assert bucket.try_take() == 0
+
+
+def test_scheduler_retries_throttled_calls_and_lowers_rate():
+    """
+    スロットリングされた呼び出しを再試行して成功させ、補充レートを下げるかをテスト。
+    """
+    clock = FakeClock()
+    fake = ce_synthetic.ThrottlingClient(ce_synthetic.SyntheticCostExplorer(group_count=10), throttle_first=2)
+    scheduler = ce_scheduler.RequestScheduler(rate_per_second=4.0, burst=1, clock=clock, sleep=clock.sleep)
+    explorer = cost_report.CostExplorer(fake, scheduler=scheduler)
+
+    data = explorer.get_cost_and_usage(
+        {"Start": "2024-01-01", "End": "2024-02-01"}, include_credit=True, group_by_dimension="SERVICE"
+    )
+
+    assert len(data["Groups"]) == 10
+    assert fake.throttled == 2
+    assert scheduler.stats["retries"] == 2
+    assert scheduler.stats["calls"] == 1
+    assert scheduler.rate < 4.0
+
+
+def test_scheduler_gives_up_after_max_attempts():
+    """
+    max_attempts 回スロットリングされた場合は RuntimeError になるかをテスト。
+    """
+    clock = FakeClock()
+    fake = ce_synthetic.ThrottlingClient(ce_synthetic.SyntheticCostExplorer(), throttle_first=10)
+    scheduler = ce_scheduler.RequestScheduler(max_attempts=3, clock=clock, sleep=clock.sleep)
+    explorer = cost_report.CostExplorer(fake, scheduler=scheduler)
+
+    with pytest.raises(RuntimeError):
+        explorer.get_cost_and_usage({"Start": "2024-01-01", "End": "2024-02-01"}, include_credit=True)
+
+    assert fake.throttled == 3
+    assert scheduler.stats["failed"] == 1
+
+
+def test_scheduler_does_not_retry_other_errors():
+    """
+    スロットリング以外のエラーは再試行しないかをテスト。
+    """
+    scheduler = ce_scheduler.RequestScheduler()
+    calls = []
+
+    def fail(**kwargs):
+        calls.append(kwargs)
+        raise botocore.exceptions.ClientError(
+            {"Error": {"Code": "AccessDeniedException", "Message": "denied"}}, "GetCostAndUsage"
+        )
+
+    with pytest.raises(botocore.exceptions.ClientError):
+        scheduler.call(fail)
+    assert len(calls) == 1
+
+
+def test_scheduler_stays_under_fake_rate_limit():
+    """
+    レート上限を超えるとスロットリングする偽のクライアントに対し、全ての呼び出しが成功するかをテスト。
+    """
+    fake = ce_synthetic.ThrottlingClient(ce_synthetic.SyntheticCostExplorer(group_count=1), max_calls_per_second=15)
+    scheduler = ce_scheduler.RequestScheduler(rate_per_second=30.0, burst=15, backoff_seconds=0.05)
+    request = {"TimePeriod": {"Start": "2024-01-01", "End": "2024-02-01"}, "Granularity": "MONTHLY"}
+
+    threads = [
+        threading.Thread(target=lambda: scheduler.call(fake.get_cost_and_usage, **request))
+        for _ in range(30)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(fake.calls) == 30
+    assert scheduler.stats["calls"] == 30
+
+
+def test_interactive_requests_go_before_batch():
+    """
+    トークン待ちのリクエストは、到着順にかかわらず優先度の高いものから実行されるかをテスト。
+    """
+    scheduler = ce_scheduler.RequestScheduler(rate_per_second=20.0, burst=1)
+    order = []
+    scheduler.call(lambda: None)  # バーストを使い切る
+
+    def submit(name, priority):
+        scheduler.call(lambda: order.append(name), priority=priority)
+
+    threads = [
+        threading.Thread(target=submit, args=(f"batch-{i}", ce_scheduler.PRIORITY_BATCH)) for i in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.005)
+    interactive = threading.Thread(target=submit, args=("interactive", ce_scheduler.PRIORITY_INTERACTIVE))
+    interactive.start()
+    for thread in threads + [interactive]:
+        thread.join()
+
+    assert order.index("interactive") <= 1
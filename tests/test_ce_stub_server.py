@@ -0,0 +1,168 @@
+import pytest
+
+# テスト対象コードをインポート
+import cost_report
+import ce_scheduler
+import ce_stub_server
+
+
+def test_real_client_follows_pages_over_http(aws_env, monkeypatch):
+    """
+    botocore のシリアライズを経由して、全ページのグループを取得できるかをテスト。
+    """
+    with ce_stub_server.LocalCostExplorerServer(group_count=250, page_size=100) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        explorer = cost_report.CostExplorer(cost_report.get_client())
+
+        data = explorer.get_cost_and_usage(
+            {"Start": "2024-01-01", "End": "2024-02-01"}, include_credit=True, group_by_dimension="SERVICE"
+        )
+
+    assert len(data["Groups"]) == 250
+    assert server.stats["ce_calls"] == 3
+    assert server.requests[1]["params"]["NextPageToken"] == "1"
+    assert server.requests[0]["params"]["GroupBy"] == [{"Type": "DIMENSION", "Key": "SERVICE"}]
+
+
+def test_real_client_retries_throttling_over_http(aws_env, monkeypatch):
+    """
+    サーバが返す ThrottlingException をスケジューラが再試行するかをテスト。
+    """
+    scheduler = ce_scheduler.RequestScheduler(backoff_seconds=0.01)
+    with ce_stub_server.LocalCostExplorerServer(group_count=10, throttle_first=2) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        explorer = cost_report.CostExplorer(cost_report.get_client(), scheduler=scheduler)
+
+        data = explorer.get_cost_and_usage({"Start": "2024-01-01", "End": "2024-02-01"}, include_credit=True)
+
+    assert data["Total"][cost_report.COST_METRIC]["Amount"]
+    assert server.stats["throttled"] == 2
+    assert scheduler.stats["retries"] == 2
+
+
+def test_main_end_to_end_against_stub(aws_env, monkeypatch, tmp_path):
+    """
+    STS・Cost Explorer をスタンドインに向け、main() がレポートを出力するまでを通しでテスト。
+    """
+    output = tmp_path / "report.md"
+    with ce_stub_server.LocalCostExplorerServer(
+        group_count=30, page_size=20, latency_seconds=0.01, account_id="210987654321"
+    ) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("STS_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("REPORT_OUTPUT_FILE", str(output))
+
+        summary = cost_report.main()
+
+    assert summary["account_id"] == "210987654321"
+    assert server.stats["ce_calls"] == 2
+    text = output.read_text(encoding="utf-8")
+    assert text.startswith("## AWSアカウント 210987654321")
+    assert "- Service 000000:" in text
+
+
+def test_main_sends_drilldown_report(aws_env, monkeypatch, tmp_path):
+    """
+    DRILLDOWN_DIMENSIONS を設定すると、親ごとの上位の子を別のメッセージで出力するかをテスト。
+    """
+    output = tmp_path / "report.md"
+    with ce_stub_server.LocalCostExplorerServer(group_count=500, page_size=200) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("STS_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("REPORT_OUTPUT_FILE", str(output))
+        monkeypatch.setenv("DRILLDOWN_DIMENSIONS", "SERVICE, USAGE_TYPE")
+        monkeypatch.setenv("DRILLDOWN_TOP_N", "3")
+        monkeypatch.setenv("DRILLDOWN_MAX_PARENTS", "4")
+
+        summary = cost_report.main()
+
+    assert "drilldown_query" in summary["phases"]
+    drilldown_requests = [
+        r for r in server.requests
+        if r["operation"] == "GetCostAndUsage" and r["params"]["GroupBy"][1]["Key"] == "USAGE_TYPE"
+    ]
+    assert len(drilldown_requests) == 3
+    text = output.read_text(encoding="utf-8")
+    assert "SERVICE × USAGE_TYPE 別" in text
+    assert text.count("    - その他 (47件):") == 4
+
+
+def test_main_compares_with_previous_periods(aws_env, monkeypatch, tmp_path):
+    """
+    COMPARE_PERIODS を設定すると、比較対象の期間を並行して取得し増減を出力するかをテスト。
+    """
+    output = tmp_path / "report.md"
+    with ce_stub_server.LocalCostExplorerServer(group_count=20, latency_seconds=0.05) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("STS_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("REPORT_OUTPUT_FILE", str(output))
+        monkeypatch.setenv("COMPARE_PERIODS", "previous_month,previous_year")
+        monkeypatch.setattr(cost_report, "get_date_range", lambda: ("2024-03-01", "2024-03-15"))
+
+        summary = cost_report.main()
+
+    periods = sorted(r["params"]["TimePeriod"]["Start"] for r in server.requests if "params" in r)
+    assert periods == ["2023-03-01", "2024-02-01", "2024-03-01"]
+    phases = summary["phases"]
+    assert phases["compare_query.previous_month"]["start_ms"] < phases["cost_query"]["end_ms"]
+    text = output.read_text(encoding="utf-8")
+    assert "前月同期間比" in text and "前年同期間比" in text
+
+
+def test_main_sends_hourly_report(aws_env, monkeypatch, tmp_path):
+    """
+    GRANULARITY=HOURLY を設定すると、時間別のピーク・p95 を別のメッセージで出力するかをテスト。
+    """
+    output = tmp_path / "report.md"
+    with ce_stub_server.LocalCostExplorerServer(group_count=5, page_size=1000) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("STS_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("REPORT_OUTPUT_FILE", str(output))
+        monkeypatch.setenv("GRANULARITY", "hourly")
+        monkeypatch.setattr(cost_report, "get_date_range", lambda: ("2024-03-01", "2024-03-16"))
+
+        summary = cost_report.main()
+
+    assert "hourly_query" in summary["phases"]
+    hourly_periods = [
+        (r["params"]["TimePeriod"]["Start"], r["params"].get("NextPageToken")) for r in server.requests
+        if "params" in r and r["params"]["Granularity"] == "HOURLY"
+    ]
+    # 14日 × 24時間 × 5グループ = 1680 件は2ページ、残りの1日分は1ページ
+    assert hourly_periods == [
+        ("2024-03-01T00:00:00Z", None), ("2024-03-01T00:00:00Z", "1"), ("2024-03-15T00:00:00Z", None),
+    ]
+    text = output.read_text(encoding="utf-8")
+    assert "03/01～03/15の時間別 (UTC) のクレジット適用前費用です。" in text
+    assert " / p95 " in text
+
+
+def test_main_rejects_unknown_granularity(aws_env, monkeypatch):
+    """
+    GRANULARITY に不正な値を設定すると ValueError になるかをテスト。
+    """
+    monkeypatch.setenv("GRANULARITY", "weekly")
+    with pytest.raises(ValueError):
+        cost_report.main()
+
+
+def test_main_fetches_multiple_metrics_in_one_request(aws_env, monkeypatch, tmp_path):
+    """
+    COST_METRICS に複数のメトリクスを設定しても Cost Explorer の呼び出し回数が増えず、全メトリクスを出力するかをテスト。
+    """
+    output = tmp_path / "report.md"
+    with ce_stub_server.LocalCostExplorerServer(group_count=30, page_size=20) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("STS_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("REPORT_OUTPUT_FILE", str(output))
+        monkeypatch.setenv("COST_METRICS", "UnblendedCost, NetAmortizedCost, UsageQuantity")
+
+        cost_report.main()
+
+    assert server.stats["ce_calls"] == 2
+    assert {tuple(r["params"]["Metrics"]) for r in server.requests if "params" in r} == {
+        ("UnblendedCost", "NetAmortizedCost", "UsageQuantity")
+    }
+    text = output.read_text(encoding="utf-8")
+    assert "USD [NetAmortizedCost " in text
+    assert " / UsageQuantity " in text
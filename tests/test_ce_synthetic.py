@@ -0,0 +1,61 @@
+import pytest
+
+# テスト対象コードをインポート
+import cost_report
+import ce_synthetic
+
+
+def test_synthetic_pages_cover_all_groups():
+    """
+    全ページをたどると、期間数 × グループ数のグループが重複なく得られるかをテスト。
+    """
+    fake = ce_synthetic.SyntheticCostExplorer(group_count=250, page_size=100)
+    explorer = cost_report.CostExplorer(fake)
+    period = {"Start": "2024-01-01", "End": "2024-04-01"}
+
+    results = list(explorer.iter_results(
+        explorer._build_request(period, include_credit=True, group_by_dimensions=["SERVICE"])
+    ))
+
+    assert fake.call_count == 8
+    assert sorted({r["TimePeriod"]["Start"] for r in results}) == ["2024-01-01", "2024-02-01", "2024-03-01"]
+    keys = [(r["TimePeriod"]["Start"], g["Keys"][0]) for r in results for g in r["Groups"]]
+    assert len(keys) == len(set(keys)) == 750
+
+
+def test_synthetic_response_is_deterministic():
+    """
+    同じシードであれば同じレスポンスが得られるかをテスト。
+    """
+    request = {
+        "TimePeriod": {"Start": "2024-12-01", "End": "2024-12-28"},
+        "Granularity": "MONTHLY",
+        "Metrics": ["AmortizedCost"],
+        "GroupBy": [{"Type": "DIMENSION", "Key": "SERVICE"}, {"Type": "DIMENSION", "Key": "RECORD_TYPE"}],
+    }
+
+    first = ce_synthetic.SyntheticCostExplorer(group_count=30, seed=1).get_cost_and_usage(**request)
+    second = ce_synthetic.SyntheticCostExplorer(group_count=30, seed=1).get_cost_and_usage(**request)
+
+    assert first == second
+    groups = first["ResultsByTime"][0]["Groups"]
+    assert groups[2]["Keys"] == ["Service 000000", "Credit"]
+    assert float(groups[2]["Metrics"]["AmortizedCost"]["Amount"]) < 0
+
+
+def test_synthetic_credit_filter():
+    """
+    クレジット除外フィルタを指定した場合に Credit のグループが含まれないかをテスト。
+    """
+    fake = ce_synthetic.SyntheticCostExplorer(group_count=30)
+    explorer = cost_report.CostExplorer(fake)
+    request = explorer._build_request(
+        {"Start": "2024-12-01", "End": "2024-12-28"},
+        include_credit=False,
+        group_by_dimensions=["SERVICE", "RECORD_TYPE"]
+    )
+
+    groups = fake.get_cost_and_usage(**request)["ResultsByTime"][0]["Groups"]
+
+    assert len(groups) == 20
+    assert all(g["Keys"][1] != "Credit" for g in groups)
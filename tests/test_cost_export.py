@@ -0,0 +1,189 @@
+import os
+import csv
+
+import pytest
+
+# テスト対象コードをインポート
+import cost_report
+import cost_export
+import ce_synthetic
+
+
+def export_period(writer, fake, period, granularity="MONTHLY"):
+    """
+    ライターを渡した CostExplorer で SERVICE と RECORD_TYPE 別の結果を最後まで取得する。
+    """
+    explorer = cost_report.CostExplorer(fake, exporter=writer)
+    return list(explorer.iter_cost_and_usage_by_record_type(period, granularity=granularity))
+
+
+@pytest.mark.parametrize("export_format", ["csv", "arrow"])
+def test_export_streams_pages_into_partitions(tmp_path, export_format):
+    """
+    ページを受け取りながら期間ごとのパーティションに書き出し、読み戻した集計が元データと一致するかをテスト。
+    """
+    if export_format == "arrow":
+        pytest.importorskip("pyarrow")
+    fake = ce_synthetic.SyntheticCostExplorer(group_count=300, page_size=250)
+    writer = cost_export.ExportWriter(str(tmp_path), rows_per_part=100, export_format=export_format)
+
+    results = export_period(writer, fake, {"Start": "2024-01-01", "End": "2024-03-01"})
+
+    reader = cost_export.ExportReader(str(tmp_path))
+    paths = list(reader.iter_paths(granularity="MONTHLY"))
+    assert all(p.endswith(f".{export_format}") for p in paths)
+    assert {os.path.basename(os.path.dirname(p)) for p in paths} == {"period=2024-01-01", "period=2024-02-01"}
+    assert writer.stats["rows"] == 600
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+    expected = {}
+    for result in results:
+        for group in result["Groups"]:
+            key = (group["Keys"][1],)
+            expected[key] = expected.get(key, 0.0) + float(group["Metrics"][cost_report.COST_METRIC]["Amount"])
+    aggregated = reader.aggregate(["RECORD_TYPE"], cost_report.COST_METRIC)
+    assert aggregated.keys() == expected.keys()
+    for key, amount in expected.items():
+        assert aggregated[key] == pytest.approx(amount)
+
+    january = reader.aggregate(["SERVICE"], cost_report.COST_METRIC, start="2024-01-01", end="2024-02-01")
+    assert len(january) == 100
+
+
+def test_export_replaces_previous_run_of_same_query(tmp_path):
+    """
+    同じ形のクエリを再実行した場合は古いファイルを置き換え、Arrow のファイルを他のツールと同じ
+    API (pyarrow.ipc) で読め、ExportReader はメモリマップして列をコピーせずに参照するかをテスト。
+    """
+    pa = pytest.importorskip("pyarrow")
+    writer = cost_export.ExportWriter(str(tmp_path), export_format="arrow")
+    period = {"Start": "2024-01-01", "End": "2024-02-01"}
+    export_period(writer, ce_synthetic.SyntheticCostExplorer(group_count=30, seed=1), period)
+    export_period(writer, ce_synthetic.SyntheticCostExplorer(group_count=30, seed=2), period)
+
+    reader = cost_export.ExportReader(str(tmp_path))
+    paths = list(reader.iter_paths())
+    assert len(paths) == 1 and paths[0].endswith(".arrow")
+    with pa.OSFile(paths[0], "rb") as source:
+        table = pa.ipc.open_file(source).read_all()
+    assert table.column_names == [
+        "period_start", "period_end", "estimated", "SERVICE", "RECORD_TYPE", cost_report.COST_METRIC
+    ]
+    assert table.num_rows == 30
+
+    allocated = pa.total_allocated_bytes()
+    part = cost_export.open_part(paths[0])
+    assert pa.total_allocated_bytes() == allocated
+    row = next(part.iter_rows())
+    assert row["period_start"] == "2024-01-01"
+    assert row[cost_report.COST_METRIC] == pytest.approx(ce_synthetic.synthetic_amount(2, 0, 0))
+    part.close()
+
+
+def test_export_discards_partial_files_on_failure(tmp_path):
+    """
+    取得が途中で失敗した場合は、書き出し途中のファイルを残さず古いファイルを保持するかをテスト。
+    """
+    writer = cost_export.ExportWriter(str(tmp_path), rows_per_part=10)
+    period = {"Start": "2024-01-01", "End": "2024-02-01"}
+    export_period(writer, ce_synthetic.SyntheticCostExplorer(group_count=30), period)
+    before = sorted(cost_export.ExportReader(str(tmp_path)).iter_paths())
+
+    fake = ce_synthetic.SyntheticCostExplorer(group_count=30, page_size=20)
+    explorer = cost_report.CostExplorer(fake, exporter=writer)
+    results = explorer.iter_cost_and_usage_by_record_type(period)
+    next(results)
+    next(results)  # 2ページ目を受け取った時点で1ページ目を書き出す
+    assert [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+    results.close()
+
+    assert sorted(cost_export.ExportReader(str(tmp_path)).iter_paths()) == before
+    assert not [name for _, _, files in os.walk(tmp_path) for name in files if name.endswith(".tmp")]
+
+
+def test_export_csv_is_readable_without_reader(tmp_path):
+    """
+    CSV 形式の出力が csv モジュールだけで読め、金額が丸めずに書き出されるかをテスト。
+    """
+    writer = cost_export.ExportWriter(str(tmp_path), export_format="csv")
+    period = {"Start": "2024-01-01", "End": "2024-02-01"}
+    export_period(writer, ce_synthetic.SyntheticCostExplorer(group_count=30, seed=2), period)
+    if cost_export.resolve_export_format("auto") == "arrow":
+        # 前回の実行が別の形式でも置き換える
+        export_period(
+            cost_export.ExportWriter(str(tmp_path), export_format="arrow"),
+            ce_synthetic.SyntheticCostExplorer(group_count=30, seed=1), period
+        )
+        export_period(writer, ce_synthetic.SyntheticCostExplorer(group_count=30, seed=2), period)
+
+    paths = list(cost_export.ExportReader(str(tmp_path)).iter_paths())
+    assert len(paths) == 1 and paths[0].endswith(".csv")
+    assert sorted(os.listdir(os.path.dirname(paths[0]))) == [
+        os.path.basename(paths[0]), os.path.basename(paths[0]) + ".meta.json"
+    ]
+    with open(paths[0], encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert len(rows) == 30
+    assert list(rows[0]) == ["period_start", "period_end", "estimated", "SERVICE", "RECORD_TYPE", cost_report.COST_METRIC]
+    assert rows[0]["period_start"] == "2024-01-01" and rows[0]["period_end"] == "2024-02-01"
+    assert float(rows[0][cost_report.COST_METRIC]) == pytest.approx(ce_synthetic.synthetic_amount(2, 0, 0))
+
+
+def test_export_format_validation(tmp_path):
+    """
+    不正な出力形式は ValueError になるかをテスト。
+    """
+    with pytest.raises(ValueError):
+        cost_export.ExportWriter(str(tmp_path), export_format="xlsx")
+    assert cost_export.resolve_export_format("csv") == "csv"
+    assert cost_export.resolve_export_format("auto") in ("arrow", "csv")
+    assert cost_export.format_amount(-1_500_000) == "-1.500000"
+    assert cost_export.format_amount(12) == "0.000012"
+
+
+def test_csv_part_reads_names_from_metadata(tmp_path):
+    """
+    CSV のディメンション・メトリクスの名前を値から推測せず、メタデータのファイルから読むかをテスト。
+    行がない場合や、ディメンションの値が金額の形式でも区別できるかを確認する。
+    """
+    path = str(tmp_path / "part.csv")
+    buffer = cost_export._PartBuffer({"Start": "2024-01-01", "End": "2024-02-01"}, ["SERVICE"], ["UnblendedCost"])
+    for written in buffer.write(path, "MONTHLY", None, "csv"):
+        os.replace(written + cost_export.STAGING_SUFFIX, written)
+    part = cost_export.open_part(path)
+    assert part.rows == 0
+    assert part.dimensions == ["SERVICE"] and list(part.metrics) == ["UnblendedCost"]
+    assert part.aggregate(["SERVICE"], "UnblendedCost") == {}
+
+    buffer.add_row(["1.000000"], {"UnblendedCost": {"Amount": "2.5", "Unit": "USD"}})
+    for written in buffer.write(path, "MONTHLY", None, "csv"):
+        os.replace(written + cost_export.STAGING_SUFFIX, written)
+    part = cost_export.open_part(path)
+    assert part.metrics["UnblendedCost"]["unit"] == "USD"
+    assert part.aggregate(["SERVICE"], "UnblendedCost") == {("1.000000",): 2_500_000}
+
+    os.remove(path + cost_export.METADATA_SUFFIX)
+    with pytest.raises(ValueError):
+        cost_export.open_part(path)
+
+
+def test_export_resolves_directory_at_first_flush(tmp_path):
+    """
+    出力先を関数で渡した場合、最初のファイルを書き出す時点で初めて呼ぶかをテスト。
+    """
+    calls = []
+
+    def directory():
+        calls.append(1)
+        return str(tmp_path / "account=123456789012")
+
+    writer = cost_export.ExportWriter(directory, export_format="csv")
+    assert calls == []
+    results = cost_report.CostExplorer(
+        ce_synthetic.SyntheticCostExplorer(group_count=30, page_size=10), exporter=writer
+    ).iter_cost_and_usage_by_record_type({"Start": "2024-01-01", "End": "2024-02-01"})
+    next(results)
+    assert calls == []
+    list(results)
+    assert calls == [1]
+    assert len(list(cost_export.ExportReader(directory()).iter_paths())) == 1
@@ -0,0 +1,46 @@
+import json
+
+# テスト対象コードをインポート
+import cost_records
+import renderer
+
+
+def test_service_cost_is_compact_and_interned():
+    """
+    ServiceCost が属性の辞書を持たず、同じサービス名を1つの文字列として共有するかをテスト。
+    """
+    first = cost_records.ServiceCost("".join(["Amazon ", "EC2"]), 1.0)
+    second = cost_records.ServiceCost("".join(["Amazon ", "EC2"]), 2.0)
+
+    assert not hasattr(first, "__dict__")
+    assert first.service_name is second.service_name
+
+
+def test_service_cost_dict_compatibility():
+    """
+    辞書形式との変換と、item["billing"] のような読み取りができるかをテスト。
+    """
+    change = {"label": "前月同期間", "previous": 1.0, "delta": 2.0, "percent": 200.0}
+    item = cost_records.ServiceCost("Amazon S3", 3.0).with_change(change)
+
+    assert item["billing"] == 3.0
+    assert item.get("missing", "default") == "default"
+    assert "changes" in item
+    assert item.to_dict() == {"service_name": "Amazon S3", "billing": 3.0, "changes": [change]}
+    assert cost_records.ServiceCost.from_dict(item.to_dict()) == item
+    assert cost_records.as_service_costs([{"service_name": "Amazon S3", "billing": 3}]) == [
+        cost_records.ServiceCost("Amazon S3", 3.0)
+    ]
+
+
+def test_renderers_accept_records():
+    """
+    レンダラが ServiceCost の区分を整形し、JSON では辞書として出力するかをテスト。
+    """
+    report = {"title": "t", "sections": [
+        {"title": "s", "total": 3.0, "services": [cost_records.ServiceCost("Amazon S3", 3.0)]}
+    ]}
+
+    assert renderer.section_lines(report["sections"][0]) == ["- Amazon S3: 3.00 USD"]
+    body = json.loads(renderer.JsonRenderer().render_one(report))
+    assert body["sections"][0]["services"] == [{"service_name": "Amazon S3", "billing": 3.0}]
@@ -1,5 +1,8 @@
 import os
 import json
+import math
+import time
+import random
 import pytest
 from unittest.mock import MagicMock, patch
 from datetime import datetime, timedelta
@@ -7,6 +10,8 @@ import botocore.exceptions  # 必要な例外のインポート
 
 # テスト対象コードをインポート
 import cost_report
+import cost_records
+import ce_synthetic
 
 
 @pytest.fixture
@@ -89,11 +94,11 @@ def test_get_account_id_failure():
 @pytest.mark.parametrize(
     "use_teams, webhook_url, expect_error, expect_post_calls",
     [
-        # 1) Teams投稿あり (クレジット後/前で2回 post_to_teams が呼ばれる想定)
-        (True, "https://dummy.webhook.microsoft.com/xxxx", False, 2),
+        # 1) Teams投稿あり (クレジット後/前を1通にまとめて Teams へ送信される想定)
+        (True, "https://dummy.webhook.microsoft.com/xxxx", False, 1),
         # 2) Teams投稿ON かつ webhook URL なし => ValueError
         (True, None, True, 0),
-        # 3) Teams投稿OFF => post_to_teamsは一切呼ばれない (0回)
+        # 3) Teams投稿OFF => Teamsへは一切送信されない (0回)
         (False, None, False, 0),
     ],
 )
@@ -119,7 +124,7 @@ def test_main(mock_boto3_client, use_teams, webhook_url, expect_error, expect_po
         env_dict["TEAMS_WEBHOOK_URL"] = webhook_url
 
     with patch.dict(os.environ, env_dict, clear=True):
-        with patch.object(cost_report, "post_to_teams") as mock_post:
+        with patch.object(cost_report.notifier.TeamsSink, "send_payload", return_value=0) as mock_post:
             with patch.object(cost_report, "print_report") as mock_print:
                 if expect_error:
                     with pytest.raises(ValueError):
@@ -128,6 +133,8 @@ def test_main(mock_boto3_client, use_teams, webhook_url, expect_error, expect_po
                     cost_report.main()
                     assert mock_post.call_count == expect_post_calls
                     assert mock_print.call_count == 2
+                    # クレジット適用前/後は1回のAPI呼び出しで取得する
+                    mock_ce_client.get_cost_and_usage.assert_called_once()
 
 
 def test_get_cost_and_usage_include_credit(explorer, mock_ce_client, sample_cost_response):
@@ -175,3 +182,893 @@ def test_get_cost_and_usage_exclude_credit(explorer, mock_ce_client, sample_cost
         GroupBy=[],
         **expected_filter
     )
+
+
+@pytest.fixture
+def sample_record_type_response():
+    """
+    SERVICE と RECORD_TYPE でグルーピングしたサンプルレスポンスを返すフィクスチャ。
+    """
+    def group(service, record_type, amount):
+        return {
+            "Keys": [service, record_type],
+            "Metrics": {cost_report.COST_METRIC: {"Amount": amount, "Unit": "USD"}}
+        }
+
+    return {
+        "ResultsByTime": [
+            {
+                "TimePeriod": {"Start": "2024-12-01", "End": "2024-12-28"},
+                "Total": {},
+                "Groups": [
+                    group("Amazon EC2", "Usage", "100.0"),
+                    group("Amazon EC2", "Tax", "10.0"),
+                    group("Amazon EC2", "Credit", "-110.0"),
+                    group("Amazon S3", "Usage", "23.45"),
+                ]
+            }
+        ]
+    }
+
+
+def test_get_cost_and_usage_by_record_type(explorer, mock_ce_client, sample_record_type_response):
+    """
+    SERVICE と RECORD_TYPE の2軸で、フィルタなしの1回のAPI呼び出しになるかをテスト。
+    """
+    mock_ce_client.get_cost_and_usage.return_value = sample_record_type_response
+    period = {"Start": "2024-12-01", "End": "2024-12-28"}
+
+    resp = explorer.get_cost_and_usage_by_record_type(period)
+
+    assert resp == sample_record_type_response["ResultsByTime"][0]
+    mock_ce_client.get_cost_and_usage.assert_called_once_with(
+        TimePeriod=period,
+        Granularity=cost_report.GRANULARITY,
+        Metrics=[cost_report.COST_METRIC],
+        GroupBy=[
+            {"Type": "DIMENSION", "Key": cost_report.SERVICE_GROUP_DIMENSION},
+            {"Type": "DIMENSION", "Key": cost_report.RECORD_TYPE_DIMENSION},
+        ]
+    )
+
+
+def test_split_by_credit(explorer, sample_record_type_response):
+    """
+    RECORD_TYPE 付きデータからクレジット適用後/適用前のサービス別費用を組み立てられるかをテスト。
+    """
+    data = sample_record_type_response["ResultsByTime"][0]
+
+    after_credit, before_credit = explorer.split_by_credit(data)
+
+    assert list(explorer.get_service_costs(after_credit)) == [
+        cost_records.ServiceCost("Amazon EC2", 0.0),
+        cost_records.ServiceCost("Amazon S3", 23.45),
+    ]
+    assert list(explorer.get_service_costs(before_credit)) == [
+        cost_records.ServiceCost("Amazon EC2", 110.0),
+        cost_records.ServiceCost("Amazon S3", 23.45),
+    ]
+    assert explorer.get_total_cost(after_credit) == pytest.approx(23.45)
+    assert explorer.get_total_cost(before_credit) == pytest.approx(133.45)
+
+
+def _group(keys, amount):
+    return {"Keys": keys, "Metrics": {cost_report.COST_METRIC: {"Amount": str(amount), "Unit": "USD"}}}
+
+
+def test_cost_table_group_by_and_filters():
+    """
+    行ストアでディメンション別集約・合計・しきい値・上位N件が計算できるかをテスト。
+    """
+    results = [
+        {"Groups": [
+            _group(["Amazon EC2", "111111111111"], "10.5"),
+            _group(["Amazon S3", "111111111111"], "0.004"),
+            _group(["Amazon EC2", "222222222222"], "-2.0"),
+        ]},
+        {"Groups": [
+            _group(["Amazon EC2", "111111111111"], "4.5"),
+            _group(["AWS Lambda", "222222222222"], "7.25"),
+        ]},
+    ]
+
+    table = cost_report.CostRowStore.from_results(results, ["SERVICE", "LINKED_ACCOUNT"])
+
+    assert len(table) == 5
+    assert table.total() == pytest.approx(20.254)
+    assert table.total(clip_negative=True) == pytest.approx(22.254)
+
+    by_service = table.group_by("SERVICE")
+    assert by_service.to_dict() == {
+        "Amazon EC2": pytest.approx(13.0),
+        "Amazon S3": pytest.approx(0.004),
+        "AWS Lambda": pytest.approx(7.25),
+    }
+    assert list(by_service.at_least(0.01).to_dict()) == ["Amazon EC2", "AWS Lambda"]
+    assert list(by_service.top_n(1).to_dict()) == ["Amazon EC2"]
+    assert table.where("LINKED_ACCOUNT", exclude=["222222222222"]).group_by("SERVICE").to_dict() == {
+        "Amazon EC2": pytest.approx(15.0),
+        "Amazon S3": pytest.approx(0.004),
+    }
+    assert list(table.group_by("SERVICE", "LINKED_ACCOUNT").rows())[1] == (
+        ("Amazon S3", "111111111111"), pytest.approx(0.004)
+    )
+
+
+def test_drilldown_keeps_top_n_per_parent():
+    """
+    親ごとに上位 N 件の子だけを残し、残りを「その他」に合算するかをテスト。
+    """
+    drilldown = cost_report.DrillDown(top_n=2)
+    for child, amount in [("a", 1.0), ("b", 5.0), ("c", 3.0), ("d", 0.5), ("e", 3.0)]:
+        drilldown.add("Amazon EC2", child, amount)
+    drilldown.add("AWS Lambda", "x", 20.0)
+
+    ec2, lambda_ = drilldown.results()[::-1]
+    assert ec2["name"] == "Amazon EC2"
+    assert ec2["total"] == pytest.approx(12.5)
+    assert ec2["children"] == [("b", 5.0), ("c", 3.0)]
+    assert ec2["other"] == pytest.approx(4.5)
+    assert ec2["other_count"] == 3
+    assert lambda_["children"] == [("x", 20.0)]
+    assert [item["name"] for item in drilldown.results(max_parents=1)] == ["AWS Lambda"]
+
+
+def test_build_drilldown_section(explorer, mock_ce_client):
+    """
+    2軸 (SERVICE × タグ) の費用から、親ごとの上位の子・その他・タグなしの行を作成するかをテスト。
+    """
+    mock_ce_client.get_cost_and_usage.return_value = {
+        "ResultsByTime": [{
+            "TimePeriod": {"Start": "2024-12-01", "End": "2024-12-28"},
+            "Groups": [
+                _group(["Amazon EC2", "Project$web"], "60.0"),
+                _group(["Amazon EC2", "Project$"], "30.0"),
+                _group(["Amazon EC2", "Project$batch"], "10.0"),
+                _group(["Amazon S3", "Project$web"], "5.0"),
+                _group(["AWS Lambda", "Project$web"], "1.0"),
+            ],
+        }]
+    }
+
+    section = cost_report.build_drilldown_section(
+        explorer, {"Start": "2024-12-01", "End": "2024-12-28"}, ["SERVICE", "TAG:Project"],
+        "12/01", "12/27", top_n=2, max_parents=2
+    )
+
+    request = mock_ce_client.get_cost_and_usage.call_args.kwargs
+    assert request["GroupBy"] == [{"Type": "DIMENSION", "Key": "SERVICE"}, {"Type": "TAG", "Key": "Project"}]
+    assert request["Filter"]["Not"]["Dimensions"]["Values"] == [cost_report.CREDIT_RECORD_TYPE]
+    assert section["lines"] == [
+        "- Amazon EC2: 100.00 USD",
+        "    - web: 60.00 USD",
+        "    - (タグなし): 30.00 USD",
+        "    - その他 (1件): 10.00 USD",
+        "- Amazon S3: 5.00 USD",
+        "    - web: 5.00 USD",
+        "- その他 (1件): 1.00 USD",
+    ]
+
+
+def test_build_drilldown_section_merges_months(explorer, mock_ce_client):
+    """
+    複数の月にまたがる期間では、同じ組み合わせを合算してから上位を選ぶかをテスト。
+    """
+    mock_ce_client.get_cost_and_usage.return_value = {
+        "ResultsByTime": [
+            {"TimePeriod": {"Start": "2024-11-01", "End": "2024-12-01"}, "Groups": [
+                _group(["Amazon EC2", "BoxUsage"], "4.0"),
+                _group(["Amazon EC2", "EBS:VolumeUsage"], "5.0"),
+            ]},
+            {"TimePeriod": {"Start": "2024-12-01", "End": "2024-12-28"}, "Groups": [
+                _group(["Amazon EC2", "BoxUsage"], "4.0"),
+            ]},
+        ]
+    }
+
+    section = cost_report.build_drilldown_section(
+        explorer, {"Start": "2024-11-01", "End": "2024-12-28"}, ["SERVICE", "USAGE_TYPE"],
+        "11/01", "12/27", top_n=1
+    )
+
+    assert section["lines"] == [
+        "- Amazon EC2: 13.00 USD",
+        "    - BoxUsage: 8.00 USD",
+        "    - その他 (1件): 5.00 USD",
+    ]
+
+
+@pytest.mark.parametrize("start_date, end_date, name, expected", [
+    ("2024-03-01", "2024-03-31", "previous_month", {"Start": "2024-02-01", "End": "2024-03-01"}),
+    ("2024-03-01", "2024-03-15", "previous_month", {"Start": "2024-02-01", "End": "2024-02-15"}),
+    ("2024-01-01", "2024-01-10", "previous_month", {"Start": "2023-12-01", "End": "2023-12-10"}),
+    ("2024-02-01", "2024-02-29", "previous_year", {"Start": "2023-02-01", "End": "2023-03-01"}),
+])
+def test_get_comparison_periods(start_date, end_date, name, expected):
+    """
+    前月同期間・前年同期間が、月末を丸めたうえで同じ日付範囲になるかをテスト。
+    """
+    [(label, period)] = cost_report.get_comparison_periods(start_date, end_date, [name])
+    assert label == cost_report.COMPARISON_LABELS[name]
+    assert period == expected
+
+
+def test_get_comparison_periods_rejects_unknown_name():
+    """
+    不正な比較期間の名前は ValueError になるかをテスト。
+    """
+    with pytest.raises(ValueError):
+        cost_report.get_comparison_periods("2024-03-01", "2024-03-15", ["last_week"])
+
+
+def test_handle_cost_report_with_comparison(explorer, mock_ce_client):
+    """
+    比較対象の期間を取得し、合計とサービスごとの増減・増減率をレポートに加えるかをテスト。
+    """
+    amounts = {
+        "2024-12-01": {"Amazon EC2": "110.0", "AWS Lambda": "5.0"},
+        "2024-11-01": {"Amazon EC2": "100.0", "Amazon S3": "2.0"},
+    }
+
+    def get_cost_and_usage(**kwargs):
+        services = amounts[kwargs["TimePeriod"]["Start"]]
+        return {"ResultsByTime": [{
+            "TimePeriod": kwargs["TimePeriod"],
+            "Groups": [_group([name], amount) for name, amount in services.items()],
+        }]}
+
+    mock_ce_client.get_cost_and_usage.side_effect = get_cost_and_usage
+    comparison_periods = cost_report.get_comparison_periods("2024-12-01", "2024-12-28", ["previous_month"])
+
+    title, lines = cost_report.handle_cost_report(
+        explorer, {"Start": "2024-12-01", "End": "2024-12-28"}, True, "12/01", "12/27",
+        comparison_periods=comparison_periods
+    )
+
+    assert mock_ce_client.get_cost_and_usage.call_count == 2
+    assert title == (
+        "12/01～12/27のクレジット適用後費用は、115.00 USD です。 (前月同期間比 +13.00 USD (+12.7%))"
+    )
+    assert lines == [
+        "- Amazon EC2: 110.00 USD (前月同期間比 +10.00 USD (+10.0%))",
+        "- AWS Lambda: 5.00 USD (前月同期間比 +5.00 USD (新規))",
+    ]
+
+
+class PeriodClient:
+    """
+    期間の開始日から金額が決まる偽の CE クライアント (どうまとめて取得しても期間ごとの金額が変わらない)。
+    """
+
+    def __init__(self):
+        self.requests = []
+
+    def get_cost_and_usage(self, **kwargs):
+        self.requests.append(kwargs)
+        period = kwargs["TimePeriod"]
+        results = []
+        for sub in ce_synthetic.split_periods(period["Start"], period["End"], kwargs["Granularity"]):
+            day = datetime.strptime(sub["Start"], "%Y-%m-%d")
+            days = (datetime.strptime(sub["End"], "%Y-%m-%d") - day).days
+            results.append({"TimePeriod": sub, "Groups": [
+                _group(["Amazon EC2"], str(float(days))),
+                _group(["AWS Lambda"], str(day.month / 100 * days)),
+            ]})
+        return {"ResultsByTime": results}
+
+
+def test_query_planner_coalesces_adjacent_months():
+    """
+    当月・前月・過去12か月の各月のリクエストが1回の MONTHLY の呼び出しにまとめられ、
+    期間ごとに個別に取得した場合と同じ結果に戻るかをテスト。
+    """
+    client = PeriodClient()
+    explorer = cost_report.CostExplorer(client)
+    months = [f"{year}-{month:02d}-01" for year, month in [(2023, m) for m in range(3, 13)] + [(2024, 1), (2024, 2)]]
+    periods = [{"Start": start, "End": end} for start, end in zip(months, months[1:] + ["2024-03-01"])]
+    periods += [{"Start": "2024-03-01", "End": "2024-03-15"}, {"Start": "2024-02-01", "End": "2024-03-01"}]
+
+    planner = cost_report.QueryPlanner(explorer)
+    for period in periods:
+        planner.add(explorer._build_request(period, True, ["SERVICE"]))
+    results = [future.result() for future in planner.execute()]
+
+    assert len(client.requests) == 1
+    assert client.requests[0]["TimePeriod"] == {"Start": "2023-03-01", "End": "2024-03-15"}
+    assert client.requests[0]["Granularity"] == "MONTHLY"
+    assert planner.stats == {"requests": 14, "calls": 1, "saved": 13}
+    for period, result in zip(periods, results):
+        expected = cost_report.CostExplorer(PeriodClient()).get_cost_and_usage(period, True, "SERVICE")
+        assert result["TimePeriod"] == period
+        assert cost_report.CostRowStore.from_results([result], ["SERVICE"]).to_dict() == pytest.approx(
+            cost_report.CostRowStore.from_results([expected], ["SERVICE"]).to_dict()
+        )
+
+
+def test_query_planner_granularity_and_compatibility():
+    """
+    月の途中で区切られた MONTHLY の期間はまとめず、DAILY の期間は DAILY のまままとめ、
+    Filter・粒度の異なるリクエストはまとめないかをテスト。
+    """
+    client = PeriodClient()
+    explorer = cost_report.CostExplorer(client)
+    periods = [{"Start": "2024-02-10", "End": "2024-02-20"}, {"Start": "2024-02-15", "End": "2024-03-05"}]
+
+    results = explorer.get_cost_and_usage_for_periods(periods, include_credit=True, group_by_dimension="SERVICE")
+    assert [(r["TimePeriod"], r["Granularity"]) for r in client.requests] == [
+        (periods[0], "MONTHLY"), (periods[1], "MONTHLY"),
+    ]
+    assert cost_report.CostRowStore.from_results([results[0]], ["SERVICE"]).to_dict()["Amazon EC2"] == pytest.approx(10.0)
+    assert cost_report.CostRowStore.from_results([results[1]], ["SERVICE"]).to_dict()["Amazon EC2"] == pytest.approx(19.0)
+
+    client.requests.clear()
+    planner = cost_report.QueryPlanner(explorer)
+    for period in periods:
+        planner.add(explorer._build_request(period, True, ["SERVICE"], granularity="DAILY"))
+    results = [future.result() for future in planner.execute()]
+    assert [(r["TimePeriod"], r["Granularity"]) for r in client.requests] == [
+        ({"Start": "2024-02-10", "End": "2024-03-05"}, "DAILY"),
+    ]
+    assert cost_report.CostRowStore.from_results([results[1]], ["SERVICE"]).to_dict()["Amazon EC2"] == pytest.approx(19.0)
+
+    planner = cost_report.QueryPlanner(explorer)
+    planner.add(explorer._build_request({"Start": "2024-01-01", "End": "2024-02-01"}, True, ["SERVICE"]))
+    planner.add(explorer._build_request({"Start": "2024-02-01", "End": "2024-03-01"}, False, ["SERVICE"]))
+    planner.add(explorer._build_request({"Start": "2024-02-01", "End": "2024-03-01"}, True, ["SERVICE"], "DAILY"))
+    assert len(planner.plan()) == 3
+
+
+@pytest.mark.parametrize("periods, expected_pages", [
+    # 月の途中で区切られた期間はまとめない (DAILY にするとページ数が増えるため)
+    ([("2024-01-01", "2024-01-20"), ("2024-01-10", "2024-02-05"), ("2024-02-01", "2024-02-15")], 12),
+    # 月初で区切られた期間は MONTHLY のまま1回にまとめても、ページ数は個別に呼び出した場合と同じ
+    ([("2024-01-01", "2024-02-01"), ("2024-02-01", "2024-03-01"), ("2024-03-01", "2024-03-15")], 9),
+])
+def test_query_planner_never_increases_page_requests(periods, expected_pages):
+    """
+    グループ数が多い (複数ページの) リクエストをまとめても、課金対象のページの呼び出し数が
+    個別に呼び出した場合より増えず、stats がページ数を数えるかをテスト。
+    """
+    client = ce_synthetic.SyntheticCostExplorer(group_count=300, page_size=100)
+    explorer = cost_report.CostExplorer(client)
+    planner = cost_report.QueryPlanner(explorer)
+    for start, end in periods:
+        planner.add(explorer._build_request({"Start": start, "End": end}, True, ["SERVICE"]))
+    for future in planner.execute():
+        future.result()
+
+    assert client.call_count == expected_pages
+    assert planner.stats == {"requests": expected_pages, "calls": expected_pages, "saved": 0}
+
+
+def test_handle_combined_cost_report(explorer, mock_ce_client, sample_record_type_response):
+    """
+    1回のAPI呼び出しでクレジット適用後/適用前の両レポートが作成されるかをテスト。
+    """
+    mock_ce_client.get_cost_and_usage.return_value = sample_record_type_response
+    period = {"Start": "2024-12-01", "End": "2024-12-28"}
+
+    (title_after, services_after), (title_before, services_before) = (
+        cost_report.handle_combined_cost_report(explorer, period, "12/01", "12/27")
+    )
+
+    mock_ce_client.get_cost_and_usage.assert_called_once()
+    assert title_after == "12/01～12/27のクレジット適用後費用は、23.45 USD です。"
+    assert services_after == ["- Amazon S3: 23.45 USD"]
+    assert title_before == "12/01～12/27のクレジット適用前費用は、133.45 USD です。"
+    assert services_before == ["- Amazon EC2: 110.00 USD", "- Amazon S3: 23.45 USD"]
+
+
+def test_iter_cost_and_usage_follows_next_page_token(explorer, mock_ce_client):
+    """
+    NextPageToken をたどって全ページのグループを取得できるかをテスト。
+    """
+    period = {"Start": "2024-12-01", "End": "2024-12-28"}
+
+    def page(service, amount, token=None):
+        response = {
+            "ResultsByTime": [
+                {
+                    "TimePeriod": period,
+                    "Total": {},
+                    "Groups": [
+                        {"Keys": [service], "Metrics": {cost_report.COST_METRIC: {"Amount": amount}}}
+                    ]
+                }
+            ]
+        }
+        if token:
+            response["NextPageToken"] = token
+        return response
+
+    mock_ce_client.get_cost_and_usage.side_effect = [
+        page("Amazon EC2", "100.0", token="page-2"),
+        page("Amazon S3", "23.45", token="page-3"),
+        page("AWS Lambda", "1.5"),
+    ]
+
+    pages = explorer.iter_cost_and_usage(period, include_credit=True, group_by_dimension="SERVICE")
+    service_costs = list(explorer.get_service_costs(pages))
+
+    assert [item["service_name"] for item in service_costs] == ["Amazon EC2", "Amazon S3", "AWS Lambda"]
+    assert mock_ce_client.get_cost_and_usage.call_count == 3
+    tokens = [c.kwargs.get("NextPageToken") for c in mock_ce_client.get_cost_and_usage.call_args_list]
+    assert tokens == [None, "page-2", "page-3"]
+
+
+def test_get_cost_and_usage_merges_pages(explorer, mock_ce_client):
+    """
+    get_cost_and_usage が全ページのグループを結合し、合計費用が欠落しないかをテスト。
+    """
+    period = {"Start": "2024-12-01", "End": "2024-12-28"}
+    mock_ce_client.get_cost_and_usage.side_effect = [
+        {
+            "ResultsByTime": [{
+                "TimePeriod": period, "Total": {},
+                "Groups": [{"Keys": ["Amazon EC2"], "Metrics": {cost_report.COST_METRIC: {"Amount": "100.0"}}}]
+            }],
+            "NextPageToken": "page-2",
+        },
+        {
+            "ResultsByTime": [{
+                "TimePeriod": period, "Total": {},
+                "Groups": [{"Keys": ["Amazon S3"], "Metrics": {cost_report.COST_METRIC: {"Amount": "23.45"}}}]
+            }],
+        },
+    ]
+
+    resp = explorer.get_cost_and_usage(period, include_credit=True, group_by_dimension="SERVICE")
+
+    assert len(resp["Groups"]) == 2
+    assert explorer.get_total_cost(resp) == pytest.approx(123.45)
+
+
+def test_response_cache_hit_skips_api_call(mock_ce_client, sample_cost_response, tmp_path):
+    """
+    同一リクエストの2回目はキャッシュから返し、APIを呼び出さないかをテスト。
+    """
+    cache = cost_report.ResponseCache(str(tmp_path))
+    explorer = cost_report.CostExplorer(mock_ce_client, cache=cache)
+    mock_ce_client.get_cost_and_usage.return_value = sample_cost_response
+    period = {"Start": "2024-12-01", "End": "2024-12-28"}
+
+    first = explorer.get_cost_and_usage(period, include_credit=True, group_by_dimension="SERVICE")
+    second = explorer.get_cost_and_usage(period, include_credit=True, group_by_dimension="SERVICE")
+    explorer.get_cost_and_usage(period, include_credit=False, group_by_dimension="SERVICE")
+
+    assert first == second
+    assert mock_ce_client.get_cost_and_usage.call_count == 2
+    assert cache.stats["hits"] == 1
+    assert cache.stats["misses"] == 2
+
+
+def test_response_cache_ttl(tmp_path):
+    """
+    締め済みの月は無期限、当月を含む期間はTTL付きでキャッシュされるかをテスト。
+    """
+    cache = cost_report.ResponseCache(str(tmp_path), ttl_seconds=60)
+    closed = {"TimePeriod": {"Start": "2024-11-01", "End": "2024-12-01"}}
+    current = {"TimePeriod": {"Start": cost_report.get_date_range()[0], "End": "9999-12-31"}}
+
+    assert cache.ttl_for(closed) is None
+    assert cache.ttl_for(current) == 60
+
+    key = cache.make_key(current)
+    cache.put_page(key, 0, {"ResultsByTime": []})
+    cache.commit(key, ttl_seconds=-1)
+    assert cache.get(key) is None
+
+
+def test_response_cache_eviction(tmp_path):
+    """
+    合計サイズが上限を超えた場合に、最終参照が古いエントリから削除されるかをテスト。
+    """
+    cache = cost_report.ResponseCache(str(tmp_path), max_bytes=350)
+    body = {"ResultsByTime": [{"Groups": [], "Padding": "x" * 100}]}
+    for i in range(3):
+        key = cache.make_key({"TimePeriod": {"Start": f"2024-0{i + 1}-01", "End": "2024-10-01"}})
+        cache.put_page(key, 0, body)
+        cache.commit(key, ttl_seconds=None)
+
+    assert cache.stats["evictions"] == 1
+    oldest = cache.make_key({"TimePeriod": {"Start": "2024-01-01", "End": "2024-10-01"}})
+    assert cache.get(oldest) is None
+
+
+def test_response_cache_resolves_namespace_only_when_needed(tmp_path):
+    """
+    同じリクエストの有効なエントリがなければ namespace (アカウントID) を待たずにキャッシュなしとし、
+    保存する時点と、エントリがある場合の参照時にだけ namespace を解決するかをテスト。
+    """
+    calls = []
+
+    def account_id():
+        calls.append(1)
+        return "123456789012"
+
+    cache = cost_report.ResponseCache(str(tmp_path), namespace=account_id)
+    request = {"TimePeriod": {"Start": "2024-01-01", "End": "2024-02-01"}, "Granularity": "MONTHLY"}
+    assert cache.lookup(request) is None
+    assert calls == []
+
+    key = cache.make_key(request)
+    cache.put_page(key, 0, {"ResultsByTime": [{"Page": 0}]})
+    cache.commit(key, ttl_seconds=None, request=request)
+    assert calls == [1]
+    assert [response["ResultsByTime"] for response in cache.lookup(request)] == [[{"Page": 0}]]
+    cache.close()
+
+    # 別のアカウントのキャッシュは、エントリがあっても参照しない
+    other = cost_report.ResponseCache(str(tmp_path), namespace=lambda: "210987654321")
+    assert other.lookup(request) is None
+    assert other.stats == {"hits": 0, "misses": 1, "stores": 0, "evictions": 0}
+    other.close()
+
+
+def test_response_cache_upgrades_previous_schema(tmp_path):
+    """
+    request_key の列がない以前のキャッシュファイルも開けるかをテスト。
+    """
+    import sqlite3
+
+    conn = sqlite3.connect(str(tmp_path / cost_report.CACHE_DB_FILENAME))
+    conn.execute(
+        "CREATE TABLE entries (key TEXT PRIMARY KEY, size INTEGER NOT NULL,"
+        " expires_at REAL, last_access REAL NOT NULL)"
+    )
+    conn.execute("INSERT INTO entries VALUES ('old', 1, NULL, 0)")
+    conn.commit()
+    conn.close()
+
+    cache = cost_report.ResponseCache(str(tmp_path))
+    request = {"TimePeriod": {"Start": "2024-01-01", "End": "2024-02-01"}}
+    assert cache.lookup(request) is None
+    key = cache.make_key(request)
+    cache.put_page(key, 0, {"ResultsByTime": []})
+    cache.commit(key, ttl_seconds=None, request=request)
+    assert list(cache.lookup(request)) == [{"ResultsByTime": []}]
+    cache.close()
+
+
+def test_response_cache_survives_concurrent_eviction(tmp_path):
+    """
+    get() の後に別の接続がエントリを削除しても、取得済みのページを最後まで返すかをテスト。
+    また、ページが欠けたエントリはキャッシュなしとして扱うかをテスト。
+    """
+    cache = cost_report.ResponseCache(str(tmp_path))
+    other = cost_report.ResponseCache(str(tmp_path), max_bytes=0)
+    key = cache.make_key({"TimePeriod": {"Start": "2024-01-01", "End": "2024-02-01"}})
+    for page in range(3):
+        cache.put_page(key, page, {"ResultsByTime": [{"Page": page}]})
+    cache.commit(key, ttl_seconds=None)
+
+    pages = cache.get(key)
+    assert next(pages)["ResultsByTime"] == [{"Page": 0}]
+    # 別の接続 (上限0) の保存で全エントリが削除される
+    other_key = other.make_key({"TimePeriod": {"Start": "2024-02-01", "End": "2024-03-01"}})
+    other.put_page(other_key, 0, {"ResultsByTime": []})
+    other.commit(other_key, ttl_seconds=None)
+    assert [response["ResultsByTime"] for response in pages] == [[{"Page": 1}], [{"Page": 2}]]
+    assert cache.get(key) is None
+
+    for page in range(3):
+        cache.put_page(key, page, {"ResultsByTime": [{"Page": page}]})
+    cache.commit(key, ttl_seconds=None)
+    other._conn.execute("DELETE FROM pages WHERE key = ? AND page = 1", (key,))
+    other._conn.commit()
+    assert cache.get(key) is None
+    other.close()
+    cache.close()
+
+
+def make_daily_response(days):
+    """
+    DAILY 粒度・SERVICE と RECORD_TYPE でグルーピングしたレスポンスを作成する。
+    """
+    return {
+        "ResultsByTime": [
+            {
+                "TimePeriod": {"Start": day, "End": day},
+                "Total": {},
+                "Groups": [
+                    {"Keys": ["Amazon EC2", "Usage"], "Metrics": {cost_report.COST_METRIC: {"Amount": "10.0"}}},
+                    {"Keys": ["Amazon EC2", "Credit"], "Metrics": {cost_report.COST_METRIC: {"Amount": "-4.0"}}},
+                ]
+            }
+            for day in days
+        ]
+    }
+
+
+def test_handle_incremental_cost_report(explorer, mock_ce_client, tmp_path):
+    """
+    2回目の実行では再計上期間の日だけを DAILY 粒度で取得し、当月累計をストアから集計するかをテスト。
+    """
+    store = cost_report.DailyCostStore(str(tmp_path))
+    period = {"Start": "2024-12-01", "End": "2024-12-06"}
+    mock_ce_client.get_cost_and_usage.return_value = make_daily_response(
+        ["2024-12-01", "2024-12-02", "2024-12-03", "2024-12-04", "2024-12-05"]
+    )
+
+    (title_after, _), (title_before, services_before) = cost_report.handle_incremental_cost_report(
+        explorer, store, period, "12/01", "12/05", restatement_days=2
+    )
+
+    assert mock_ce_client.get_cost_and_usage.call_args.kwargs["TimePeriod"] == period
+    assert mock_ce_client.get_cost_and_usage.call_args.kwargs["Granularity"] == "DAILY"
+    assert title_after.endswith("30.00 USD です。")
+    assert title_before.endswith("50.00 USD です。")
+    assert services_before == ["- Amazon EC2: 50.00 USD"]
+
+    # 翌日の実行: 未取得の 12/06 と再計上期間の 12/05 だけを取得する
+    period = {"Start": "2024-12-01", "End": "2024-12-07"}
+    mock_ce_client.get_cost_and_usage.return_value = make_daily_response(["2024-12-05", "2024-12-06"])
+
+    (title_after, _), _ = cost_report.handle_incremental_cost_report(
+        explorer, store, period, "12/01", "12/06", restatement_days=2
+    )
+
+    assert mock_ce_client.get_cost_and_usage.call_args.kwargs["TimePeriod"] == {
+        "Start": "2024-12-05", "End": "2024-12-07"
+    }
+    assert title_after.endswith("36.00 USD です。")
+
+
+def test_daily_cost_store_refetches_missing_days(tmp_path):
+    """
+    取得済みの日に欠けがある場合、その日から取得し直すかをテスト。
+    """
+    store = cost_report.DailyCostStore(str(tmp_path))
+    store.replace_days("2024-12-03", "2024-12-06", {})
+
+    assert store.get_fetch_start("2024-12-01", "2024-12-06", restatement_days=1) == "2024-12-01"
+    store.replace_days("2024-12-01", "2024-12-03", {})
+    assert store.get_fetch_start("2024-12-01", "2024-12-06", restatement_days=1) == "2024-12-05"
+
+
+def test_anomaly_detector_flags_spike_and_persists_state(tmp_path):
+    """
+    学習期間後の急増を検知し、状態と反映済みの日が次回の実行に引き継がれるかをテスト。
+    """
+    detector = cost_report.AnomalyDetector(str(tmp_path), namespace="123456789012")
+    start = datetime(2024, 11, 1)
+    for offset in range(14):
+        day = (start + timedelta(days=offset)).strftime("%Y-%m-%d")
+        assert detector.update(day, {"Amazon EC2": 10.0 + offset % 3, "Amazon S3": 1.0}) == []
+
+    anomalies = detector.update("2024-11-15", {"Amazon EC2": 50.0, "Amazon S3": 1.0})
+    assert [item["service_name"] for item in anomalies] == ["Amazon EC2"]
+    assert anomalies[0]["expected"] == pytest.approx(11.0, abs=1.0)
+    detector.save()
+    detector.close()
+
+    reopened = cost_report.AnomalyDetector(str(tmp_path), namespace="123456789012")
+    assert reopened.get_fetch_start("2024-11-20") == "2024-11-16"
+    assert reopened.states["Amazon EC2"]["days"] == 15
+    assert reopened.update("2024-11-15", {"Amazon EC2": 500.0}) == []
+    assert cost_report.AnomalyDetector(str(tmp_path), namespace="other").get_fetch_start("2024-11-29") == "2024-11-01"
+
+
+def test_build_anomaly_section(explorer, mock_ce_client, tmp_path):
+    """
+    直近 restatement_days 日を除いた未反映の日だけを DAILY 粒度で取得し、検知したサービスを
+    区分として返すかをテスト。計上途中 (Estimated) の日は状態に反映しない。
+    """
+    detector = cost_report.AnomalyDetector(str(tmp_path), min_increase=5.0)
+    days = [(datetime(2024, 11, 1) + timedelta(days=offset)).strftime("%Y-%m-%d") for offset in range(30)]
+    response = make_daily_response(days)
+    response["ResultsByTime"][27]["Groups"][0]["Metrics"][cost_report.COST_METRIC]["Amount"] = "80.0"
+    response["ResultsByTime"][28]["Estimated"] = True
+    response["ResultsByTime"][28]["Groups"][0]["Metrics"][cost_report.COST_METRIC]["Amount"] = "0.5"
+    mock_ce_client.get_cost_and_usage.return_value = response
+
+    section = cost_report.build_anomaly_section(explorer, detector, "2024-12-01", restatement_days=2)
+
+    assert mock_ce_client.get_cost_and_usage.call_args.kwargs["TimePeriod"] == {
+        "Start": "2024-11-01", "End": "2024-11-29"
+    }
+    assert detector.last_day == "2024-11-28"
+    assert detector.states["Amazon EC2"]["days"] == 28
+    assert section["anomalies"][0]["billing"] == pytest.approx(80.0)
+    title, lines = cost_report.section_to_report(section)
+    assert title == "日次費用の急増を検知したサービスが 1 件あります。"
+    assert lines[0].startswith("- Amazon EC2 (2024-11-28): 80.00 USD")
+
+    # 反映済みの日しかなければ API を呼び出さない
+    mock_ce_client.get_cost_and_usage.reset_mock()
+    assert cost_report.build_anomaly_section(explorer, detector, "2024-12-01", restatement_days=2) is None
+    mock_ce_client.get_cost_and_usage.assert_not_called()
+
+
+@patch.object(cost_report.boto3, "client")
+def test_main_reuses_given_client_and_account_id(mock_boto3_client):
+    """
+    client, account_id を渡した場合はクライアント作成と STS 呼び出しを行わないかをテスト。
+    """
+    ce_client = MagicMock()
+    ce_client.get_cost_and_usage.return_value = {
+        "ResultsByTime": [{"Total": {}, "Groups": []}]
+    }
+
+    with patch.dict(os.environ, {"USE_TEAMS_POST": "no"}, clear=True):
+        with patch.object(cost_report, "print_report") as mock_print:
+            cost_report.main(client=ce_client, account_id="123456789012")
+
+    mock_boto3_client.assert_not_called()
+    ce_client.get_cost_and_usage.assert_called_once()
+    assert mock_print.call_args_list[0].args[0].startswith("AWSアカウント 123456789012\n")
+
+
+@pytest.mark.parametrize("storage_env", [{}, {"CE_CACHE_DIR": "cache"}, {"EXPORT_DIR": "export"}])
+@patch.object(cost_report.boto3, "client")
+def test_main_overlaps_sts_and_cost_explorer_calls(mock_boto3_client, storage_env, tmp_path):
+    """
+    STS と Cost Explorer の呼び出しが並行して行われ、フェーズごとの処理時間が返るかをテスト。
+    キャッシュ・出力先をアカウントIDで分ける CE_CACHE_DIR・EXPORT_DIR の場合も並行して行うかを確認する。
+    """
+    def slow_cost_and_usage(**kwargs):
+        time.sleep(0.2)
+        return {"ResultsByTime": [{"Total": {}, "Groups": []}]}
+
+    def slow_caller_identity():
+        time.sleep(0.2)
+        return {"Account": "123456789012"}
+
+    ce_client = MagicMock()
+    ce_client.get_cost_and_usage.side_effect = slow_cost_and_usage
+    mock_boto3_client.return_value.get_caller_identity.side_effect = slow_caller_identity
+
+    env = {"USE_TEAMS_POST": "no", **{key: str(tmp_path / value) for key, value in storage_env.items()}}
+    with patch.dict(os.environ, env, clear=True):
+        with patch.object(cost_report, "print_report"):
+            summary = cost_report.main(client=ce_client)
+
+    assert summary["account_id"] == "123456789012"
+    phases = summary["phases"]
+    assert phases["sts"]["start_ms"] < phases["cost_query"]["end_ms"]
+    assert phases["cost_query"]["start_ms"] < phases["sts"]["end_ms"]
+    assert summary["overlap_ms"] > 100
+    assert summary["total_ms"] < 380
+
+
+def test_split_hourly_periods_by_14_days():
+    """
+    HOURLY の期間が14日以下ごとの UTC の日時に分割されるかをテスト。
+    """
+    assert cost_report.split_hourly_periods("2024-03-01", "2024-03-31") == [
+        {"Start": "2024-03-01T00:00:00Z", "End": "2024-03-15T00:00:00Z"},
+        {"Start": "2024-03-15T00:00:00Z", "End": "2024-03-29T00:00:00Z"},
+        {"Start": "2024-03-29T00:00:00Z", "End": "2024-03-31T00:00:00Z"},
+    ]
+    assert cost_report.split_hourly_periods("2024-03-01", "2024-03-01") == []
+
+
+def test_hourly_aggregator_matches_full_matrix():
+    """
+    時間 × サービスの表を作らずに求めた合計・ピーク・p95 が、全ての値を並べた場合と一致するかをテスト。
+    """
+    hours = [f"2024-03-{1 + h // 24:02d}T{h % 24:02d}:00:00Z" for h in range(72)]
+    rng = random.Random(0)
+    matrix = {name: [0.0] * len(hours) for name in ("A", "B", "C")}
+    aggregator = cost_report.HourlyAggregator(len(hours))
+    for index, hour in enumerate(hours):
+        for name in matrix:
+            # 行のない時間 (0) と負の値 (クレジット) を混ぜる
+            if rng.random() < 0.3:
+                continue
+            amount = round(rng.uniform(-1, 10), 2)
+            matrix[name][index] = amount
+            aggregator.add(hour, name, amount)
+
+    results = {item["name"]: item for item in aggregator.results()}
+    for name, values in matrix.items():
+        ordered = sorted(values)
+        assert results[name]["total"] == pytest.approx(sum(values))
+        assert results[name]["p95"] == pytest.approx(ordered[math.ceil(0.95 * len(values)) - 1])
+        assert results[name]["peak"] == pytest.approx(max(values))
+        assert results[name]["peak_hour"] == hours[values.index(max(values))]
+
+
+def test_build_hourly_section_streams_chunks():
+    """
+    時間別の区分が14日ごとのリクエストに分けて取得され、ピークと p95 の行を持つかをテスト。
+    """
+    client = ce_synthetic.ThrottlingClient(ce_synthetic.SyntheticCostExplorer(group_count=30, page_size=500))
+    scheduler = cost_report.ce_scheduler.RequestScheduler(rate_per_second=1e9, burst=10**6)
+    explorer = cost_report.CostExplorer(client, scheduler=scheduler)
+
+    section = cost_report.build_hourly_section(explorer, "2024-03-01", "2024-03-21", "03/01", "03/20", top_n=5)
+
+    assert {call["Granularity"] for call in client.calls} == {"HOURLY"}
+    assert sorted({(call["TimePeriod"]["Start"], call["TimePeriod"]["End"]) for call in client.calls}) == [
+        ("2024-03-01T00:00:00Z", "2024-03-15T00:00:00Z"), ("2024-03-15T00:00:00Z", "2024-03-21T00:00:00Z"),
+    ]
+    # 14日 × 24時間 × 30グループ = 10080 件 (21ページ) と 6日分 (9ページ)
+    assert len(client.calls) == 30
+    assert section["title"].startswith("03/01～03/20の時間別 (UTC) のクレジット適用前費用です。 ピークは ")
+    assert len(section["hourly"]) == 5
+    assert section["lines"][0].startswith(f"- {section['hourly'][0]['name']}: 合計 ")
+    assert " / p95 " in section["lines"][0]
+    assert section["lines"][-1].startswith("- その他 (25件):")
+
+
+MULTI_METRICS = ["AmortizedCost", "UnblendedCost", "UsageQuantity"]
+MULTI_METRIC_PERIOD = {"Start": "2024-12-01", "End": "2024-12-28"}
+
+
+def multi_metric_group(keys, amortized, unblended, usage):
+    return {"Keys": keys, "Metrics": {
+        "AmortizedCost": {"Amount": str(amortized), "Unit": "USD"},
+        "UnblendedCost": {"Amount": str(unblended), "Unit": "USD"},
+        "UsageQuantity": {"Amount": str(usage), "Unit": "N/A"},
+    }}
+
+
+def test_multi_metric_extraction_in_one_pass():
+    """
+    複数のメトリクスをリクエストの Metrics にまとめ、合計とサービス別の値を全て読み取れるかをテスト。
+    """
+    explorer = cost_report.CostExplorer(MagicMock(), metrics=MULTI_METRICS)
+    data = {
+        "Total": {},
+        "Groups": [
+            multi_metric_group(["Amazon EC2"], 10.0, 12.0, 100.0),
+            multi_metric_group(["Amazon S3"], 2.0, 2.5, 40.0),
+        ],
+    }
+
+    assert explorer._build_request(MULTI_METRIC_PERIOD, include_credit=True)["Metrics"] == MULTI_METRICS
+    assert explorer.get_total_costs(data) == pytest.approx((12.0, 14.5, 140.0))
+    assert explorer.get_total_cost(data) == pytest.approx(12.0)
+    assert list(explorer.get_service_costs(data)) == [
+        cost_records.ServiceCost("Amazon EC2", 10.0, extra_amounts=(12.0, 100.0)),
+        cost_records.ServiceCost("Amazon S3", 2.0, extra_amounts=(2.5, 40.0)),
+    ]
+
+
+def test_multi_metric_combined_sections():
+    """
+    クレジット適用後/適用前の区分が全メトリクスを合算し、表示と JSON に2つ目以降のメトリクスを含むかをテスト。
+    """
+    client = MagicMock()
+    client.get_cost_and_usage.return_value = {"ResultsByTime": [{
+        "TimePeriod": MULTI_METRIC_PERIOD,
+        "Total": {},
+        "Groups": [
+            multi_metric_group(["Amazon EC2", "Usage"], 10.0, 12.0, 100.0),
+            multi_metric_group(["Amazon EC2", "Credit"], -4.0, -4.0, 0.0),
+            multi_metric_group(["Amazon S3", "Usage"], 2.0, 2.5, 40.0),
+        ],
+    }]}
+    explorer = cost_report.CostExplorer(client, metrics=MULTI_METRICS)
+
+    after, before = cost_report.build_combined_cost_sections(explorer, MULTI_METRIC_PERIOD, "12/01", "12/27")
+
+    assert client.get_cost_and_usage.call_count == 1
+    assert client.get_cost_and_usage.call_args.kwargs["Metrics"] == MULTI_METRICS
+    assert after["total"] == pytest.approx(8.0)
+    assert after["extra_totals"] == pytest.approx([10.5, 140.0])
+    assert before["services"][0].extra_amounts == pytest.approx((12.0, 100.0))
+    assert after["title"] == (
+        "12/01～12/27のクレジット適用後費用は、8.00 USD [UnblendedCost 10.50 / UsageQuantity 140.00] です。"
+    )
+    _, lines = cost_report.section_to_report(after)
+    assert lines[0] == "- Amazon EC2: 6.00 USD [UnblendedCost 8.00 / UsageQuantity 100.00]"
+
+    body = json.loads(cost_report.renderer.JsonRenderer().render_one({"title": "t", "sections": [after]}))
+    assert body["sections"][0]["metrics"] == pytest.approx({"UnblendedCost": 10.5, "UsageQuantity": 140.0})
+    assert body["sections"][0]["services"][0]["metrics"] == pytest.approx({"UnblendedCost": 8.0, "UsageQuantity": 100.0})
+
+
+@pytest.mark.parametrize("metrics, daily_store_dir", [
+    (["AmortizedCost", "Unknown"], None),
+    (["AmortizedCost", "AmortizedCost"], None),
+    ([], None),
+    (["AmortizedCost", "UnblendedCost"], "/tmp/store"),
+])
+def test_get_cost_metrics_rejects_invalid(metrics, daily_store_dir):
+    """
+    不正なメトリクス、重複、日別のストアとの併用は ValueError になるかをテスト。
+    """
+    with pytest.raises(ValueError):
+        cost_report.get_cost_metrics({"COST_METRICS": metrics, "DAILY_STORE_DIR": daily_store_dir})
@@ -0,0 +1,82 @@
+import json
+import time
+
+import pytest
+
+# テスト対象コードをインポート
+import cost_report
+import instrumentation
+import ce_stub_server
+
+
+def test_disabled_instrumentation_is_noop():
+    """
+    無効時は何も記録せず、計測箇所のオーバーヘッドが小さいかをテスト。
+    """
+    metrics = instrumentation.configure(instrumentation.MODE_OFF)
+    assert metrics is instrumentation.NULL_INSTRUMENTATION
+    assert not metrics.enabled
+
+    iterations = 100_000
+    started = time.perf_counter()
+    for _ in range(iterations):
+        with instrumentation.current().span("x"):
+            pass
+        instrumentation.current().count("y")
+    per_call_us = (time.perf_counter() - started) / iterations * 1_000_000
+    assert per_call_us < 5
+
+
+def test_invalid_mode_is_rejected():
+    """
+    不正な METRICS_MODE は ValueError になるかをテスト。
+    """
+    with pytest.raises(ValueError):
+        instrumentation.configure("verbose")
+
+
+def test_emf_record_format(capsys):
+    """
+    EMF の1行にメトリクス定義・ディメンション・値が含まれるかをテスト。
+    """
+    metrics = instrumentation.configure(instrumentation.MODE_EMF)
+    metrics.count("ce.requests", 3)
+    with metrics.span("aggregate"):
+        pass
+    metrics.emit({"AccountId": "123456789012"})
+
+    record = json.loads(capsys.readouterr().out.strip())
+    directive = record["_aws"]["CloudWatchMetrics"][0]
+    assert directive["Namespace"] == instrumentation.EMF_NAMESPACE
+    assert directive["Dimensions"] == [["AccountId"]]
+    assert {"Name": "ce.requests", "Unit": "Count"} in directive["Metrics"]
+    assert {"Name": "aggregate.duration", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert record["AccountId"] == "123456789012"
+    assert record["ce.requests"] == 3
+
+
+def test_main_writes_json_summary(aws_env, monkeypatch, tmp_path):
+    """
+    main() の実行で各処理の時間・CE リクエスト数・サイズが JSON サマリに記録されるかをテスト。
+    """
+    summary_path = tmp_path / "metrics.jsonl"
+    with ce_stub_server.LocalCostExplorerServer(group_count=30, page_size=20, throttle_first=1) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("STS_ENDPOINT_URL", server.url)
+        monkeypatch.setenv("REPORT_OUTPUT_FILE", str(tmp_path / "report.md"))
+        monkeypatch.setenv("METRICS_MODE", "json")
+        monkeypatch.setenv("METRICS_OUTPUT_FILE", str(summary_path))
+        monkeypatch.setattr(cost_report.ce_scheduler.random, "uniform", lambda a, b: 0.0)
+
+        cost_report.main()
+
+    summary = json.loads(summary_path.read_text(encoding="utf-8"))
+    assert summary["AccountId"] == ce_stub_server.DEFAULT_ACCOUNT_ID
+    assert summary["counters"]["ce.requests"] == 2
+    assert summary["counters"]["ce.retries"] == 1
+    observations = summary["observations"]
+    assert observations["ce.groups"]["sum"] == 30
+    assert observations["ce.response_bytes"]["unit"] == "Bytes"
+    for name in ("get_account_id.duration", "ce.get_cost_and_usage.duration", "aggregate.duration",
+                 "render.markdown.duration", "notify.file.duration", "phase.cost_query"):
+        assert name in observations
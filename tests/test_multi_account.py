@@ -0,0 +1,119 @@
+import threading
+import time
+import pytest
+from unittest.mock import MagicMock, patch
+import botocore.exceptions
+
+# テスト対象コードをインポート
+import cost_report
+import cost_records
+import multi_account
+
+
+PERIOD = {"Start": "2024-12-01", "End": "2024-12-28"}
+
+
+def make_ce_response(amount):
+    """
+    SERVICE と RECORD_TYPE でグルーピングしたレスポンスを返す。
+    """
+    return {
+        "ResultsByTime": [
+            {
+                "TimePeriod": PERIOD,
+                "Total": {},
+                "Groups": [
+                    {"Keys": ["Amazon EC2", "Usage"], "Metrics": {cost_report.COST_METRIC: {"Amount": amount}}},
+                    {"Keys": ["Amazon EC2", "Credit"], "Metrics": {cost_report.COST_METRIC: {"Amount": "-1.0"}}},
+                ]
+            }
+        ]
+    }
+
+
+@pytest.fixture
+def mock_session_cls():
+    """
+    boto3.Session をモック化し、ce/sts クライアントを返すようにするフィクスチャ。
+    """
+    with patch.object(multi_account.boto3, "Session") as session_cls:
+        def make_session(**kwargs):
+            session = MagicMock()
+            ce_client = MagicMock()
+            ce_client.get_cost_and_usage.return_value = make_ce_response("10.0")
+            sts_client = MagicMock()
+            sts_client.assume_role.return_value = {
+                "Credentials": {"AccessKeyId": "AK", "SecretAccessKey": "SK", "SessionToken": "ST"}
+            }
+            sts_client.get_caller_identity.return_value = {"Account": "210987654321"}
+            session.client.side_effect = lambda name, **kw: ce_client if name == "ce" else sts_client
+            return session
+
+        session_cls.side_effect = make_session
+        yield session_cls
+
+
+def test_run_multi_account_report_rollup(mock_session_cls):
+    """
+    ロールARNとプロファイル名の混在で、アカウントごとの結果と合算結果が得られるかをテスト。
+    """
+    targets = ["arn:aws:iam::123456789012:role/CostReport", "billing-profile"]
+
+    result = multi_account.run_multi_account_report(targets, PERIOD, max_workers=2)
+
+    accounts = result["accounts"]
+    assert [a["account_id"] for a in accounts] == ["123456789012", "210987654321"]
+    assert all(a["error"] is None for a in accounts)
+    assert accounts[0]["total_before_credit"] == pytest.approx(10.0)
+    assert accounts[0]["total_after_credit"] == pytest.approx(9.0)
+
+    rollup = result["rollup"]
+    assert rollup["account_count"] == 2
+    assert rollup["failed_count"] == 0
+    assert rollup["total_before_credit"] == pytest.approx(20.0)
+    assert rollup["services_after_credit"] == [cost_records.ServiceCost("Amazon EC2", 18.0)]
+
+
+def test_run_account_report_assume_role_failure(mock_session_cls):
+    """
+    AssumeRole に失敗したアカウントがあっても他のアカウントの集計が継続されるかをテスト。
+    """
+    failing_sts = MagicMock()
+    failing_sts.assume_role.side_effect = botocore.exceptions.ClientError(
+        error_response={"Error": {"Code": "AccessDenied", "Message": "Access Denied"}},
+        operation_name="AssumeRole"
+    )
+    with patch.object(multi_account, "_get_worker_sts_client", return_value=failing_sts):
+        result = multi_account.run_multi_account_report(
+            ["arn:aws:iam::123456789012:role/CostReport", "billing-profile"], PERIOD
+        )
+
+    assert "ロール" in result["accounts"][0]["error"]
+    assert result["accounts"][1]["error"] is None
+    assert result["rollup"]["account_count"] == 1
+    assert result["rollup"]["failed_count"] == 1
+
+
+def test_run_multi_account_report_runs_concurrently():
+    """
+    スレッドプールのサイズ分だけ並行実行されるかをテスト。
+    """
+    active = 0
+    peak = 0
+    lock = threading.Lock()
+
+    def slow_report(target, period):
+        nonlocal active, peak
+        with lock:
+            active += 1
+            peak = max(peak, active)
+        time.sleep(0.05)
+        with lock:
+            active -= 1
+        return {"target": target, "account_id": target, "error": "skipped"}
+
+    with patch.object(multi_account, "run_account_report", side_effect=slow_report):
+        result = multi_account.run_multi_account_report([str(i) for i in range(8)], PERIOD, max_workers=4)
+
+    assert peak == 4
+    assert [a["target"] for a in result["accounts"]] == [str(i) for i in range(8)]
@@ -0,0 +1,143 @@
+import time
+from unittest.mock import MagicMock
+
+# テスト対象コードをインポート
+import notifier
+import renderer
+from tests.webhook_server import LocalWebhookServer
+
+
+def make_report(title, services):
+    """
+    1区分のみのレポートを作成する。
+    """
+    return {
+        "title": title,
+        "sections": [{"title": "12/01～12/27のクレジット適用後費用は、1.00 USD です。", "total": 1.0, "services": services}],
+    }
+
+
+EC2 = [{"service_name": "Amazon EC2", "billing": 1.0}]
+
+
+def test_dispatch_to_multiple_sinks(tmp_path):
+    """
+    Teams, Slack, ファイルへ全レポートが送信され、送信結果が記録されるかをテスト。
+    """
+    output = tmp_path / "report.txt"
+    with LocalWebhookServer() as teams, LocalWebhookServer() as slack:
+        dispatcher = notifier.NotificationDispatcher([
+            notifier.TeamsSink(teams.url),
+            notifier.SlackSink(slack.url),
+            notifier.FileSink(str(output)),
+        ])
+        results = dispatcher.dispatch([make_report("タイトル1", EC2), make_report("タイトル2", [])])
+        dispatcher.close()
+
+    assert all(result["delivered"] for result in results)
+    assert len(teams.requests) == 2
+    card_texts = sorted(r["attachments"][0]["content"]["body"][0]["text"] for r in teams.requests)
+    assert card_texts[0] == (
+        "## タイトル1\n\n### 12/01～12/27のクレジット適用後費用は、1.00 USD です。\n\n- Amazon EC2: 1.00 USD"
+    )
+    assert sorted(r["blocks"][0]["text"]["text"] for r in slack.requests) == ["タイトル1", "タイトル2"]
+    assert any("サービスごとの費用データはありません。" in r["text"] for r in slack.requests)
+    assert "タイトル2" in output.read_text(encoding="utf-8")
+    assert dispatcher.metrics["teams"]["delivered"] == 2
+    assert dispatcher.metrics["file"]["delivered"] == 2
+
+
+def test_dispatch_retries_with_backoff():
+    """
+    5xx 応答は再送し、4xx 応答は再送せずに失敗とするかをテスト。
+    """
+    with LocalWebhookServer(responses=[503, 502]) as retried, \
+            LocalWebhookServer(responses=[400]) as rejected:
+        dispatcher = notifier.NotificationDispatcher(
+            [notifier.TeamsSink(retried.url), notifier.SlackSink(rejected.url)],
+            backoff_seconds=0.01
+        )
+        teams_result, slack_result = dispatcher.dispatch([make_report("タイトル", [])])
+        dispatcher.close()
+
+    assert teams_result == {"sink": "teams", "delivered": True, "attempts": 3, "error": None}
+    assert slack_result["delivered"] is False
+    assert slack_result["attempts"] == 1
+    assert dispatcher.metrics["teams"]["attempts"] == 3
+    assert dispatcher.metrics["slack"]["failed"] == 1
+
+
+def test_dispatch_retries_only_undelivered_payloads():
+    """
+    複数のメッセージに分割したレポートの送信が途中で失敗した場合、送信済みのメッセージは
+    再送せず、失敗したメッセージから再送するかをテスト。
+    """
+    report = make_report("タイトル", EC2)
+    report["sections"].append({"title": "2つ目の区分", "total": 1.0, "services": EC2})
+    with LocalWebhookServer(responses=[200, 503]) as slack:
+        sink = notifier.SlackSink(slack.url)
+        single_section = sink.renderer.render({**report, "sections": report["sections"][:1]})[0]
+        sink.renderer = renderer.SlackBlocksRenderer(max_bytes=len(single_section.encode("utf-8")) + 50)
+        dispatcher = notifier.NotificationDispatcher([sink], backoff_seconds=0.01)
+        (result,) = dispatcher.dispatch([report])
+        dispatcher.close()
+
+    assert result == {"sink": "slack", "delivered": True, "attempts": 2, "error": None}
+    sent_sections = [r["blocks"][1]["text"]["text"].split("\n")[0] for r in slack.requests]
+    assert sent_sections == [
+        "*12/01～12/27のクレジット適用後費用は、1.00 USD です。*", "*2つ目の区分*", "*2つ目の区分*",
+    ]
+
+
+def test_dispatch_timeout_does_not_block_other_sinks():
+    """
+    応答の遅い通知先はタイムアウトし、他の通知先の送信は待たされないかをテスト。
+    """
+    with LocalWebhookServer(delay_seconds=1.0) as slow, LocalWebhookServer() as fast:
+        dispatcher = notifier.NotificationDispatcher(
+            [notifier.TeamsSink(slow.url, timeout=0.2), notifier.SlackSink(fast.url)],
+            max_attempts=1
+        )
+        futures = dispatcher.submit(make_report("タイトル", []))
+        started = time.perf_counter()
+        slack_result = futures[1].result()
+        assert time.perf_counter() - started < 0.5
+        teams_result = futures[0].result()
+        dispatcher.close()
+
+    assert slack_result["delivered"] is True
+    assert teams_result["delivered"] is False
+
+
+def test_sns_sink_publish():
+    """
+    SNS へ件名・本文付きで publish されるかをテスト。
+    """
+    sns_client = MagicMock()
+    sink = notifier.SnsSink("arn:aws:sns:us-east-1:123456789012:billing", client=sns_client)
+    dispatcher = notifier.NotificationDispatcher([sink])
+
+    report = make_report("AWSアカウント 123456789012", [{"service_name": "Amazon S3", "billing": 1.0}])
+    results = dispatcher.dispatch([report])
+    dispatcher.close()
+
+    assert results[0]["delivered"] is True
+    kwargs = sns_client.publish.call_args.kwargs
+    assert kwargs["TopicArn"] == "arn:aws:sns:us-east-1:123456789012:billing"
+    assert kwargs["Subject"] == "AWSアカウント 123456789012"
+    assert kwargs["Message"].endswith("- Amazon S3: 1.00 USD")
+
+
+def test_build_sinks():
+    """
+    設定に応じた通知先が作成されるかをテスト。
+    """
+    sinks = notifier.build_sinks({
+        "USE_TEAMS_POST": True,
+        "TEAMS_WEBHOOK_URL": "https://example.com/teams",
+        "SLACK_WEBHOOK_URL": None,
+        "SNS_TOPIC_ARN": "arn:aws:sns:us-east-1:123456789012:billing",
+        "REPORT_OUTPUT_FILE": "-",
+    })
+
+    assert [sink.name for sink in sinks] == ["teams", "sns", "file"]
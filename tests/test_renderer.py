@@ -0,0 +1,150 @@
+import json
+import pytest
+
+# テスト対象コードをインポート
+import renderer
+
+
+def make_report(service_count):
+    """
+    クレジット適用後/適用前の2区分を持つレポートを作成する。
+    """
+    services = [
+        {"service_name": f"Service {i:05d}", "billing": float(i + 1)}
+        for i in range(service_count)
+    ]
+    return {
+        "title": "AWSアカウント 123456789012",
+        "sections": [
+            {"title": "12/01～12/27のクレジット適用後費用は、0.00 USD です。", "total": 0.0, "services": []},
+            {"title": "12/01～12/27のクレジット適用前費用は、1.00 USD です。", "total": 1.0, "services": services},
+        ],
+    }
+
+
+def test_teams_card_contains_both_sections():
+    """
+    Teams の Adaptive Card に両区分が1通にまとめて含まれるかをテスト。
+    """
+    bodies = renderer.TeamsCardRenderer().render(make_report(2))
+
+    assert len(bodies) == 1
+    card = json.loads(bodies[0])
+    text = card["attachments"][0]["content"]["body"][0]["text"]
+    assert text == (
+        "## AWSアカウント 123456789012\n\n"
+        "### 12/01～12/27のクレジット適用後費用は、0.00 USD です。\n\nサービスごとの費用データはありません。\n\n"
+        "### 12/01～12/27のクレジット適用前費用は、1.00 USD です。\n\n"
+        "- Service 00000: 1.00 USD\n- Service 00001: 2.00 USD"
+    )
+
+
+@pytest.mark.parametrize(
+    "renderer_obj",
+    [renderer.TeamsCardRenderer(), renderer.SlackBlocksRenderer(), renderer.MarkdownRenderer(max_bytes=4096)],
+)
+def test_large_report_is_truncated_to_top_n(renderer_obj):
+    """
+    上限サイズを超えるレポートは上位N件と「その他」の行にまとめられるかをテスト。
+    """
+    bodies = renderer_obj.render(make_report(5000))
+
+    assert len(bodies) == 1
+    assert len(bodies[0].encode("utf-8")) <= renderer_obj.max_bytes
+    assert "Service 04999: 5000.00 USD" in bodies[0]
+    assert "Service 00000: 1.00 USD" not in bodies[0]
+    assert "- その他 (" in bodies[0]
+
+
+def test_others_row_sums_remaining_services():
+    """
+    「その他」の行に残りのサービス数と合計費用が表示されるかをテスト。
+    """
+    lines = renderer.section_lines(make_report(5)["sections"][1], top_n=2)
+
+    assert lines == [
+        "- Service 00004: 5.00 USD",
+        "- Service 00003: 4.00 USD",
+        "- その他 (3サービス): 6.00 USD",
+    ]
+
+
+def test_json_renderer_keeps_numeric_amounts():
+    """
+    JSON 形式では金額が数値のまま出力されるかをテスト。
+    """
+    body = json.loads(renderer.JsonRenderer().render(make_report(1))[0])
+
+    assert body["sections"][1]["total"] == 1.0
+    assert body["sections"][1]["services"] == [{"service_name": "Service 00000", "billing": 1.0}]
+
+
+def test_section_lines_include_changes():
+    """
+    比較対象の期間からの増減がサービスの行末に付くかをテスト。
+    """
+    section = {"title": "t", "total": 3.0, "services": [
+        {"service_name": "Amazon EC2", "billing": 3.0, "changes": [
+            {"label": "前月同期間", "previous": 2.0, "delta": 1.0, "percent": 50.0},
+            {"label": "前年同期間", "previous": 0.0, "delta": 3.0, "percent": None},
+        ]},
+    ]}
+
+    assert renderer.section_lines(section) == [
+        "- Amazon EC2: 3.00 USD (前月同期間比 +1.00 USD (+50.0%), 前年同期間比 +3.00 USD (新規))"
+    ]
+
+
+def test_slack_long_section_is_split_by_lines():
+    """
+    section ブロックの上限文字数を超える区分が、行の途中で切られずに複数のブロックに分けられ、
+    全てのサービスが含まれるかをテスト。
+    """
+    bodies = renderer.SlackBlocksRenderer().render(make_report(200))
+
+    assert len(bodies) == 1
+    blocks = json.loads(bodies[0])["blocks"]
+    texts = [block["text"]["text"] for block in blocks if block["type"] == "section"]
+    assert len(texts) > 2
+    assert all(len(text) <= renderer.SLACK_MAX_SECTION_CHARS for text in texts)
+    lines = [line for text in texts[1:] for line in text.split("\n")]
+    assert lines[0] == "*12/01～12/27のクレジット適用前費用は、1.00 USD です。*"
+    assert lines[1:] == [f"- Service {i:05d}: {i + 1:.2f} USD" for i in range(200)]
+
+
+def test_slack_long_title_is_truncated_in_header():
+    """
+    header ブロックの上限文字数を超える見出しが切り詰められ、text には全文が残るかをテスト。
+    """
+    title = "AWSアカウント " + "x" * 300
+    bodies = renderer.SlackBlocksRenderer().render({**make_report(2), "title": title})
+
+    message = json.loads(bodies[0])
+    header = message["blocks"][0]["text"]["text"]
+    assert len(header) == renderer.SLACK_MAX_HEADER_CHARS
+    assert header.endswith("…")
+    assert title.startswith(header[:-1])
+    assert message["text"].startswith(title)
+
+
+def test_slack_block_count_is_capped():
+    """
+    ブロック数が上限を超える場合に、区分ごとのメッセージに分けられ、各メッセージが上限以下に収まるかをテスト。
+    """
+    report = {
+        "title": "AWSアカウント 123456789012",
+        "sections": [
+            {"title": f"区分 {i}", "total": 1.0, "services": [{"service_name": "Amazon S3", "billing": 1.0}]}
+            for i in range(60)
+        ],
+    }
+    bodies = renderer.SlackBlocksRenderer().render(report)
+
+    assert len(bodies) > 1
+    messages = [json.loads(body) for body in bodies]
+    assert all(len(message["blocks"]) <= renderer.SLACK_MAX_BLOCKS for message in messages)
+    titles = [
+        block["text"]["text"].split("\n")[0]
+        for message in messages for block in message["blocks"] if block["type"] == "section"
+    ]
+    assert titles == [f"*区分 {i}*" for i in range(60)]
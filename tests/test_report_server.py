@@ -0,0 +1,177 @@
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# テスト対象コードをインポート
+import cost_report
+import ce_stub_server
+import report_server
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class ImmediateExecutor:
+    """
+    submit された処理をその場で実行する (バックグラウンドでの取り直しを決定的にする)。
+    """
+
+    def submit(self, func, *args):
+        func(*args)
+
+    def shutdown(self, wait=True):
+        pass
+
+
+def test_cache_serves_stale_value_and_refreshes_once():
+    """
+    fresh_seconds を過ぎた値は古いまま返しつつ取り直し、stale_seconds を過ぎたら取得を待つかをテスト。
+    """
+    clock = FakeClock()
+    cache = report_server.StaleWhileRevalidateCache(
+        fresh_seconds=10, stale_seconds=60, executor=ImmediateExecutor(), clock=clock
+    )
+    values = iter(["v1", "v2", "v3"])
+
+    def loader():
+        return next(values)
+
+    assert cache.get("k", loader) == "v1"
+    clock.now = 5
+    assert cache.get("k", loader) == "v1"
+    clock.now = 20
+    # 古い値を返し、裏で取り直した値を次から返す
+    assert cache.get("k", loader) == "v1"
+    assert cache.get("k", loader) == "v2"
+    clock.now = 100
+    assert cache.get("k", loader) == "v3"
+    assert cache.stats == {
+        "hits": 2, "stale_hits": 1, "misses": 2, "collapsed": 0, "refreshes": 1, "errors": 0
+    }
+
+
+def test_cache_collapses_concurrent_requests():
+    """
+    同じキーへの同時リクエストが1回の取得にまとめられ、失敗も全員に伝わるかをテスト。
+    """
+    cache = report_server.StaleWhileRevalidateCache()
+    calls = []
+    started = threading.Event()
+
+    def slow_loader():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return {"value": len(calls)}
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        first = executor.submit(cache.get, "k", slow_loader)
+        started.wait()
+        others = [executor.submit(cache.get, "k", slow_loader) for _ in range(19)]
+        results = [first.result()] + [f.result() for f in others]
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert cache.stats["collapsed"] == 19
+
+    def failing_loader():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        cache.get("other", failing_loader)
+    assert cache.stats["errors"] == 1
+    cache.close()
+
+
+def test_many_consumers_share_one_ce_call(aws_env, monkeypatch):
+    """
+    多数の利用者が同時に同じレポートを要求しても Cost Explorer の呼び出しが1回で済むかをテスト。
+    """
+    with ce_stub_server.LocalCostExplorerServer(group_count=30, latency_seconds=0.2) as stub:
+        monkeypatch.setenv("CE_ENDPOINT_URL", stub.url)
+        explorer = cost_report.CostExplorer(cost_report.get_client())
+        service = report_server.ReportService(explorer, "123456789012")
+        with report_server.ReportServer(service, port=0) as server:
+            url = f"{server.url}/report?start=2024-03-01&end=2024-03-15"
+
+            def fetch(_):
+                with urllib.request.urlopen(url) as response:
+                    return json.loads(response.read())
+
+            with ThreadPoolExecutor(max_workers=30) as executor:
+                reports = list(executor.map(fetch, range(30)))
+            with urllib.request.urlopen(f"{server.url}/report?start=2024-03-01&end=2024-03-15&format=markdown") as r:
+                markdown = r.read().decode("utf-8")
+            with urllib.request.urlopen(f"{server.url}/stats") as r:
+                stats = json.loads(r.read())
+
+    assert stub.stats["ce_calls"] == 1
+    assert len({json.dumps(report, sort_keys=True) for report in reports}) == 1
+    assert reports[0]["title"] == "AWSアカウント 123456789012"
+    assert len(reports[0]["sections"]) == 2
+    assert markdown.startswith("## AWSアカウント 123456789012")
+    assert stats["cache"]["misses"] == 1
+    assert stats["cache"]["hits"] + stats["cache"]["collapsed"] == 30
+
+
+def test_report_with_comparison_and_drilldown(aws_env, monkeypatch):
+    """
+    compare と drilldown の指定で、比較対象の期間との増減とドリルダウンの区分を返すかをテスト。
+    """
+    with ce_stub_server.LocalCostExplorerServer(group_count=200) as stub:
+        monkeypatch.setenv("CE_ENDPOINT_URL", stub.url)
+        service = report_server.ReportService(cost_report.CostExplorer(cost_report.get_client()), "123456789012")
+        report = service.get_report({
+            "start": ["2024-03-01"], "end": ["2024-03-15"],
+            "compare": ["previous_month"], "drilldown": ["SERVICE,USAGE_TYPE"], "top_n": ["2"],
+        })
+
+    after, before, drilldown = report["sections"]
+    assert after["comparisons"][0]["label"] == "前月同期間"
+    assert "changes" in after["services"][0]
+    assert "SERVICE × USAGE_TYPE" in drilldown["title"]
+    assert stub.stats["ce_calls"] == 3
+
+
+@pytest.mark.parametrize("path, status", [
+    ("/healthz", 200),
+    ("/report?start=2024-03-15&end=2024-03-01", 400),
+    ("/report?start=2024-03-01&end=2024-03-15&compare=last_week", 400),
+    ("/report?start=2024-03-01&end=2024-03-15&format=xml", 400),
+    ("/unknown", 404),
+])
+def test_handle_status(path, status):
+    """
+    不正なパラメータは 400、未知のパスは 404 を返すかをテスト。
+    """
+    service = report_server.ReportService(explorer=None, account_id="123456789012")
+    server = report_server.ReportServer(service, port=0)
+    try:
+        assert server.handle(path)[0] == status
+    finally:
+        server._server.server_close()
+
+
+def test_run_mode_server_starts_report_server(monkeypatch):
+    """
+    エントリポイントが RUN_MODE=server で常駐サーバを起動し、不正な値を拒否するかをテスト。
+    """
+    calls = []
+    monkeypatch.setattr(report_server, "serve", lambda: calls.append("serve"))
+    monkeypatch.setenv("RUN_MODE", "server")
+    cost_report.run()
+    assert calls == ["serve"]
+
+    monkeypatch.setenv("RUN_MODE", "daemon")
+    with pytest.raises(ValueError):
+        cost_report.run()
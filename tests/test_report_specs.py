@@ -0,0 +1,187 @@
+import json
+
+import pytest
+
+# テスト対象コードをインポート
+import cost_report
+import ce_stub_server
+
+
+def test_parse_report_spec_defaults_and_validation(monkeypatch):
+    """
+    省略したキーに既定値が入り、不正な指定が ValueError になるかをテスト。
+    """
+    monkeypatch.setattr(cost_report, "get_date_range", lambda: ("2024-03-01", "2024-03-15"))
+
+    spec = cost_report.parse_report_spec({"id": "a", "compare": ["previous_month"]})
+    assert spec["period"] == {"Start": "2024-03-01", "End": "2024-03-15"}
+    assert spec["dimensions"] == ["SERVICE"]
+    assert spec["credit"] == "both"
+    assert spec["sinks"] is None
+    assert spec["comparison_periods"] == [("前月同期間", {"Start": "2024-02-01", "End": "2024-02-15"})]
+
+    for invalid in [
+        "not a dict",
+        {"unknown": 1},
+        {"start": "2024-03-15", "end": "2024-03-01"},
+        {"dimensions": ["SERVICE", "USAGE_TYPE", "REGION"]},
+        {"credit": "net"},
+        {"sinks": {"email": "a@example.com"}},
+    ]:
+        with pytest.raises(ValueError):
+            cost_report.parse_report_spec(invalid)
+
+
+@pytest.mark.parametrize("event, expected", [
+    ({}, None),
+    ({"detail-type": "Scheduled Event", "detail": {}}, None),
+    ({"id": "x"}, [(None, {"id": "x"})]),
+    ({"reports": [{"id": "a"}, {"id": "b"}]}, [(None, {"id": "a"}), (None, {"id": "b"})]),
+    ({"detail": {"reports": [{"id": "a"}]}}, [(None, {"id": "a"})]),
+    ({"Records": [
+        {"messageId": "m1", "body": json.dumps({"id": "a"})},
+        {"messageId": "m2", "body": json.dumps({"reports": [{"id": "b"}, {"id": "c"}]})},
+        {"messageId": "m3", "body": "not json"},
+    ]}, [("m1", {"id": "a"}), ("m2", {"id": "b"}), ("m2", {"id": "c"}), ("m3", "not json")]),
+])
+def test_extract_report_specs(event, expected):
+    """
+    直接呼び出し・EventBridge・SQS のイベントからレポートの指定を取り出せるかをテスト。
+    """
+    assert cost_report.extract_report_specs(event) == expected
+
+
+def test_run_report_specs_shares_client_and_isolates_failures(aws_env, monkeypatch, tmp_path):
+    """
+    複数の指定を1つのクライアントで並行して実行し、指定ごとの通知先・期間・アカウントの絞り込みが
+    反映され、不正な指定が他の指定に影響しないかをテスト。
+    """
+    monkeypatch.setattr(cost_report, "get_date_range", lambda: ("2024-03-01", "2024-03-15"))
+    team_a, team_b = tmp_path / "a.md", tmp_path / "b.md"
+    specs = [
+        ("m1", {"id": "a", "accounts": ["111111111111"], "credit": "after",
+                "sinks": {"output_file": str(team_a)}}),
+        ("m1", {"id": "b", "dimensions": ["SERVICE", "USAGE_TYPE"], "credit": "before",
+                "compare": ["previous_month"], "sinks": {"output_file": str(team_b)}}),
+        ("m2", {"id": "c", "credit": "net"}),
+        ("m3", {"id": "d", "start": "2024-01-01", "end": "2024-02-01", "sinks": {}}),
+    ]
+    with ce_stub_server.LocalCostExplorerServer(group_count=100) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        results = cost_report.run_report_specs(specs, cost_report.get_client(), "123456789012")
+
+    assert [(r["id"], r["status"], r["sections"]) for r in results] == [
+        ("a", "ok", 1), ("b", "ok", 2), ("c", "error", 0), ("d", "ok", 2),
+    ]
+    assert "credit" in results[2]["error"]
+
+    filters = [r["params"].get("Filter") for r in server.requests]
+    assert {"Dimensions": {"Key": "LINKED_ACCOUNT", "Values": ["111111111111"]}} in filters
+    # d (1月) と b の比較対象 (2/1～2/14) は隣接するため、1回の MONTHLY の呼び出しにまとめられる
+    periods = sorted(
+        (r["params"]["TimePeriod"]["Start"], r["params"]["TimePeriod"]["End"], r["params"]["Granularity"])
+        for r in server.requests
+    )
+    assert periods == [
+        ("2024-01-01", "2024-02-15", "MONTHLY"),
+        ("2024-03-01", "2024-03-15", "MONTHLY"),
+        ("2024-03-01", "2024-03-15", "MONTHLY"),
+        ("2024-03-01", "2024-03-15", "MONTHLY"),
+    ]
+
+    text_a = team_a.read_text(encoding="utf-8")
+    assert text_a.startswith("## AWSアカウント 123456789012 (リンクアカウント 111111111111)")
+    assert "クレジット適用前" not in text_a
+    text_b = team_b.read_text(encoding="utf-8")
+    assert "前月同期間比" in text_b and "SERVICE × USAGE_TYPE" in text_b
+
+
+def test_parse_report_spec_rejects_non_list_fields():
+    """
+    accounts・dimensions・compare が文字列のリスト以外の場合に ValueError になるかをテスト。
+    """
+    for invalid in [
+        {"accounts": "123456789012"},
+        {"accounts": [123456789012]},
+        {"dimensions": "SERVICE"},
+        {"compare": "previous_month"},
+    ]:
+        with pytest.raises(ValueError, match="文字列のリスト"):
+            cost_report.parse_report_spec(invalid)
+
+
+def test_run_report_specs_isolates_botocore_errors(aws_env, monkeypatch, tmp_path):
+    """
+    1件の指定の取得がタイムアウト (BotoCoreError) しても、その指定だけが失敗となり、
+    他の指定は通知されるかをテスト。
+    """
+    import botocore.exceptions
+
+    monkeypatch.setattr(cost_report, "get_date_range", lambda: ("2024-03-01", "2024-03-15"))
+
+    class TimeoutClient:
+        def __init__(self, client):
+            self.client = client
+
+        def get_cost_and_usage(self, **params):
+            if "222222222222" in json.dumps(params.get("Filter", {})):
+                raise botocore.exceptions.ReadTimeoutError(endpoint_url="http://localhost")
+            return self.client.get_cost_and_usage(**params)
+
+    delivered = tmp_path / "ok.md"
+    specs = [
+        ("m1", {"id": "ok", "accounts": ["111111111111"], "sinks": {"output_file": str(delivered)}}),
+        ("m2", {"id": "timeout", "accounts": ["222222222222"], "sinks": {"output_file": str(tmp_path / "ng.md")}}),
+    ]
+    with ce_stub_server.LocalCostExplorerServer(group_count=10) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        client = TimeoutClient(cost_report.get_client())
+        results = cost_report.run_report_specs(specs, client, "123456789012")
+
+    assert [(r["id"], r["status"]) for r in results] == [("ok", "ok"), ("timeout", "error")]
+    assert "Read timeout" in results[1]["error"]
+    assert delivered.read_text(encoding="utf-8").startswith("## AWSアカウント 123456789012")
+    assert not (tmp_path / "ng.md").exists()
+
+
+def test_run_report_specs_isolates_unexpected_errors(aws_env, monkeypatch, tmp_path):
+    """
+    不正なレスポンス (KeyError) や通知先の作成の失敗 (TypeError) など、想定外の例外も
+    その指定だけの失敗となり、他の指定は通知されるかをテスト。
+    """
+    monkeypatch.setattr(cost_report, "get_date_range", lambda: ("2024-03-01", "2024-03-15"))
+
+    class BrokenClient:
+        def __init__(self, client):
+            self.client = client
+
+        def get_cost_and_usage(self, **params):
+            if "222222222222" in json.dumps(params.get("Filter", {})):
+                return {"NextPageToken": None}
+            return self.client.get_cost_and_usage(**params)
+
+    create_dispatcher = cost_report.create_dispatcher
+
+    def broken_dispatcher(config):
+        if config["REPORT_OUTPUT_FILE"] and config["REPORT_OUTPUT_FILE"].endswith("broken.md"):
+            raise TypeError("unsupported sink")
+        return create_dispatcher(config)
+
+    monkeypatch.setattr(cost_report, "create_dispatcher", broken_dispatcher)
+    delivered = tmp_path / "ok.md"
+    specs = [
+        ("m1", {"id": "ok", "accounts": ["111111111111"], "sinks": {"output_file": str(delivered)}}),
+        ("m2", {"id": "bad_response", "accounts": ["222222222222"], "sinks": {}}),
+        ("m3", {"id": "bad_sink", "accounts": ["111111111111"],
+                "sinks": {"output_file": str(tmp_path / "broken.md")}}),
+    ]
+    with ce_stub_server.LocalCostExplorerServer(group_count=10) as server:
+        monkeypatch.setenv("CE_ENDPOINT_URL", server.url)
+        results = cost_report.run_report_specs(specs, BrokenClient(cost_report.get_client()), "123456789012")
+
+    assert [(r["source"], r["status"], r["sections"]) for r in results] == [
+        ("m1", "ok", 2), ("m2", "error", 0), ("m3", "error", 0),
+    ]
+    assert results[1]["error"].startswith("KeyError")
+    assert results[2]["error"] == "TypeError: unsupported sink"
+    assert delivered.read_text(encoding="utf-8").startswith("## AWSアカウント 123456789012")
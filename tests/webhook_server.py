@@ -0,0 +1,53 @@
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Sequence
+
+
+class LocalWebhookServer:
+    """
+    テスト用のローカル Webhook。受信した JSON を requests に記録する。
+
+    responses に HTTP ステータスコードを並べると、その順に応答する (尽きたら 200)。
+    delay_seconds を指定すると応答前に待機する。
+    """
+
+    def __init__(self, responses: Sequence[int] = (), delay_seconds: float = 0.0) -> None:
+        self.requests: List[Dict[str, Any]] = []
+        self._responses = list(responses)
+        self._delay_seconds = delay_seconds
+        self._lock = threading.Lock()
+        owner = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with owner._lock:
+                    owner.requests.append(json.loads(body or b"null"))
+                    status = owner._responses.pop(0) if owner._responses else 200
+                time.sleep(owner._delay_seconds)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/webhook"
+
+    def __enter__(self) -> "LocalWebhookServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._server.shutdown()
+        self._server.server_close()